@@ -1,19 +1,51 @@
 import os
+import hmac
 import shutil
 import json
-import tempfile
+import asyncio
+import threading
+import time
 import traceback
-import zipfile
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from typing import List, Optional, Dict, Any, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
 
 # Import our local tool modules
-from modules import image_tools, pdf_tools, pdf_editor
+from modules import image_tools, pdf_tools, pdf_editor, worker_pool, jobs, lazy_imports, zip_stream, workspace, uploads
+from modules import metrics, pdf_sessions, result_cache, tracing, model_registry, inference
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+def start_worker_pool():
+    # CPU-bound actions run in warm worker processes (WORKER_PROCESSES, WORKER_MAX_TASKS)
+    worker_pool.start()
+    # Per-request temp directories with a quota and a TTL janitor (WORKSPACE_*)
+    workspace.start()
+    # Async jobs (/api/jobs/*) run on their own bounded pool of runners
+    jobs.init()
+    # Thread-pool actions run in this process; load their deferred imports while idle
+    threading.Thread(target=lazy_imports.prewarm, name="prewarm", daemon=True).start()
+    # remove_bg/upscale run here only without a worker pool (workers load MODEL_PREWARM themselves)
+    if worker_pool.WORKER_PROCESSES <= 0:
+        threading.Thread(target=model_registry.prewarm, name="model-prewarm", daemon=True).start()
+    # Scrape-time gauges for /metrics
+    metrics.register_stats("worker_pool", worker_pool.stats)
+    metrics.register_stats("jobs", lambda: {**{state: 0 for state in (jobs.QUEUED, jobs.RUNNING, jobs.SUCCEEDED, jobs.FAILED)}, **jobs.stats()}, label="state")
+    metrics.register_stats("workspace", workspace.stats, counters=("admitted", "rejected", "waited", "expired", "evicted"))
+    metrics.register_stats("pdf_sessions", pdf_sessions.stats)
+    metrics.register_stats("result_cache", lambda: {k: v for k, v in result_cache.stats().items() if k in ("entries", "bytes", "max_bytes")})
+    metrics.register_collector(lambda: model_registry.metric_families(_live_pids()))
+    metrics.register_stats("inference", inference.stats, counters=("requests", "batches", "fallbacks"))
+
+
+@app.on_event("shutdown")
+def stop_worker_pool():
+    jobs.shutdown()
+    worker_pool.shutdown()
+
 # CORS Configuration - Security Hardened
 # In production, restrict to specific domains
 # In development, allow localhost for testing
@@ -44,10 +76,13 @@ app.add_middleware(
     allow_credentials=allow_credentials,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "Server-Timing"],
 )
 
-TEMP_DIR = os.path.join(tempfile.gettempdir(), "offline_tools_api")
+# Phase timings per request: Server-Timing header plus one JSON log line (see modules/tracing.py)
+app.add_middleware(tracing.TracingMiddleware)
+
+TEMP_DIR = workspace.WORKSPACE_DIR
 os.makedirs(TEMP_DIR, exist_ok=True)
 
 # File upload size limits (in bytes) - Web version only
@@ -57,75 +92,109 @@ MAX_PDF_SIZE = 20 * 1024 * 1024    # 20MB for PDFs (web)
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # Default: 50MB (fallback)
 MAX_TOTAL_SIZE = int(os.getenv("MAX_TOTAL_SIZE", "104857600"))  # Default: 100MB for multiple files
 
-def validate_file_size(file: UploadFile) -> None:
-    """Validates that the uploaded file size is within limits based on file type (web version)."""
-    if not hasattr(file, 'size') or not file.size:
-        return
-    
-    # Determine file type from content type or filename
-    content_type = file.content_type or ""
-    filename = file.filename or ""
-    
-    # Check if it's an image
-    is_image = (
-        content_type.startswith("image/") or
-        any(filename.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.heic', '.heif'])
-    )
-    
-    # Check if it's a PDF
-    is_pdf = (
-        content_type == "application/pdf" or
-        filename.lower().endswith('.pdf')
-    )
-    
-    # Set appropriate limit based on file type
-    if is_image:
-        max_size = MAX_IMAGE_SIZE
-        limit_text = "20MB"
-    elif is_pdf:
-        max_size = MAX_PDF_SIZE
-        limit_text = "20MB"
-    else:
-        # Fallback to default for unknown types
-        max_size = MAX_FILE_SIZE
-        limit_text = f"{MAX_FILE_SIZE / 1024 / 1024:.0f}MB"
-    
-    if file.size > max_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File size ({file.size / 1024 / 1024:.2f}MB) exceeds maximum allowed size ({limit_text}) for web version. Please use the desktop app for larger files."
-        )
+# Enables admin-only features (job profiling) for requests sending it as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
-def save_upload(file: UploadFile) -> str:
-    """Saves an uploaded file to a specific temp path and returns the path."""
-    # Validate file size
-    validate_file_size(file)
+def require_admin(request: Request) -> None:
+    """Rejects the request unless X-Admin-Token matches ADMIN_TOKEN (always, when ADMIN_TOKEN is unset)."""
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
-    safe_name = "".join([c for c in file.filename if c.isalpha() or c.isdigit() or c in "._-"]) if file.filename else "unknown"
-    path = os.path.join(TEMP_DIR, safe_name)
-    # Ensure unique if conflict? Overwrite for now is simpler for MVPs.
-    with open(path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return path
-
-async def save_upload_file(upload_file: UploadFile) -> str:
-    """Saves an uploaded file (async version matching server.py)."""
+def upload_limit(mime: Optional[str]) -> Tuple[int, str]:
+    """
+    Returns (max bytes, human-readable limit) for an upload (web version).
+    mime is sniffed from the file's magic bytes (uploads.sniff), not taken from
+    the client's content type or file name, so a large image can't claim the
+    fallback limit by being sent as something else.
+    """
+    if mime and mime.startswith("image/"):
+        return MAX_IMAGE_SIZE, "20MB"
+    if mime == "application/pdf":
+        return MAX_PDF_SIZE, "20MB"
+    # Fallback to default for other types (Office documents, archives, unrecognized)
+    return MAX_FILE_SIZE, f"{MAX_FILE_SIZE / 1024 / 1024:.0f}MB"
+
+def _too_large(size: int, limit_text: str) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File size ({size / 1024 / 1024:.2f}MB) exceeds maximum allowed size ({limit_text}) for web version. Please use the desktop app for larger files."
+    )
+
+def validate_file_size(file: UploadFile) -> Tuple[int, str]:
+    """
+    Validates the declared upload size against the limit for the file's sniffed
+    type (web version). Returns that limit for the copy to enforce.
+    """
+    max_size, limit_text = upload_limit(uploads.sniff_stream(file.file))
+    if getattr(file, "size", None) and file.size > max_size:
+        raise _too_large(file.size, limit_text)
+    return max_size, limit_text
+
+async def _save(file: UploadFile, directory: str, name: Optional[str] = None) -> str:
+    """Chunked copy with inline hashing; the size limit is enforced while copying."""
+    # Reject early when the declared size is already known to be too large
+    max_size, limit_text = validate_file_size(file)
     try:
-        # Validate file size
-        validate_file_size(upload_file)
+        with tracing.span("upload"):
+            saved = await uploads.save(file, directory, name=name, max_bytes=max_size)
+    except uploads.UploadTooLargeError as e:
+        raise _too_large(e.size_bytes, limit_text)
+    return saved.path
+
+async def save_upload(file: UploadFile, directory: str = TEMP_DIR) -> str:
+    """Saves an uploaded file under its (sanitized) original name and returns the path."""
+    safe_name = "".join([c for c in file.filename if c.isalpha() or c.isdigit() or c in "._-"]) if file.filename else "unknown"
+    return await _save(file, directory, name=safe_name)
 
-        suffix = os.path.splitext(upload_file.filename)[1] if upload_file.filename else ""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=TEMP_DIR) as tmp:
-            shutil.copyfileobj(upload_file.file, tmp)
-            return tmp.name
+async def save_upload_file(upload_file: UploadFile, directory: str = TEMP_DIR) -> str:
+    """Saves an uploaded file under a unique temp name and returns the path."""
+    try:
+        return await _save(upload_file, directory)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def zip_response(files: List[str], zip_filename: str) -> StreamingResponse:
+    """Stream several result files as one zip archive, built while it is sent."""
+    return StreamingResponse(
+        tracing.timed_iter(zip_stream.iter_zip(files), "zip"),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{zip_filename}"'}
+    )
+
+async def admit_workspace(request: Request) -> workspace.Workspace:
+    """
+    Creates a temp directory for the request (see modules/workspace.py), sized by its body.
+    Waits while temp storage is full and answers 503 if no space frees up.
+    The caller releases it.
+    """
+    # Form parameters of the endpoint have been read by now
+    tracing.mark("receive")
+    try:
+        upload_bytes = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        upload_bytes = 0
+
+    try:
+        with tracing.span("admit"):
+            return await workspace.acquire(upload_bytes)
+    except workspace.WorkspaceFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+async def request_workspace(request: Request):
+    """Dependency that gives the request its own temp directory, released when the request ends."""
+    ws = await admit_workspace(request)
+    try:
+        yield ws
+    finally:
+        # Outputs stay on disk for the response and expire after WORKSPACE_TTL
+        workspace.release(ws)
+
 from fastapi.concurrency import run_in_threadpool
 
-async def process_request(module_name: str, action: str, request: Request):
+async def process_request(module_name: str, action: str, request: Request, ws: workspace.Workspace):
     """
     Generic handler that parses JSON payload (from body or form-data)
     and merges it with file uploads, then dispatches to the module.
@@ -136,7 +205,8 @@ async def process_request(module_name: str, action: str, request: Request):
     content_type = request.headers.get("content-type", "")
 
     if "multipart/form-data" in content_type:
-        form = await request.form()
+        with tracing.span("receive"):
+            form = await request.form()
 
         # 1. Parse the JSON payload
         if "__payload_json" in form:
@@ -152,7 +222,7 @@ async def process_request(module_name: str, action: str, request: Request):
 
             if isinstance(value, UploadFile):
                 # Save file
-                path = save_upload(value)
+                path = await save_upload(value, ws.path)
                 if key not in uploaded_files:
                     uploaded_files[key] = []
                 uploaded_files[key].append(path)
@@ -187,16 +257,16 @@ async def process_request(module_name: str, action: str, request: Request):
             if not hasattr(image_tools, "handle_image_action"):
                  raise HTTPException(status_code=500, detail="image_tools module missing dispatcher")
 
-            # Run CPU-bound task in threadpool
-            result = await run_in_threadpool(image_tools.handle_image_action, action, payload)
+            # Run CPU-bound task in a worker process or the threadpool
+            result = await worker_pool.run_action("image_tools", action, payload)
             return {"status": "success", "data": result}
 
         elif module_name == "pdf_tools":
              if not hasattr(pdf_tools, "handle_pdf_action"):
                  raise HTTPException(status_code=500, detail="pdf_tools module missing dispatcher")
 
-             # Run CPU-bound task in threadpool
-             result = await run_in_threadpool(pdf_tools.handle_pdf_action, action, payload)
+             # Run CPU-bound task in a worker process or the threadpool
+             result = await worker_pool.run_action("pdf_tools", action, payload)
              return {"status": "success", "data": result}
 
         else:
@@ -213,13 +283,14 @@ async def process_request(module_name: str, action: str, request: Request):
 
 
 @app.post("/image_tools/{action}")
-async def handle_image_tools(action: str, request: Request):
-    return await process_request("image_tools", action, request)
+async def handle_image_tools(action: str, request: Request, ws: workspace.Workspace = Depends(request_workspace)):
+    return await process_request("image_tools", action, request, ws)
 
 
 @app.post("/api/image/{action}")
 async def image_endpoint(
     action: str,
+    ws: workspace.Workspace = Depends(request_workspace),
     files: List[UploadFile] = File(...),
     watermark_type: Optional[str] = Form(None),
     text: Optional[str] = Form(None),
@@ -255,12 +326,12 @@ async def image_endpoint(
 
     saved_files = []
     for f in files:
-        saved_files.append(await save_upload_file(f))
+        saved_files.append(await save_upload_file(f, ws.path))
 
     # Save watermark file if present
     saved_watermark_file = None
     if watermark_file:
-        saved_watermark_file = await save_upload_file(watermark_file)
+        saved_watermark_file = await save_upload_file(watermark_file, ws.path)
 
     payload = {
         "files": saved_files,
@@ -295,7 +366,7 @@ async def image_endpoint(
             pass
 
     try:
-        result = await run_in_threadpool(image_tools.handle_image_action, action, payload)
+        result = await worker_pool.run_action("image_tools", action, payload)
 
         # Special Case: Palette Extraction returns JSON, not file
         if action == "extract_palette":
@@ -320,15 +391,7 @@ async def image_endpoint(
             return FileResponse(processed_files[0], filename=os.path.basename(processed_files[0]))
         else:
             zip_filename = f"processed_images_{action}.zip"
-            zip_path = os.path.join(TEMP_DIR, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file in processed_files:
-                    zipf.write(file, os.path.basename(file))
-            return FileResponse(
-                zip_path, 
-                filename=zip_filename,
-                media_type="application/zip"
-            )
+            return zip_response(processed_files, zip_filename)
 
     except HTTPException as he:
         raise he
@@ -337,13 +400,14 @@ async def image_endpoint(
 
 
 @app.post("/pdf_tools/{action}")
-async def handle_pdf_tools(action: str, request: Request):
-    return await process_request("pdf_tools", action, request)
+async def handle_pdf_tools(action: str, request: Request, ws: workspace.Workspace = Depends(request_workspace)):
+    return await process_request("pdf_tools", action, request, ws)
 
 
 @app.post("/api/pdf/{action}")
 async def pdf_endpoint(
     action: str,
+    ws: workspace.Workspace = Depends(request_workspace),
     files: List[UploadFile] = File(...),
     output_name: Optional[str] = Form(None),
     output_format: Optional[str] = Form(None),
@@ -380,16 +444,16 @@ async def pdf_endpoint(
 
     saved_files = []
     for f in files:
-        saved_files.append(await save_upload_file(f))
+        saved_files.append(await save_upload_file(f, ws.path))
 
     # Save watermark file if present
     saved_watermark_file = None
     if watermark_file:
-        saved_watermark_file = await save_upload_file(watermark_file)
+        saved_watermark_file = await save_upload_file(watermark_file, ws.path)
 
     saved_cert_file = None
     if cert_file:
-        saved_cert_file = await save_upload_file(cert_file)
+        saved_cert_file = await save_upload_file(cert_file, ws.path)
 
     payload = {
         "files": saved_files,
@@ -431,7 +495,7 @@ async def pdf_endpoint(
             payload["action"] = preview_action
 
     try:
-        result = await run_in_threadpool(pdf_tools.handle_pdf_action, action, payload)
+        result = await worker_pool.run_action("pdf_tools", action, payload)
 
         if result.get("errors"):
             # Format errors as user-friendly messages
@@ -458,16 +522,7 @@ async def pdf_endpoint(
         else:
             # Create zip
             zip_filename = f"processed_files_{action}.zip"
-            zip_path = os.path.join(TEMP_DIR, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file in processed_files:
-                    zipf.write(file, os.path.basename(file))
-
-            return FileResponse(
-                zip_path, 
-                filename=zip_filename,
-                media_type="application/zip"
-            )
+            return zip_response(processed_files, zip_filename)
 
     except HTTPException as he:
         raise he
@@ -477,17 +532,66 @@ async def pdf_endpoint(
 
 
 # --- PDF Editor Endpoints ---
+# Every endpoint accepts either an uploaded "file" or the "doc_id" of a session
+# created with /api/pdf-editor/open, which avoids re-uploading the PDF per call.
+
+async def _editor_payload(file: Optional[UploadFile], doc_id: Optional[str], ws: workspace.Workspace) -> Dict[str, Any]:
+    """Builds the pdf_editor payload from either a session id or an uploaded file."""
+    if doc_id:
+        return {"doc_id": doc_id}
+    if file is None:
+        raise HTTPException(status_code=400, detail="Either file or doc_id is required")
+    return {"file": await save_upload(file, ws.path)}
+
+
+def _raise_for_editor_error(result: Dict[str, Any]) -> None:
+    if "error" in result:
+        status_code = 404 if result.get("code") == "SESSION_NOT_FOUND" else 400
+        raise HTTPException(status_code=status_code, detail=result["error"])
+
+
+@app.post("/api/pdf-editor/open")
+async def pdf_editor_open(request: Request, file: UploadFile = File(...)):
+    """Open a PDF as an editor session and return its doc_id with the document info"""
+    # The session outlives the request, so it holds its workspace (and quota) until it is closed
+    ws = await admit_workspace(request)
+    try:
+        file_path = await save_upload_file(file, ws.path)
+        result = await run_in_threadpool(pdf_editor.open_session, {
+            "file": file_path,
+            "on_close": lambda: workspace.release(ws),
+        })
+        _raise_for_editor_error(result)
+
+        return {"status": "success", "data": result}
+
+    except HTTPException:
+        workspace.release(ws)
+        raise
+    except Exception as e:
+        workspace.release(ws)
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/pdf-editor/close")
+async def pdf_editor_close(doc_id: str = Form(...)):
+    """Close an editor session"""
+    result = pdf_editor.close_session({"doc_id": doc_id})
+    return {"status": "success", "data": result}
+
 
 @app.post("/api/pdf-editor/info")
-async def pdf_editor_get_info(file: UploadFile = File(...)):
+async def pdf_editor_get_info(
+    file: Optional[UploadFile] = File(None),
+    doc_id: Optional[str] = Form(None),
+    ws: workspace.Workspace = Depends(request_workspace)
+):
     """Get PDF document information (page count, dimensions)"""
     try:
-        file_path = save_upload(file)
-        payload = {"file": file_path}
-        result = pdf_editor.get_pdf_info(payload)
-
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
+        payload = await _editor_payload(file, doc_id, ws)
+        result = await run_in_threadpool(pdf_editor.get_pdf_info, payload)
+        _raise_for_editor_error(result)
 
         return {"status": "success", "data": result}
 
@@ -500,22 +604,19 @@ async def pdf_editor_get_info(file: UploadFile = File(...)):
 
 @app.post("/api/pdf-editor/render")
 async def pdf_editor_render_page(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    doc_id: Optional[str] = Form(None),
+    ws: workspace.Workspace = Depends(request_workspace),
     page: int = Form(0),
     dpi: int = Form(150)
 ):
     """Render a specific PDF page to image"""
     try:
-        file_path = save_upload(file)
-        payload = {
-            "file": file_path,
-            "page": page,
-            "dpi": dpi
-        }
-        result = pdf_editor.render_pdf_page(payload)
-
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
+        payload = await _editor_payload(file, doc_id, ws)
+        payload["page"] = page
+        payload["dpi"] = dpi
+        result = await run_in_threadpool(pdf_editor.render_pdf_page, payload)
+        _raise_for_editor_error(result)
 
         return {"status": "success", "data": result}
 
@@ -527,15 +628,16 @@ async def pdf_editor_render_page(
 
 
 @app.post("/api/pdf-editor/load-annotations")
-async def pdf_editor_load_annotations(file: UploadFile = File(...)):
+async def pdf_editor_load_annotations(
+    file: Optional[UploadFile] = File(None),
+    doc_id: Optional[str] = Form(None),
+    ws: workspace.Workspace = Depends(request_workspace)
+):
     """Load existing annotations from a PDF"""
     try:
-        file_path = save_upload(file)
-        payload = {"file": file_path}
-        result = pdf_editor.load_annotations(payload)
-
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
+        payload = await _editor_payload(file, doc_id, ws)
+        result = await run_in_threadpool(pdf_editor.load_annotations, payload)
+        _raise_for_editor_error(result)
 
         return {"status": "success", "data": result}
 
@@ -548,13 +650,15 @@ async def pdf_editor_load_annotations(file: UploadFile = File(...)):
 
 @app.post("/api/pdf-editor/save")
 async def pdf_editor_save_annotations(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    doc_id: Optional[str] = Form(None),
+    ws: workspace.Workspace = Depends(request_workspace),
     annotations: str = Form(...),
     flatten: bool = Form(False)
 ):
     """Save annotations to PDF and return the file"""
     try:
-        file_path = save_upload(file)
+        payload = await _editor_payload(file, doc_id, ws)
 
         # Parse annotations JSON
         try:
@@ -562,21 +666,19 @@ async def pdf_editor_save_annotations(
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid annotations JSON")
 
-        # Generate output path
-        base, ext = os.path.splitext(file_path)
-        output_path = f"{base}_annotated{ext}"
+        # Write the output into the request workspace: it is removed after the
+        # response, and concurrent saves of one session don't share a file
+        session = pdf_sessions.get_session(doc_id) if doc_id else None
+        source = session.file_path if session is not None else payload.get("file")
+        if source:
+            base, ext = os.path.splitext(os.path.basename(source))
+            payload["output"] = os.path.join(ws.path, f"{base}_annotated{ext}")
 
-        payload = {
-            "file": file_path,
-            "output": output_path,
-            "annotations": annotations_data,
-            "flatten": flatten
-        }
+        payload["annotations"] = annotations_data
+        payload["flatten"] = flatten
 
-        result = pdf_editor.save_annotations(payload)
-
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
+        result = await run_in_threadpool(pdf_editor.save_annotations, payload)
+        _raise_for_editor_error(result)
 
         output_file = result.get("output_file")
         if not output_file or not os.path.exists(output_file):
@@ -597,7 +699,7 @@ async def pdf_editor_save_annotations(
 
 
 @app.post("/api/py-invoke")
-async def handle_py_invoke(request: Request):
+async def handle_py_invoke(request: Request, ws: workspace.Workspace = Depends(request_workspace)):
     """
     Unified endpoint that matches frontend expectations.
     Handles both JSON and FormData requests.
@@ -607,7 +709,8 @@ async def handle_py_invoke(request: Request):
 
         if "multipart/form-data" in content_type:
             # FormData mode - frontend sends module, action, and files
-            form = await request.form()
+            with tracing.span("receive"):
+                form = await request.form()
 
             module = form.get("module")
             action = form.get("action")
@@ -625,7 +728,7 @@ async def handle_py_invoke(request: Request):
                     continue
 
                 if isinstance(value, UploadFile):
-                    path = save_upload(value)
+                    path = await save_upload(value, ws.path)
                     if key not in uploaded_files:
                         uploaded_files[key] = []
                     uploaded_files[key].append(path)
@@ -665,12 +768,12 @@ async def handle_py_invoke(request: Request):
         if module == "image_tools":
             if not hasattr(image_tools, "handle_image_action"):
                 raise HTTPException(status_code=500, detail="image_tools module missing dispatcher")
-            result = await run_in_threadpool(image_tools.handle_image_action, action, payload)
+            result = await worker_pool.run_action("image_tools", action, payload)
             return {"status": "success", "data": result}
         elif module == "pdf_tools":
             if not hasattr(pdf_tools, "handle_pdf_action"):
                 raise HTTPException(status_code=500, detail="pdf_tools module missing dispatcher")
-            result = await run_in_threadpool(pdf_tools.handle_pdf_action, action, payload)
+            result = await worker_pool.run_action("pdf_tools", action, payload)
             return {"status": "success", "data": result}
         else:
             raise HTTPException(status_code=404, detail=f"Module '{module}' not found")
@@ -686,6 +789,215 @@ async def handle_py_invoke(request: Request):
             content={"status": "error", "error": "An internal error occurred during processing."}
         )
 
+# --- Async Job Endpoints ---
+# Long-running actions (ocr_pdf, extract_tables, ...) can exceed proxy timeouts
+# when run inside the request. A job returns its id at once; clients then poll
+# the status, follow /events (Server-Sent Events) and fetch /result when done.
+
+JOB_MODULES = {"pdf": "pdf_tools", "image": "image_tools"}
+# Single-path payload keys; every other uploaded key becomes a list of paths
+SINGLE_FILE_KEYS = ("file", "watermark_file", "cert_file")
+# Free-text form fields (str in the /api/pdf and /api/image signatures); never JSON-decoded,
+# so a password "1234" or watermark text "2024" stays a string
+TEXT_FORM_FIELDS = frozenset({
+    "output_name", "output_format", "mode", "pages", "watermark_type", "text", "color", "position",
+    "x", "y", "password", "language", "libreoffice_path", "page_order", "target_format", "country",
+})
+
+
+def _job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["id"],
+        "module": job["module"],
+        "action": job["action"],
+        "state": job["state"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+def _get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/api/jobs/{module}/{action}")
+async def submit_job(module: str, action: str, request: Request):
+    """
+    Queue an action and return its job id immediately.
+    Accepts the same multipart form as /api/pdf and /api/image: uploaded files
+    plus form fields. Free-text fields (TEXT_FORM_FIELDS) stay strings; the
+    others are decoded as JSON when they parse, e.g. "2" -> 2 or a steps list.
+    Admins can send X-Profile: cprofile|sample to profile the action; the
+    profile is kept with the job (GET /api/jobs/{id}/profile).
+    """
+    module_name = JOB_MODULES.get(module)
+    if module_name is None:
+        raise HTTPException(status_code=404, detail=f"Module '{module}' not found")
+
+    profile = request.headers.get("x-profile")
+    if profile:
+        require_admin(request)
+        if profile not in tracing.PROFILE_MODES:
+            raise HTTPException(status_code=400, detail=f"X-Profile must be one of {', '.join(tracing.PROFILE_MODES)}")
+
+    try:
+        upload_bytes = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        upload_bytes = 0
+    try:
+        await workspace.wait_for_space(upload_bytes * workspace.RESERVE_FACTOR)
+    except workspace.WorkspaceFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    with tracing.span("receive"):
+        form = await request.form()
+    job_id, job_dir = jobs.new_job_dir()
+
+    try:
+        payload: Dict[str, Any] = {}
+        uploaded_files: Dict[str, List[str]] = {}
+        for key, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                uploaded_files.setdefault(key, []).append(await save_upload_file(value, job_dir))
+            elif key in TEXT_FORM_FIELDS:
+                payload[key] = value
+            else:
+                try:
+                    payload[key] = json.loads(value)
+                except (json.JSONDecodeError, TypeError):
+                    payload[key] = value
+
+        for key, paths in uploaded_files.items():
+            payload[key] = paths[0] if key in SINGLE_FILE_KEYS else paths
+
+        if not payload.get("files") and not payload.get("file"):
+            raise HTTPException(status_code=400, detail="No files uploaded")
+
+        # Same conventions as /api/pdf/{action}
+        if module_name == "pdf_tools" and action in ("split", "preview") and payload.get("files"):
+            payload.setdefault("file", payload["files"][0])
+            if action == "preview":
+                payload["action"] = payload.get("mode") or "preview"
+
+        jobs.submit(job_id, module_name, action, payload, profile=profile)
+    except jobs.JobQueueFullError:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=503, detail="Too many queued jobs, please retry later")
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    return JSONResponse(status_code=202, content={"status": "success", "job_id": job_id, "state": jobs.QUEUED})
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Current state and progress of a job."""
+    return _job_response(_get_job_or_404(job_id))
+
+
+@app.get("/api/jobs/{job_id}/profile")
+async def job_profile(job_id: str, request: Request, format: str = "txt"):
+    """Profile of a job submitted with X-Profile (admin only): txt summary, pstats or folded stacks."""
+    require_admin(request)
+    _get_job_or_404(job_id)
+    path = os.path.join(jobs.job_dir(job_id), f"profile.{format}")
+    if format not in ("txt", "pstats", "folded") or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No profile for this job")
+    if format == "txt":
+        return FileResponse(path, media_type="text/plain")
+    return FileResponse(path, filename=f"{job_id}.{format}")
+
+
+def _live_pids():
+    return [os.getpid(), *worker_pool.worker_pids()]
+
+
+@app.get("/api/models")
+async def loaded_models(request: Request):
+    """ML models loaded in this process and in the worker processes (admin only)."""
+    require_admin(request)
+    return {"models": model_registry.all_models(_live_pids()), "max_bytes_per_process": model_registry.MODEL_CACHE_BYTES}
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events stream of progress updates, ending with a "done" event."""
+    _get_job_or_404(job_id)
+
+    async def event_stream():
+        last_snapshot = None
+        last_sent = time.monotonic()
+        while True:
+            job = jobs.get(job_id)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Job not found\"}\n\n"
+                return
+
+            snapshot = (job["state"], job["progress"], job["message"])
+            if snapshot != last_snapshot:
+                last_snapshot = snapshot
+                last_sent = time.monotonic()
+                yield f"event: progress\ndata: {json.dumps(_job_response(job))}\n\n"
+
+            if job["state"] in jobs.TERMINAL_STATES:
+                yield f"event: done\ndata: {json.dumps(_job_response(job))}\n\n"
+                return
+
+            # Comment lines keep idle connections open through proxies
+            if time.monotonic() - last_sent > 15:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Artifacts of a finished job: a file, a zip of several files, or JSON for data-only actions."""
+    job = _get_job_or_404(job_id)
+
+    if job["state"] == jobs.FAILED:
+        raise HTTPException(status_code=400, detail=job["error"] or "Processing failed")
+    if job["state"] != jobs.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['state']}")
+
+    result = job["result"] or {}
+    processed_files = [f for f in result.get("processed_files", []) if os.path.exists(f)]
+
+    if not processed_files:
+        if result.get("processed_files"):
+            raise HTTPException(status_code=410, detail="Job artifacts are no longer available")
+        return result
+
+    if len(processed_files) == 1:
+        return FileResponse(processed_files[0], filename=os.path.basename(processed_files[0]))
+
+    return zip_response(processed_files, f"processed_files_{job['action']}.zip")
+
+
+@app.delete("/api/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Delete a finished job and its files."""
+    _get_job_or_404(job_id)
+    if not jobs.delete(job_id):
+        raise HTTPException(status_code=409, detail="Job is still running")
+    return {"status": "success"}
+
+
 # --- Licensing Endpoints ---
 from modules import licensing
 
@@ -742,7 +1054,13 @@ async def update_subscription(request: Request):
 
 @app.get("/")
 def health_check():
-    return {"status": "online", "mode": "web-api"}
+    return {"status": "online", "mode": "web-api", "temp_storage": workspace.stats()}
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of per-action timings and counters plus pool, job and storage gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,91 @@
+"""
+Benchmark: desktop sidecar cold start.
+
+Measures, each in a fresh interpreter:
+  - importing the heavy dependencies eagerly (what every tool-module import cost before)
+  - importing pdf_tools and image_tools now that those dependencies are deferred
+  - time from launching main.py to the first license-check response on stdout
+and finally prints the deferred-import profile after a pre-warm.
+
+Usage (from python-backend/):
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What pdf_tools.py and image_tools.py used to import at module level
+EAGER_IMPORTS = (
+    "import fitz, pypdf, pdfplumber, pandas, pikepdf, numpy; "
+    "from PIL import Image, ImageChops, ImageOps, ImageDraw, ImageFont, ImageEnhance, ImageFilter; "
+    "from pyhanko.sign import signers, fields; "
+    "from pillow_heif import register_heif_opener; register_heif_opener()"
+)
+TOOL_IMPORTS = "from modules import pdf_tools, image_tools"
+
+
+def _timed_python(code, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def first_response_ms(runs):
+    """Launch main.py and time the first licensing.status result line."""
+    env = {**os.environ, "BACKEND_PREWARM": "0"}
+    request = json.dumps({"request_id": "bench", "module": "licensing", "action": "status", "payload": {}})
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "main.py"], cwd=BACKEND_DIR, env=env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        proc.stdin.write(request + "\n")
+        proc.stdin.flush()
+        for line in proc.stdout:
+            if json.loads(line).get("request_id") == "bench":
+                break
+        samples.append((time.perf_counter() - start) * 1000)
+        proc.stdin.close()
+        proc.wait()
+    return samples
+
+
+def prewarm_report():
+    sys.path.insert(0, BACKEND_DIR)
+    from modules import pdf_tools, image_tools, lazy_imports  # noqa: F401
+    lazy_imports.prewarm()
+    return lazy_imports.report()
+
+
+def _summary(samples_ms):
+    return f"mean {statistics.mean(samples_ms):8.1f} ms   min {min(samples_ms):8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"({args.runs} runs each, times include interpreter start-up)")
+    print(f"  before: eager dependency imports   {_summary(_timed_python(EAGER_IMPORTS, args.runs))}")
+    print(f"  after:  import tool modules        {_summary(_timed_python(TOOL_IMPORTS, args.runs))}")
+    print(f"  main.py first license response     {_summary(first_response_ms(args.runs))}")
+    print()
+    print("Deferred-import profile after pre-warm:")
+    print(prewarm_report())
+
+
+if __name__ == "__main__":
+    main()
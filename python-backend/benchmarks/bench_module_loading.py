@@ -0,0 +1,84 @@
+"""
+Benchmark: per-request module loading overhead of the stdin bridge.
+
+Compares the old behaviour of main.load_module (importlib.reload on every
+request) with the cached registry, and measures the one-off cold import cost
+in a fresh interpreter.
+
+Usage (from python-backend/):
+    python benchmarks/bench_module_loading.py
+    python benchmarks/bench_module_loading.py --module image_tools --requests 50
+"""
+
+import argparse
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("BACKEND_HOT_RELOAD", "false")
+
+import main  # noqa: E402
+
+
+def _summary(samples_ms):
+    samples_ms = sorted(samples_ms)
+    p95 = samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))]
+    return f"mean {statistics.mean(samples_ms):9.3f} ms   p50 {statistics.median(samples_ms):9.3f} ms   p95 {p95:9.3f} ms"
+
+
+def cold_import_ms(dotted_name, runs):
+    """Wall time of importing the module in a fresh interpreter (includes interpreter start-up)."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {dotted_name}"], cwd=BACKEND_DIR, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def reload_per_request_ms(dotted_name, requests):
+    """Old load_module: reload the module on every request."""
+    importlib.import_module(dotted_name)
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        importlib.reload(sys.modules[dotted_name])
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def cached_per_request_ms(module_name, requests):
+    """New load_module: registry lookup after the first import."""
+    main.load_module(module_name)
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        main.load_module(module_name)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="pdf_tools", choices=sorted(main.MODULES))
+    parser.add_argument("--requests", type=int, default=20, help="Simulated requests per variant")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Fresh-interpreter imports to time")
+    args = parser.parse_args()
+
+    dotted_name = main.MODULES[args.module]
+    if not isinstance(dotted_name, str):
+        sys.exit("Run from source, not from a frozen build")
+
+    print(f"Module: {dotted_name}  ({args.requests} requests)")
+    print(f"  cold import (fresh process)   {_summary(cold_import_ms(dotted_name, args.cold_runs))}")
+    print(f"  before: reload per request    {_summary(reload_per_request_ms(dotted_name, args.requests))}")
+    print(f"  after:  cached registry       {_summary(cached_per_request_ms(args.module, args.requests))}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,101 @@
+"""
+Benchmark: OCR pages/sec per Tesseract engine and worker count.
+
+Runs ocr.iter_pages() over the same document with each engine from
+ocr_engine.py:
+
+    subprocess  one tesseract process per page (pytesseract, the old path)
+    batch       one tesseract process per OCR_BATCH_PAGES pages (list-file mode)
+    tesserocr   warm in-process APIs (skipped if tesserocr is not installed)
+
+"first page" is the time until the first page comes back: it includes the
+engine start-up and model load, which tesserocr pays once per worker
+process. Every run after the first pays no load, the way it runs in a warm
+pool worker, so pages/sec is measured on a second pass. "words" should
+match across engines; a difference means they disagree on the text.
+
+Without --pdf, a text document is generated and OCRed from its rendering
+(its text layer is ignored).
+
+Usage (from python-backend/):
+    python benchmarks/bench_ocr.py --pages 20 --workers 1 4
+    python benchmarks/bench_ocr.py --pdf scan.pdf --engines batch tesserocr --lang eng
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules import ocr, ocr_engine  # noqa: E402
+from modules.tesseract_helper import configure_tesseract  # noqa: E402
+
+SAMPLE_TEXT = (
+    "The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs. "
+    "Invoice 2024-117, due within 30 days of receipt; late payments accrue 1.5% monthly interest."
+)
+
+
+def make_sample_pdf(pages):
+    import fitz
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(60, 60, 540, 780), f"Page {n + 1}\n\n" + (SAMPLE_TEXT + "\n") * 14, fontsize=11)
+    return doc
+
+
+def run(doc, engine, workers, language, dpi):
+    """(ms until the first page, pages/sec over the document, words recognized)."""
+    start = time.perf_counter()
+    first = None
+    words = 0
+    for _, result in ocr.iter_pages(doc, language, dpi=dpi, skip_text_pages=False, workers=workers, engine=engine):
+        if first is None:
+            first = (time.perf_counter() - start) * 1000
+        words += len(result["words"])
+    elapsed = time.perf_counter() - start
+    return first, doc.page_count / elapsed, words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="Scanned PDF to OCR (default: generated text pages)")
+    parser.add_argument("--pages", type=int, default=12, help="Pages of the generated document")
+    parser.add_argument("--engines", nargs="+", default=list(ocr_engine.ENGINES))
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, ocr.OCR_WORKERS])
+    parser.add_argument("--lang", default="eng")
+    parser.add_argument("--dpi", type=int, default=ocr.OCR_DPI)
+    args = parser.parse_args()
+
+    import fitz
+    configure_tesseract()
+    doc = fitz.open(args.pdf) if args.pdf else make_sample_pdf(args.pages)
+    print(f"{doc.page_count} pages at {args.dpi} DPI, batch size {ocr_engine.OCR_BATCH_PAGES}")
+    print(f"{'engine':<11} {'workers':>7} {'first page ms':>14} {'pages/s':>9} {'words':>7}")
+
+    baseline = None
+    for name in args.engines:
+        try:
+            engine = ocr_engine.get_engine(name)
+        except ValueError as e:
+            print(f"{name:<11} skipped: {e}")
+            continue
+        for workers in args.workers:
+            try:
+                first, _, _ = run(doc, engine, workers, args.lang, args.dpi)  # cold: includes start-up
+                _, rate, words = run(doc, engine, workers, args.lang, args.dpi)
+            except ImportError as e:
+                print(f"{name:<11} skipped: {e}")
+                break
+            if baseline is None:
+                baseline = rate
+            print(f"{name:<11} {workers:>7} {first:>14.0f} {rate:>9.2f} {words:>7}  x{rate / baseline:.2f}")
+    doc.close()
+
+
+if __name__ == "__main__":
+    main()
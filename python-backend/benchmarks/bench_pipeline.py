@@ -0,0 +1,149 @@
+"""
+Benchmark: chained single actions vs. the in-memory pipeline action.
+
+Builds a sample document, then runs rotate -> crop -> watermark ->
+page_numbers -> compress twice: once as separate actions, each re-reading the
+previous step's output file, and once as a single pipeline action (one parse,
+one write). The same is done for a sample photo with resize -> watermark ->
+compress (one decode, one encode). The result cache is bypassed; the step
+functions are called directly.
+
+Usage (from python-backend/):
+    python benchmarks/bench_pipeline.py --pages 50 --megapixels 12 --runs 5
+"""
+
+import argparse
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules import image_tools, pdf_tools  # noqa: E402
+
+PDF_STEPS = [
+    {"action": "rotate", "angle": 90},
+    {"action": "crop", "x": 20, "y": 20, "width": 500, "height": 700},
+    {"action": "watermark", "text": "DRAFT", "opacity": 0.3},
+    {"action": "page_numbers", "position": "bottom-right"},
+    {"action": "compress", "level": 2},
+]
+
+PDF_ACTIONS = {
+    "rotate": pdf_tools.rotate_pdf,
+    "crop": pdf_tools.crop_pdf,
+    "watermark": pdf_tools.watermark_pdf,
+    "page_numbers": pdf_tools.add_page_numbers,
+    "compress": pdf_tools.compress_pdf,
+}
+
+IMAGE_STEPS = [
+    {"action": "resize", "width": 2000},
+    {"action": "watermark", "text": "DRAFT", "opacity": 0.3},
+    {"action": "compress", "quality": 70},
+]
+
+IMAGE_ACTIONS = {
+    "resize": image_tools.resize_images,
+    "watermark": image_tools.watermark_images,
+    "compress": image_tools.compress_images,
+}
+
+
+def make_sample_pdf(path, pages):
+    """Text pages with an embedded image each, roughly like a scanned report."""
+    fitz = pdf_tools.fitz
+    Image = pdf_tools.Image
+    img = Image.effect_noise((800, 600), 64).convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    image_bytes = buffer.getvalue()
+
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {n + 1} " + "lorem ipsum " * 20, fontsize=11)
+        page.insert_image(fitz.Rect(72, 200, 472, 500), stream=image_bytes)
+    doc.save(path)
+    doc.close()
+
+
+def make_sample_image(path, megapixels):
+    """A noisy gradient photo-sized JPEG; noise keeps the encoder honest."""
+    Image = image_tools.Image
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    Image.merge("RGB", (noise, gradient, noise)).save(path, quality=92)
+
+
+def chained_ms(source, workdir, steps, actions):
+    path = shutil.copy(source, os.path.join(workdir, "chained" + os.path.splitext(source)[1]))
+    start = time.perf_counter()
+    for step in steps:
+        params = {k: v for k, v in step.items() if k != "action"}
+        result = actions[step["action"]]({"files": [path], **params})
+        if result["errors"]:
+            raise RuntimeError(f"{step['action']}: {result['errors']}")
+        path = result["processed_files"][0]
+    return (time.perf_counter() - start) * 1000, os.path.getsize(path)
+
+
+def pipeline_ms(source, workdir, steps, run_pipeline):
+    path = shutil.copy(source, os.path.join(workdir, "pipeline" + os.path.splitext(source)[1]))
+    start = time.perf_counter()
+    result = run_pipeline({"files": [path], "steps": [dict(s) for s in steps]})
+    elapsed = (time.perf_counter() - start) * 1000
+    if result["errors"]:
+        raise RuntimeError(result["errors"])
+    return elapsed, os.path.getsize(result["processed_files"][0]), result["steps"]
+
+
+def _summary(samples_ms):
+    return f"mean {statistics.mean(samples_ms):9.1f} ms   min {min(samples_ms):9.1f} ms"
+
+
+def compare(title, source, steps, actions, run_pipeline, workdir, runs):
+    chained, piped = [], []
+    for run in range(runs):
+        run_dir = os.path.join(workdir, f"run{run}")
+        os.makedirs(run_dir)
+        ms, chained_size = chained_ms(source, run_dir, steps, actions)
+        chained.append(ms)
+        ms, piped_size, step_times = pipeline_ms(source, run_dir, steps, run_pipeline)
+        piped.append(ms)
+
+    print(f"{title}, {' -> '.join(s['action'] for s in steps)} ({runs} runs)")
+    print(f"  chained actions   {_summary(chained)}   output {chained_size} bytes")
+    print(f"  pipeline          {_summary(piped)}   output {piped_size} bytes")
+    print(f"  speed-up          {statistics.mean(chained) / statistics.mean(piped):.1f}x")
+    print("  pipeline steps (last run): " + ", ".join(f"{s['action']} {s['ms']:.1f} ms" for s in step_times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source.pdf")
+        make_sample_pdf(source, args.pages)
+        compare(f"PDF, {args.pages} pages", source, PDF_STEPS, PDF_ACTIONS, pdf_tools.run_pipeline,
+                os.path.join(workdir, "pdf"), args.runs)
+
+        source = os.path.join(workdir, "source.jpg")
+        make_sample_image(source, args.megapixels)
+        compare(f"Image, {args.megapixels:g} MP JPEG", source, IMAGE_STEPS, IMAGE_ACTIONS, image_tools.run_pipeline,
+                os.path.join(workdir, "image"), args.runs)
+
+
+if __name__ == "__main__":
+    main()
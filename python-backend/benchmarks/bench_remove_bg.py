@@ -0,0 +1,151 @@
+"""
+Benchmark: background removal latency and mask quality per CPU variant.
+
+For each image, rembg's default session gives the reference mask. Every
+variant is then timed and compared with it:
+
+    rembg            rembg's session (the default path of remove_background)
+    fp32             bg_removal.CpuMattingModel, full precision
+    int8             bg_removal.CpuMattingModel, <model>_int8.onnx
+    <variant>@<size> the same with the mask inferred at size x size (models
+                     with dynamic input size only)
+
+Quality is measured against the reference: mean absolute alpha error (0-1,
+lower is better) and IoU of the masks thresholded at 0.5 (higher is
+better). Latency covers mask prediction only, not decoding or PNG encoding.
+
+--quantize writes the int8 variants first with onnxruntime's dynamic
+quantization. --intra/--graph-opt sweep the session options. Without
+--images, a synthetic subject on a textured background is used. Use real
+photos for meaningful quality numbers.
+
+Usage (from python-backend/):
+    python benchmarks/bench_remove_bg.py --quantize --models u2netp u2net --images ~/photos
+    python benchmarks/bench_remove_bg.py --intra 1 2 4 --graph-opt basic all --mask-sizes 256
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules import bg_removal  # noqa: E402
+
+
+def load_images(paths, count):
+    from PIL import Image, ImageDraw, ImageFilter
+    images = []
+    for path in paths or ():
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, f) for f in sorted(os.listdir(path))
+                          if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp")))
+        else:
+            images.append(path)
+    if images:
+        return [(os.path.basename(p), Image.open(p).convert("RGB")) for p in images[:count]]
+
+    synthetic = []
+    for n in range(count):
+        img = Image.effect_noise((1600, 1200), 40 + n * 5).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        draw.ellipse((500 - n * 20, 200, 1100 + n * 20, 1100), fill=(220, 180, 150))
+        draw.rectangle((650, 100, 950, 350), fill=(60, 40, 30))
+        synthetic.append((f"synthetic{n}", img.filter(ImageFilter.GaussianBlur(1))))
+    return synthetic
+
+
+def quantize(model_name):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    source = bg_removal.model_file(model_name, "fp32")
+    target = bg_removal.model_file(model_name, "int8")
+    if not os.path.exists(source):
+        print(f"  {model_name}: {source} not found, run a default remove_bg once to download it")
+        return
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    print(f"  {model_name}: {os.path.getsize(source) / 1e6:.1f} MB -> {os.path.getsize(target) / 1e6:.1f} MB ({target})")
+
+
+def reference_masks(model_name, images):
+    from rembg import new_session
+    session = new_session(model_name)
+    masks, times = [], []
+    for _, img in images:
+        start = time.perf_counter()
+        masks.append(session.predict(img)[0])
+        times.append((time.perf_counter() - start) * 1000)
+    return masks, times
+
+
+def compare(mask, reference):
+    import numpy as np
+    a = np.asarray(mask, dtype=np.float32) / 255
+    b = np.asarray(reference.resize(mask.size), dtype=np.float32) / 255
+    union = np.logical_or(a >= 0.5, b >= 0.5).sum()
+    iou = np.logical_and(a >= 0.5, b >= 0.5).sum() / union if union else 1.0
+    return float(np.abs(a - b).mean()), float(iou)
+
+
+def run_variant(model, images, references, mask_size, runs):
+    times, errors, ious = [], [], []
+    for (_, img), reference in zip(images, references):
+        model.mask(img, mask_size)  # warm-up
+        for _ in range(runs):
+            start = time.perf_counter()
+            mask = model.mask(img, mask_size)
+            times.append((time.perf_counter() - start) * 1000)
+        error, iou = compare(mask, reference)
+        errors.append(error)
+        ious.append(iou)
+    return times, statistics.mean(errors), statistics.mean(ious)
+
+
+def _row(label, times, error=None, iou=None):
+    quality = f"{error:8.4f} {iou:7.4f}" if error is not None else f"{'ref':>8} {'ref':>7}"
+    print(f"  {label:<34} {statistics.mean(times):9.1f} {min(times):9.1f}  {quality}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["u2netp", "u2net"])
+    parser.add_argument("--images", nargs="*", help="Image files or directories")
+    parser.add_argument("--count", type=int, default=5, help="Images to use")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--quantize", action="store_true", help="Write <model>_int8.onnx first")
+    parser.add_argument("--intra", nargs="+", type=int, default=[bg_removal.REMBG_INTRA_OP_THREADS])
+    parser.add_argument("--graph-opt", nargs="+", default=[bg_removal.REMBG_GRAPH_OPT])
+    parser.add_argument("--mask-sizes", nargs="*", type=int, default=[])
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.count)
+    print(f"{len(images)} images, {args.runs} runs each, models from {bg_removal.REMBG_MODEL_DIR}")
+    if args.quantize:
+        print("Quantizing:")
+        for model_name in args.models:
+            quantize(model_name)
+
+    for model_name in args.models:
+        print(f"\n{model_name}: {'variant':<26} {'mean ms':>9} {'min ms':>9}  {'abs err':>8} {'IoU':>7}")
+        references, ref_times = reference_masks(model_name, images)
+        _row("rembg", ref_times)
+        for precision in bg_removal.PRECISIONS:
+            if not os.path.exists(bg_removal.model_file(model_name, precision)):
+                print(f"  {precision:<34} skipped: {os.path.basename(bg_removal.model_file(model_name, precision))} not found")
+                continue
+            for intra in args.intra:
+                for graph_opt in args.graph_opt:
+                    model = bg_removal.CpuMattingModel(model_name, precision, intra_op=intra, graph_opt=graph_opt)
+                    sizes = [None] + ([] if model.fixed_size else args.mask_sizes)
+                    for mask_size in sizes:
+                        label = f"{precision} intra={intra or 'default'} opt={graph_opt}"
+                        if mask_size:
+                            label += f" @{mask_size}"
+                        times, error, iou = run_variant(model, images, references, mask_size, args.runs)
+                        _row(label, times, error, iou)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: super-resolution time and peak memory per model and tile size.
+
+Each configuration runs in a fresh interpreter, so the peak RSS reported
+(ru_maxrss) belongs to that configuration alone. "whole" is the old
+behaviour: one upsample() call on the full image. Numeric tile sizes go
+through superres.SuperResModel.upscale() with the memory ceiling lifted, so
+the requested tile size is used as-is.
+
+Models are read from UPSCALE_MODEL_DIR; models without a file there are
+skipped (EDSR is not downloaded here). The numbers are the ones to use
+when tuning UPSCALE_MEMORY_MB, UPSCALE_THREADS and the activation estimate
+in superres.MODELS for a given machine.
+
+Usage (from python-backend/):
+    python benchmarks/bench_upscale.py --size 1500x1000 --scales 2 4
+    python benchmarks/bench_upscale.py --models espcn fsrcnn --tiles whole 128 256
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules import superres  # noqa: E402
+
+
+def make_sample(width, height):
+    """A photo-like BGR array: smooth gradients plus fine noise."""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    return np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+
+
+def run_single(algorithm, scale, tile, width, height):
+    """Child process: one configuration, printed as a JSON line."""
+    img = make_sample(width, height)
+    model = superres.SuperResModel(algorithm, scale, superres.model_path(algorithm, scale))
+    start = time.perf_counter()
+    if tile == "whole":
+        with model.instance() as sr:
+            out = sr.upsample(img)
+    else:
+        out = model.upscale(img, tile_size=int(tile))
+    elapsed = (time.perf_counter() - start) * 1000
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_kb //= 1024
+    print(json.dumps({"ms": elapsed, "peak_mb": peak_kb / 1024, "shape": list(out.shape)}))
+
+
+def measure(algorithm, scale, tile, width, height, threads):
+    env = dict(os.environ, UPSCALE_MEMORY_MB="1000000", UPSCALE_THREADS=str(threads))
+    cmd = [sys.executable, os.path.abspath(__file__), "--single", algorithm, str(scale), str(tile), str(width), str(height)]
+    proc = subprocess.run(cmd, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None, proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+    return json.loads(proc.stdout.strip().splitlines()[-1]), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=list(superres.MODELS))
+    parser.add_argument("--scales", nargs="+", type=int, default=[2, 4])
+    parser.add_argument("--tiles", nargs="+", default=["whole", "128", "256", "512"])
+    parser.add_argument("--size", default="1500x1000", help="Input WIDTHxHEIGHT")
+    parser.add_argument("--threads", type=int, default=superres.UPSCALE_THREADS)
+    parser.add_argument("--single", nargs=5, metavar=("MODEL", "SCALE", "TILE", "WIDTH", "HEIGHT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        algorithm, scale, tile, width, height = args.single
+        run_single(algorithm, int(scale), tile, int(width), int(height))
+        return
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    print(f"Input {width}x{height}, {args.threads} threads, models from {superres.UPSCALE_MODEL_DIR}")
+    print(f"{'model':<8} {'scale':>5} {'tile':>6} {'time ms':>10} {'peak MB':>9}  {'estimate MB':>11}")
+    for algorithm in args.models:
+        for scale in args.scales:
+            if scale not in superres.MODELS[algorithm]["scales"]:
+                continue
+            if not os.path.exists(superres.model_path(algorithm, scale)):
+                print(f"{algorithm:<8} {scale:>5}  skipped: {os.path.basename(superres.model_path(algorithm, scale))} not found")
+                continue
+            for tile in args.tiles:
+                result, error = measure(algorithm, scale, tile, width, height, args.threads)
+                if error:
+                    print(f"{algorithm:<8} {scale:>5} {tile:>6}  failed: {error}")
+                    continue
+                if tile == "whole":
+                    spec = superres.MODELS[algorithm]
+                    estimate = width * height * spec["channels"] * 4 * (spec["live_maps"] + scale * scale) / 1024 / 1024
+                else:
+                    estimate = (args.threads * superres._tile_bytes(algorithm, scale, int(tile))
+                                + superres._band_bytes(scale, int(tile), width, 3)) / 1024 / 1024
+                print(f"{algorithm:<8} {scale:>5} {tile:>6} {result['ms']:>10.0f} {result['peak_mb']:>9.0f}  {estimate:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
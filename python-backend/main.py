@@ -6,6 +6,8 @@ from datetime import datetime
 import importlib
 import traceback
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Setup Logging
 def setup_logging():
@@ -34,50 +36,131 @@ setup_logging()
 logger = logging.getLogger('main')
 
 # Module Registry
-if getattr(sys, 'frozen', False):
-    # Running in PyInstaller bundle
+# Tool modules are imported on first request (see load_module), so the sidecar
+# can answer a license check without loading PyMuPDF, Pillow, pandas, ...
+MODULES = {
+    "image_tools": "modules.image_tools",
+    "pdf_tools": "modules.pdf_tools",
+    "pdf_editor": "modules.pdf_editor",
+    "licensing": "modules.licensing"
+}
+
+try:
+    from modules import progress, lazy_imports, model_registry
+except ImportError:
+    import progress
+    import lazy_imports
+    import model_registry
+
+# Minimum seconds between two progress lines of one request (about 10 per second)
+PROGRESS_MIN_INTERVAL = float(os.getenv("BRIDGE_PROGRESS_INTERVAL", "0.1"))
+
+# stdout carries the JSON bridge; every line must be written whole
+_stdout_lock = threading.Lock()
+
+def write_message(message):
+    with _stdout_lock:
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+
+def progress_emitter(req_id):
+    """Returns a progress callback that writes throttled "progress" lines for req_id."""
+    last_sent = [0.0]
+
+    def emit(percent, message):
+        now = time.monotonic()
+        if req_id is None or now - last_sent[0] < PROGRESS_MIN_INTERVAL:
+            return
+        last_sent[0] = now
+        write_message({
+            "type": "progress",
+            "request_id": req_id,
+            "progress": percent,
+            "message": message
+        })
+
+    return emit
+
+# Requests run concurrently, each module on its own bounded pool, so a long OCR
+# job cannot hold up a license check or a preview. Responses are written as they
+# complete; the Tauri side matches them by request_id.
+MODULE_CONCURRENCY = {
+    "pdf_tools": int(os.getenv("BRIDGE_PDF_CONCURRENCY", "2")),
+    "image_tools": int(os.getenv("BRIDGE_IMAGE_CONCURRENCY", "2")),
+    "pdf_editor": int(os.getenv("BRIDGE_EDITOR_CONCURRENCY", "4")),
+    "licensing": 1,
+}
+# Pool for requests naming an unknown module (they fail fast with MODULE_NOT_FOUND)
+DEFAULT_CONCURRENCY = 2
+
+_executors = {}
+_load_lock = threading.Lock()
+
+def get_executor(module_name):
+    key = module_name if module_name in MODULE_CONCURRENCY else None
+    executor = _executors.get(key)
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=MODULE_CONCURRENCY.get(key, DEFAULT_CONCURRENCY),
+            thread_name_prefix=f"bridge-{key or 'default'}"
+        )
+        _executors[key] = executor
+    return executor
+
+# Modules are imported once and cached. When running from source, set
+# BACKEND_HOT_RELOAD=1 to reload a module whenever its file changes on disk
+HOT_RELOAD = os.getenv("BACKEND_HOT_RELOAD", "false").lower() in ("1", "true")
+
+_loaded = {}  # module name -> (module, source mtime)
+
+def _source_mtime(module):
     try:
-        from modules import image_tools
-        from modules import pdf_tools
-        from modules import pdf_editor
-        from modules import licensing
+        return os.path.getmtime(module.__file__)
+    except (AttributeError, TypeError, OSError):
+        return None
+
+def _import_module(dotted_name):
+    try:
+        return importlib.import_module(dotted_name)
     except ImportError:
-        # Fallback if bundled flat
-        import image_tools
-        import pdf_tools
-        import pdf_editor
-        import licensing
-
-    MODULES = {
-        "image_tools": image_tools,
-        "pdf_tools": pdf_tools,
-        "pdf_editor": pdf_editor,
-        "licensing": licensing
-    }
-else:
-    # Running from source
-    MODULES = {
-        "image_tools": "modules.image_tools",
-        "pdf_tools": "modules.pdf_tools",
-        "pdf_editor": "modules.pdf_editor",
-        "licensing": "modules.licensing"
-    }
+        if not getattr(sys, 'frozen', False):
+            raise
+        # PyInstaller bundle may be flat
+        return importlib.import_module(dotted_name.rsplit(".", 1)[-1])
 
 def load_module(module_name):
-    if module_name in MODULES:
-        val = MODULES[module_name]
-        if isinstance(val, str):
+    if module_name not in MODULES:
+        return None
+
+    val = MODULES[module_name]
+    entry = _loaded.get(module_name)
+    if entry is not None and not HOT_RELOAD:
+        return entry[0]
+
+    # Requests load modules from several threads at once, so imports are serialized
+    with _load_lock:
+        entry = _loaded.get(module_name)
+        if entry is None:
             try:
-                # Reload module if it's already imported to pick up changes
-                if val in sys.modules:
-                    return importlib.reload(sys.modules[val])
-                return importlib.import_module(val)
+                module = _import_module(val)
             except ImportError as e:
                 logger.error(f"Failed to import module {module_name}: {e}")
                 return None
         else:
-            return val
-    return None
+            module, mtime = entry
+            if not HOT_RELOAD or _source_mtime(module) == mtime:
+                return module
+            try:
+                logger.info(f"Source of {module_name} changed, reloading")
+                module = importlib.reload(module)
+            except Exception as e:
+                # Keep serving the previous version until the file is fixed
+                logger.error(f"Failed to reload module {module_name}: {e}")
+                _loaded[module_name] = (module, _source_mtime(module))
+                return module
+
+        _loaded[module_name] = (module, _source_mtime(module))
+        return module
 
 def process_request(request):
     req_id = request.get("request_id")
@@ -101,9 +184,11 @@ def process_request(request):
         result_data = None
 
         if module_name == "image_tools" and hasattr(module, "handle_image_action"):
-            result_data = module.handle_image_action(action, payload)
+            with progress.reporting_to(progress_emitter(req_id)):
+                result_data = module.handle_image_action(action, payload)
         elif module_name == "pdf_tools" and hasattr(module, "handle_pdf_action"):
-            result_data = module.handle_pdf_action(action, payload)
+            with progress.reporting_to(progress_emitter(req_id)):
+                result_data = module.handle_pdf_action(action, payload)
         elif module_name == "licensing":
             if action == "status":
                 result_data = module.check_local_license()
@@ -145,6 +230,50 @@ def process_request(request):
             "error": {"code": "INTERNAL_ERROR", "message": "An internal error occurred during processing."}
         }
 
+# Once the first response is out, load the tool modules and their deferred
+# dependencies in the background: the first click stays fast and later ones
+# find everything warm. BACKEND_PREWARM=0 turns this off
+PREWARM = os.getenv("BACKEND_PREWARM", "true").lower() in ("1", "true")
+PREWARM_MODULES = ("pdf_tools", "image_tools")
+
+_prewarm_started = False
+_prewarm_lock = threading.Lock()
+
+def _prewarm():
+    start = time.perf_counter()
+    for module_name in PREWARM_MODULES:
+        load_module(module_name)
+    count = lazy_imports.prewarm()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Pre-warm loaded {count} deferred imports in {elapsed:.2f}s\n{lazy_imports.report()}")
+    # ML models listed in MODEL_PREWARM (none by default)
+    model_registry.prewarm()
+
+def schedule_prewarm():
+    global _prewarm_started
+    if not PREWARM:
+        return
+    with _prewarm_lock:
+        if _prewarm_started:
+            return
+        _prewarm_started = True
+    threading.Thread(target=_prewarm, name="prewarm", daemon=True).start()
+
+def handle_request(request):
+    """Runs on a module pool: process one request and write its result line."""
+    try:
+        response = process_request(request)
+    except Exception:
+        logger.exception(f"Unhandled error in request {request.get('request_id')}")
+        response = {
+            "type": "result",
+            "request_id": request.get("request_id"),
+            "status": "error",
+            "error": {"code": "INTERNAL_ERROR", "message": "An internal error occurred during processing."}
+        }
+    write_message(response)
+    schedule_prewarm()
+
 def stdin_loop():
     """Handle stdin/stdout communication bridge (for existing tools)"""
     logger.info("Stdin/stdout bridge started")
@@ -161,17 +290,14 @@ def stdin_loop():
 
             try:
                 request = json.loads(line)
-                response = process_request(request)
-                print(json.dumps(response))
-                sys.stdout.flush()
+                get_executor(request.get("module")).submit(handle_request, request)
             except json.JSONDecodeError:
                 logger.error("Invalid JSON received")
-                print(json.dumps({
+                write_message({
                     "type": "result",
                     "status": "error",
                     "error": {"code": "INVALID_JSON", "message": "Invalid JSON"}
-                }))
-                sys.stdout.flush()
+                })
 
         except KeyboardInterrupt:
             break
@@ -179,6 +305,10 @@ def stdin_loop():
             logger.exception("Fatal error in stdin loop")
             break
 
+    # Let running requests finish and drop the ones still queued
+    for executor in list(_executors.values()):
+        executor.shutdown(wait=True, cancel_futures=True)
+
 def start_http_server():
     """Start HTTP server for PDF Editor endpoints"""
     try:
@@ -186,6 +316,7 @@ def start_http_server():
         from fastapi import FastAPI, UploadFile, File, Form
         from fastapi.middleware.cors import CORSMiddleware
         from fastapi.responses import FileResponse
+        from typing import Optional
         import tempfile
 
         logger.info("Starting HTTP server for PDF Editor...")
@@ -204,106 +335,123 @@ def start_http_server():
         # Load pdf_editor module
         pdf_editor_module = load_module("pdf_editor")
 
-        @app.post("/api/pdf-editor/info")
-        async def pdf_editor_get_info(file: UploadFile = File(...)):
-            """Get PDF document information"""
-            try:
-                # Save uploaded file to temp location
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    content = await file.read()
-                    tmp.write(content)
-                    file_path = tmp.name
+        async def save_temp_pdf(file):
+            """Save an uploaded PDF to a temp file and return its path"""
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
+                content = await file.read()
+                tmp.write(content)
+                return tmp.name
 
-                result = pdf_editor_module.get_pdf_info({"file": file_path})
+        def cleanup(file_path):
+            try:
+                os.unlink(file_path)
+            except:
+                pass
+
+        # Every endpoint takes either an uploaded "file" or the "doc_id" of a
+        # session from /api/pdf-editor/open, so the PDF is only uploaded once
+        async def call_editor(func, file, doc_id, **params):
+            if doc_id:
+                return func({"doc_id": doc_id, **params})
+            if file is None:
+                return {"error": "Either file or doc_id is required"}
+
+            file_path = await save_temp_pdf(file)
+            try:
+                return func({"file": file_path, **params})
+            finally:
+                cleanup(file_path)
+
+        def editor_response(result):
+            if "error" in result:
+                return {"status": "error", "error": result["error"], "code": result.get("code")}
+            return {"status": "success", "data": result}
+
+        @app.post("/api/pdf-editor/open")
+        async def pdf_editor_open(file: UploadFile = File(...)):
+            """Open a PDF as an editor session and return its doc_id"""
+            try:
+                file_path = await save_temp_pdf(file)
+                # The session owns the temp file and deletes it when closed
+                result = pdf_editor_module.open_session({"file": file_path})
+                if "error" in result:
+                    cleanup(file_path)
+                return editor_response(result)
+            except Exception as e:
+                logger.exception("Error in pdf-editor/open")
+                return {"status": "error", "error": str(e)}
 
-                # Cleanup
-                try:
-                    os.unlink(file_path)
-                except:
-                    pass
+        @app.post("/api/pdf-editor/close")
+        async def pdf_editor_close(doc_id: str = Form(...)):
+            """Close an editor session"""
+            return {"status": "success", "data": pdf_editor_module.close_session({"doc_id": doc_id})}
 
-                return {"status": "success", "data": result}
+        @app.post("/api/pdf-editor/info")
+        async def pdf_editor_get_info(
+            file: Optional[UploadFile] = File(None),
+            doc_id: Optional[str] = Form(None)
+        ):
+            """Get PDF document information"""
+            try:
+                result = await call_editor(pdf_editor_module.get_pdf_info, file, doc_id)
+                return editor_response(result)
             except Exception as e:
                 logger.exception("Error in pdf-editor/info")
                 return {"status": "error", "error": str(e)}
 
         @app.post("/api/pdf-editor/render")
         async def pdf_editor_render_page(
-            file: UploadFile = File(...),
+            file: Optional[UploadFile] = File(None),
+            doc_id: Optional[str] = Form(None),
             page: int = Form(...),
             dpi: int = Form(150)
         ):
             """Render PDF page to image"""
             try:
-                # Save uploaded file to temp location
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    content = await file.read()
-                    tmp.write(content)
-                    file_path = tmp.name
-
-                result = pdf_editor_module.render_pdf_page({
-                    "file": file_path,
-                    "page": page,
-                    "dpi": dpi
-                })
-
-                # Cleanup
-                try:
-                    os.unlink(file_path)
-                except:
-                    pass
-
-                return {"status": "success", "data": result}
+                result = await call_editor(pdf_editor_module.render_pdf_page, file, doc_id, page=page, dpi=dpi)
+                return editor_response(result)
             except Exception as e:
                 logger.exception("Error in pdf-editor/render")
                 return {"status": "error", "error": str(e)}
 
         @app.post("/api/pdf-editor/load-annotations")
-        async def pdf_editor_load_annotations(file: UploadFile = File(...)):
+        async def pdf_editor_load_annotations(
+            file: Optional[UploadFile] = File(None),
+            doc_id: Optional[str] = Form(None)
+        ):
             """Load existing annotations from PDF"""
             try:
-                # Save uploaded file to temp location
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    content = await file.read()
-                    tmp.write(content)
-                    file_path = tmp.name
-
-                result = pdf_editor_module.load_annotations({"file": file_path})
-
-                # Cleanup
-                try:
-                    os.unlink(file_path)
-                except:
-                    pass
-
-                return {"status": "success", "data": result}
+                result = await call_editor(pdf_editor_module.load_annotations, file, doc_id)
+                return editor_response(result)
             except Exception as e:
                 logger.exception("Error in pdf-editor/load-annotations")
                 return {"status": "error", "error": str(e)}
 
         @app.post("/api/pdf-editor/save")
         async def pdf_editor_save_annotations(
-            file: UploadFile = File(...),
+            file: Optional[UploadFile] = File(None),
+            doc_id: Optional[str] = Form(None),
             annotations: str = Form(...),
             flatten: bool = Form(False)
         ):
             """Save annotations to PDF"""
             try:
-                # Save uploaded file to temp location
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    content = await file.read()
-                    tmp.write(content)
-                    file_path = tmp.name
-
                 # Parse annotations JSON
-                import json
                 annotations_list = json.loads(annotations)
 
-                result = pdf_editor_module.save_annotations({
-                    "file": file_path,
-                    "annotations": annotations_list,
-                    "flatten": flatten
-                })
+                if doc_id:
+                    payload = {"doc_id": doc_id}
+                elif file is not None:
+                    payload = {"file": await save_temp_pdf(file)}
+                else:
+                    return {"status": "error", "error": "Either file or doc_id is required"}
+
+                payload["annotations"] = annotations_list
+                payload["flatten"] = flatten
+                result = pdf_editor_module.save_annotations(payload)
+
+                if "error" in result:
+                    return editor_response(result)
 
                 output_path = result.get("output_file")
 
@@ -0,0 +1,156 @@
+"""
+CPU-optimized background removal for the u2net model family.
+
+By default remove_background runs rembg's session: full-precision u2net with
+onnxruntime's default session options. The backend nodes have no GPU.
+CpuMattingModel runs the same u2net models directly on onnxruntime. A
+request opts in with "precision" or "mask_size", or every u2net-family
+request does with REMBG_CPU_MODE=true. It adds:
+
+- int8 variants: precision="int8" loads <model>_int8.onnx from
+  REMBG_MODEL_DIR. bench_remove_bg.py --quantize writes these with
+  onnxruntime's dynamic quantization.
+- Explicit threading: REMBG_INTRA_OP_THREADS and REMBG_INTER_OP_THREADS.
+  0 keeps the onnxruntime default.
+- Graph optimization: REMBG_GRAPH_OPT = disable | basic | extended | all.
+- Reduced-resolution inference: the full-size photo is never resized.
+  A box-filtered copy is shrunk to the model input (mask_size, when the
+  model accepts other sizes than 320), and only the predicted alpha mask is
+  upsampled to full size.
+
+Pre- and post-processing follow rembg's u2net session (ImageNet
+normalization, min-max scaled mask, naive cutout), so with precision="fp32"
+the masks match rembg's up to resampling filters. The onnxruntime session
+is wrapped by inference.BatchedOnnxSession like on the default path. The
+stock u2net-family exports have a fixed batch of 1 and run one input at a
+time; only exports with a dynamic batch axis are micro-batched.
+"""
+
+import logging
+import os
+from typing import Any, Optional, Tuple
+
+try:
+    from modules import inference
+    from modules.lazy_imports import lazy_module
+except ImportError:
+    import inference
+    from lazy_imports import lazy_module
+
+np = lazy_module("numpy")
+Image = lazy_module("PIL.Image")
+
+logger = logging.getLogger(__name__)
+
+# Use this path for u2net-family requests even when they don't ask for precision/mask_size
+REMBG_CPU_MODE = os.getenv("REMBG_CPU_MODE", "false").lower() == "true"
+REMBG_MODEL_DIR = os.getenv("REMBG_MODEL_DIR") or os.getenv("U2NET_HOME") or os.path.join(os.path.expanduser("~"), ".u2net")
+REMBG_INTRA_OP_THREADS = int(os.getenv("REMBG_INTRA_OP_THREADS", "0"))
+REMBG_INTER_OP_THREADS = int(os.getenv("REMBG_INTER_OP_THREADS", "0"))
+REMBG_GRAPH_OPT = os.getenv("REMBG_GRAPH_OPT", "all").lower()
+
+# Models that share u2net's pre- and post-processing
+CPU_MODELS = ("u2net", "u2netp", "u2net_human_seg", "silueta")
+PRECISIONS = ("fp32", "int8")
+NATIVE_SIZE = 320
+
+_MEAN = (0.485, 0.456, 0.406)
+_STD = (0.229, 0.224, 0.225)
+
+
+def model_file(model_name: str, precision: str = "fp32") -> str:
+    """ONNX file of a model variant, e.g. ~/.u2net/u2netp_int8.onnx."""
+    suffix = "" if precision == "fp32" else f"_{precision}"
+    return os.path.join(REMBG_MODEL_DIR, f"{model_name}{suffix}.onnx")
+
+
+def session_options(intra_op: Optional[int] = None, inter_op: Optional[int] = None, graph_opt: Optional[str] = None):
+    """onnxruntime SessionOptions from the REMBG_* settings (arguments override them)."""
+    import onnxruntime as ort
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    graph_opt = (graph_opt or REMBG_GRAPH_OPT).lower()
+    if graph_opt not in levels:
+        raise ValueError(f"Unknown graph optimization level: {graph_opt}. Supported: {', '.join(levels)}")
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = levels[graph_opt]
+    intra_op = REMBG_INTRA_OP_THREADS if intra_op is None else intra_op
+    inter_op = REMBG_INTER_OP_THREADS if inter_op is None else inter_op
+    if intra_op > 0:
+        options.intra_op_num_threads = intra_op
+    if inter_op > 0:
+        options.inter_op_num_threads = inter_op
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return options
+
+
+class CpuMattingModel:
+    """A u2net-family model on onnxruntime's CPU provider, tuned per the REMBG_* settings."""
+
+    def __init__(self, model_name: str, precision: str = "fp32", **option_overrides: Any):
+        if model_name not in CPU_MODELS:
+            raise ValueError(f"CPU mode supports {', '.join(CPU_MODELS)}, not {model_name}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}. Supported: {', '.join(PRECISIONS)}")
+        path = model_file(model_name, precision)
+        if not os.path.exists(path):
+            if precision == "fp32":
+                hint = " (a remove_bg request without precision/mask_size downloads it)"
+            else:
+                hint = " (create it with benchmarks/bench_remove_bg.py --quantize)"
+            raise FileNotFoundError(f"{os.path.basename(path)} not found in {REMBG_MODEL_DIR}{hint}")
+
+        import onnxruntime as ort
+        session = ort.InferenceSession(path, sess_options=session_options(**option_overrides),
+                                       providers=["CPUExecutionProvider"])
+        self.name = f"{model_name}:{precision}"
+        self.path = path
+        self.input_name = session.get_inputs()[0].name
+        shape = session.get_inputs()[0].shape
+        # Fixed spatial dimensions (the usual u2net export) pin the inference size
+        self.fixed_size = shape[2] if len(shape) == 4 and isinstance(shape[2], int) else None
+        self.session = inference.BatchedOnnxSession(session, f"rembg_cpu:{self.name}")
+
+    def mask(self, img, mask_size: Optional[int] = None):
+        """Alpha mask ("L", same size as img) predicted at mask_size x mask_size."""
+        size = self.fixed_size or int(mask_size or NATIVE_SIZE)
+        if mask_size and self.fixed_size and int(mask_size) != self.fixed_size:
+            logger.debug(f"{self.name} has a fixed {self.fixed_size}px input; ignoring mask_size={mask_size}")
+
+        small = img.convert("RGB")
+        # Cheap box filter down to about twice the input size, then a proper resize
+        factor = min(small.width, small.height) // (2 * size)
+        if factor > 1:
+            small = small.reduce(factor)
+        small = small.resize((size, size), Image.Resampling.BILINEAR)
+
+        pixels = np.asarray(small, dtype=np.float32)
+        pixels = pixels / max(float(pixels.max()), 1e-6)
+        pixels = (pixels - np.array(_MEAN, dtype=np.float32)) / np.array(_STD, dtype=np.float32)
+        tensor = np.expand_dims(pixels.transpose((2, 0, 1)), 0).astype(np.float32)
+
+        outputs = self.session.run(None, {self.input_name: tensor})
+        pred = outputs[0][0, 0, :, :]
+        low, high = float(pred.min()), float(pred.max())
+        pred = (pred - low) / max(high - low, 1e-6)
+        mask = Image.fromarray((pred * 255).astype(np.uint8), mode="L")
+        # Only the mask is brought back to full resolution
+        return mask.resize(img.size, Image.Resampling.BILINEAR)
+
+    def cutout(self, img, mask_size: Optional[int] = None):
+        """RGBA copy of img with the background made transparent."""
+        img = img.convert("RGBA")
+        empty = Image.new("RGBA", img.size, 0)
+        return Image.composite(img, empty, self.mask(img, mask_size))
+
+
+def load(name: str) -> Tuple["CpuMattingModel", int]:
+    """model_registry loader for names like "u2netp:int8"."""
+    model_name, _, precision = name.partition(":")
+    model = CpuMattingModel(model_name, precision or "fp32")
+    return model, os.path.getsize(model.path)
@@ -0,0 +1,189 @@
+"""
+Size bound and counters for an on-disk cache shared by several processes.
+
+The result cache and the OCR page cache live in one directory that every
+worker process reads and writes. An in-memory index per process only sees
+that process's own stores, so N workers could fill N times the budget.
+DiskLRU keeps the accounting on disk instead: a small state file in the
+cache directory holds the total size, the entry count and named counters
+(hits, misses, ...), and is only read or written under an OS file lock
+(flock, or msvcrt.locking on Windows).
+
+Stores add their size to the shared total. Only when the total goes over
+max_bytes is the directory scanned: entries are ordered by mtime (a hit
+touches its entry), the oldest are removed until the store is back under
+LOW_WATER of the budget, and the total is reset from the scan. Scanning
+only past the bound keeps the common store cheap, and the low-water mark
+keeps a full cache from scanning on every store. Any drift (an entry
+removed outside the accounting) is corrected by the next scan.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger(__name__)
+
+# Share of max_bytes an eviction scan brings the store back down to
+LOW_WATER = 0.9
+
+_STATE_FILE = ".state.json"
+_LOCK_FILE = ".lock"
+
+
+class DiskLRU:
+    """
+    Shared accounting for one cache directory.
+
+    Args:
+        directory: The cache directory (created on first use)
+        max_bytes: Budget for the whole directory
+        scan: Callable returning (mtime, key, size) for every entry on disk
+        remove: Callable deleting one entry by key
+    """
+
+    def __init__(self, directory: str, max_bytes: int,
+                 scan: Callable[[], Iterable[Tuple[float, str, int]]], remove: Callable[[str], None]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._scan = scan
+        self._remove = remove
+        self._lock_path = os.path.join(directory, _LOCK_FILE)
+        self._state_path = os.path.join(directory, _STATE_FILE)
+        self._thread_lock = threading.Lock()
+
+    def added(self, size: int, entries: int = 1) -> List[str]:
+        """
+        Account for a stored entry (or a size change with entries=0) and evict
+        least recently used entries if the store is over budget. Returns the
+        evicted keys (already removed).
+        """
+        with self._locked():
+            state = self._read_state()
+            state["bytes"] += size
+            state["entries"] += entries
+            evicted = []
+            if state["bytes"] > self.max_bytes:
+                evicted = self._evict(state)
+            self._write_state(state)
+        return evicted
+
+    def removed(self, size: int, entries: int = 1) -> None:
+        """Account for an entry deleted outside eviction."""
+        with self._locked():
+            state = self._read_state()
+            state["bytes"] = max(0, state["bytes"] - size)
+            state["entries"] = max(0, state["entries"] - entries)
+            self._write_state(state)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add to a shared counter."""
+        with self._locked():
+            state = self._read_state()
+            state["counters"][name] = state["counters"].get(name, 0) + value
+            self._write_state(state)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters plus entries and bytes, over every process using the directory."""
+        with self._locked():
+            state = self._read_state()
+        return {**state["counters"], "entries": state["entries"], "bytes": state["bytes"]}
+
+    def clear(self) -> None:
+        """Remove every entry and reset the size and counters."""
+        with self._locked():
+            for name in os.listdir(self.directory):
+                if name == _LOCK_FILE:
+                    continue
+                path = os.path.join(self.directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            self._write_state({"bytes": 0, "entries": 0, "counters": {}})
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._lock_path, "a+b") as f:
+                _lock_file(f)
+                try:
+                    yield
+                finally:
+                    _unlock_file(f)
+
+    def _read_state(self) -> Dict:
+        try:
+            with open(self._state_path) as f:
+                state = json.load(f)
+            if (isinstance(state, dict) and isinstance(state.get("bytes"), int)
+                    and isinstance(state.get("entries"), int) and isinstance(state.get("counters"), dict)):
+                return state
+        except (OSError, ValueError):
+            pass
+        # First use, or a store from before the state file: measure it
+        entries = list(self._scan())
+        return {"bytes": sum(size for _, _, size in entries), "entries": len(entries), "counters": {}}
+
+    def _write_state(self, state: Dict) -> None:
+        staging = f"{self._state_path}.{os.getpid()}.tmp"
+        with open(staging, "w") as f:
+            json.dump(state, f)
+        os.replace(staging, self._state_path)
+
+    def _evict(self, state: Dict) -> List[str]:
+        """Remove the oldest entries down to LOW_WATER and re-measure. Caller holds the lock."""
+        start = time.perf_counter()
+        entries = sorted(self._scan())
+        total = sum(size for _, _, size in entries)
+        target = int(self.max_bytes * LOW_WATER)
+        evicted = []
+        for _, key, size in entries:
+            if total <= target:
+                break
+            self._remove(key)
+            total -= size
+            evicted.append(key)
+        state["bytes"] = total
+        state["entries"] = len(entries) - len(evicted)
+        state["counters"]["evictions"] = state["counters"].get("evictions", 0) + len(evicted)
+        logger.info(f"Evicted {len(evicted)} entries from {self.directory} in "
+                    f"{(time.perf_counter() - start) * 1000:.0f}ms, {total} bytes left")
+        return evicted
+
+
+# Helper functions
+
+def _lock_file(f) -> None:
+    if os.name == "nt":
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK gives up after about 10 seconds; keep waiting like flock does
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f) -> None:
+    if os.name == "nt":
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
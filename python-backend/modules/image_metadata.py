@@ -0,0 +1,286 @@
+"""
+Lossless metadata removal at the container level.
+
+remove_metadata used to decode every pixel into a Python tuple and re-encode
+the image. That took seconds and gigabytes on a 20 MP photo and recompressed
+JPEGs. strip() never decodes pixels. It walks the file structure and copies
+everything except metadata:
+
+    JPEG  APP1 (EXIF, XMP), APP2 (ICC, MPF), APP3-APP13, APP15, COM,
+          JFXX thumbnails and anything after EOI
+    PNG   tEXt, zTXt, iTXt, eXIf, tIME, iCCP
+    WebP  EXIF, XMP and ICCP chunks (the VP8X flags are updated)
+
+Image data, JFIF/Adobe segments and chunks that affect rendering (gamma,
+transparency, sRGB, animation, ...) are copied byte for byte, so the time
+depends on the file size, not the pixel count. By default the EXIF
+orientation is kept as a minimal EXIF block holding only that tag. Without
+it, phone photos would show rotated. keep_icc keeps colour profiles. That
+block is not reported as removed, so stripping a stripped file changes
+nothing and removes nothing.
+
+Other formats, and files that don't parse, raise UnsupportedImage. The
+caller then falls back to a pixel-buffer copy (see image_tools.remove_metadata).
+"""
+
+import logging
+import struct
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_METADATA_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME"}
+
+# WebP VP8X flag bits
+_WEBP_ICC = 0x20
+_WEBP_EXIF = 0x08
+_WEBP_XMP = 0x04
+
+
+class UnsupportedImage(ValueError):
+    """The file is not a JPEG/PNG/WebP this module can rewrite."""
+
+
+def strip(data: bytes, keep_orientation: bool = True, keep_icc: bool = False) -> Tuple[bytes, Dict[str, object]]:
+    """
+    Remove metadata from an encoded image.
+
+    Args:
+        data: The whole file
+        keep_orientation: Keep the EXIF orientation tag (as a minimal EXIF block)
+        keep_icc: Keep embedded colour profiles
+
+    Returns:
+        (clean bytes, {"format": ..., "removed": [segment/chunk names]})
+
+    Raises:
+        UnsupportedImage: Not JPEG/PNG/WebP, or malformed
+    """
+    try:
+        if data.startswith(b"\xff\xd8"):
+            return _strip_jpeg(data, keep_orientation, keep_icc)
+        if data.startswith(PNG_SIGNATURE):
+            return _strip_png(data, keep_orientation, keep_icc)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _strip_webp(data, keep_orientation, keep_icc)
+    except (IndexError, struct.error) as e:
+        raise UnsupportedImage(f"Malformed image: {e}") from e
+    raise UnsupportedImage("Not a JPEG, PNG or WebP file")
+
+
+def exif_orientation(exif: bytes) -> Optional[int]:
+    """Orientation (1-8) from a TIFF-structured EXIF block (optionally with the "Exif\\0\\0" prefix)."""
+    if exif.startswith(b"Exif\x00\x00"):
+        exif = exif[6:]
+    if len(exif) < 8 or exif[:2] not in (b"II", b"MM"):
+        return None
+    endian = "<" if exif[:2] == b"II" else ">"
+    ifd_offset = struct.unpack(endian + "I", exif[4:8])[0]
+    if ifd_offset + 2 > len(exif):
+        return None
+    count = struct.unpack(endian + "H", exif[ifd_offset:ifd_offset + 2])[0]
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(exif):
+            return None
+        tag, field_type = struct.unpack(endian + "HH", exif[entry:entry + 4])
+        if tag == 0x0112 and field_type == 3:
+            value = struct.unpack(endian + "H", exif[entry + 8:entry + 10])[0]
+            return value if 1 <= value <= 8 else None
+    return None
+
+
+def orientation_exif(orientation: int) -> bytes:
+    """A TIFF-structured EXIF block (without the "Exif\\0\\0" prefix) holding only the orientation."""
+    return b"MM\x00\x2a" + struct.pack(">I", 8) + struct.pack(">H", 1) \
+        + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack(">I", 0)
+
+
+# Helper functions
+
+def _strip_jpeg(data: bytes, keep_orientation: bool, keep_icc: bool) -> Tuple[bytes, Dict[str, object]]:
+    out: List[bytes] = [b"\xff\xd8"]
+    removed: List[str] = []
+    orientation = None
+    pos = 2
+    length = len(data)
+    inserted_exif = False
+
+    while pos < length:
+        if data[pos] != 0xFF:
+            raise UnsupportedImage(f"Expected a JPEG marker at offset {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker == 0xD9:  # EOI; anything after it (MPF images, vendor trailers) is dropped
+            out.append(b"\xff\xd9")
+            if pos + 2 < length:
+                removed.append(f"trailer ({length - pos - 2} bytes)")
+            break
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:  # standalone markers
+            out.append(data[pos:pos + 2])
+            pos += 2
+            continue
+
+        seg_len = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        seg_end = pos + 2 + seg_len
+        if seg_len < 2 or seg_end > length:
+            raise UnsupportedImage(f"Truncated JPEG segment at offset {pos}")
+        payload = data[pos + 4:seg_end]
+
+        keep = True
+        if marker == 0xE0:  # APP0: keep JFIF, drop JFXX thumbnails and others
+            keep = payload.startswith(b"JFIF\x00")
+        elif marker == 0xE1:  # APP1: EXIF or XMP
+            if payload.startswith(b"Exif\x00\x00") and orientation is None:
+                orientation = exif_orientation(payload)
+            keep = False
+        elif marker == 0xE2:  # APP2: ICC profile or MPF
+            keep = keep_icc and payload.startswith(b"ICC_PROFILE\x00")
+        elif marker == 0xEE:  # APP14 Adobe: needed to decode CMYK/YCCK correctly
+            keep = payload.startswith(b"Adobe")
+        elif 0xE3 <= marker <= 0xEF or marker == 0xFE:  # other APPn, COM
+            keep = False
+
+        if not keep:
+            if not (marker == 0xE1 and _is_kept_orientation_block(payload, keep_orientation)):
+                removed.append(_jpeg_segment_name(marker, payload))
+        else:
+            if marker not in (0xE0,) and not inserted_exif:
+                # The orientation block goes right after JFIF (or SOI), before the frame
+                out.append(_jpeg_orientation_segment(keep_orientation, orientation))
+                inserted_exif = True
+            out.append(data[pos:seg_end])
+
+        pos = seg_end
+        if marker == 0xDA:  # SOS: copy entropy-coded data up to the next real marker
+            scan_end = _jpeg_scan_end(data, pos)
+            out.append(data[pos:scan_end])
+            pos = scan_end
+
+    return b"".join(out), {"format": "JPEG", "removed": removed}
+
+
+def _jpeg_orientation_segment(keep_orientation: bool, orientation: Optional[int]) -> bytes:
+    if not keep_orientation or not orientation or orientation == 1:
+        return b""
+    payload = b"Exif\x00\x00" + orientation_exif(orientation)
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _jpeg_scan_end(data: bytes, pos: int) -> int:
+    """Offset of the first marker after entropy-coded data (skipping stuffed FF00 and RSTn)."""
+    while True:
+        pos = data.find(b"\xff", pos)
+        if pos < 0 or pos + 1 >= len(data):
+            return len(data)
+        following = data[pos + 1]
+        if following == 0x00 or 0xD0 <= following <= 0xD7 or following == 0xFF:
+            pos += 1
+            continue
+        return pos
+
+
+def _jpeg_segment_name(marker: int, payload: bytes) -> str:
+    if marker == 0xFE:
+        return "COM"
+    if marker == 0xE1:
+        if payload.startswith(b"Exif\x00\x00"):
+            return "EXIF"
+        if payload.startswith(b"http://ns.adobe.com/"):
+            return "XMP"
+    if marker == 0xE2 and payload.startswith(b"ICC_PROFILE\x00"):
+        return "ICC"
+    if marker == 0xED:
+        return "IPTC"
+    return f"APP{marker - 0xE0}"
+
+
+def _strip_png(data: bytes, keep_orientation: bool, keep_icc: bool) -> Tuple[bytes, Dict[str, object]]:
+    out: List[bytes] = [PNG_SIGNATURE]
+    removed: List[str] = []
+    orientation = None
+    pos = len(PNG_SIGNATURE)
+
+    while pos < len(data):
+        chunk_len, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        chunk_end = pos + 12 + chunk_len
+        if chunk_end > len(data):
+            raise UnsupportedImage(f"Truncated PNG chunk at offset {pos}")
+
+        body = data[pos + 8:pos + 8 + chunk_len]
+        if chunk_type == b"eXIf":
+            orientation = exif_orientation(body)
+        drop = chunk_type in PNG_METADATA_CHUNKS or (chunk_type == b"iCCP" and not keep_icc)
+        if drop:
+            if not (chunk_type == b"eXIf" and _is_kept_orientation_block(body, keep_orientation)):
+                removed.append(chunk_type.decode("latin-1"))
+        else:
+            # Written before the image data, or before IEND when the source had eXIf after IDAT
+            if chunk_type in (b"IDAT", b"acTL", b"IEND") and keep_orientation and orientation not in (None, 1):
+                out.append(_png_chunk(b"eXIf", orientation_exif(orientation)))
+                orientation = None
+            out.append(data[pos:chunk_end])
+        pos = chunk_end
+        if chunk_type == b"IEND":
+            break
+
+    return b"".join(out), {"format": "PNG", "removed": removed}
+
+
+def _is_kept_orientation_block(exif: bytes, keep_orientation: bool) -> bool:
+    """True for a minimal orientation block as written by this module, which strip() writes back unchanged."""
+    if exif.startswith(b"Exif\x00\x00"):
+        exif = exif[6:]
+    orientation = exif_orientation(exif)
+    return keep_orientation and orientation not in (None, 1) and exif == orientation_exif(orientation)
+
+
+def _png_chunk(chunk_type: bytes, body: bytes) -> bytes:
+    return struct.pack(">I", len(body)) + chunk_type + body + struct.pack(">I", zlib.crc32(chunk_type + body) & 0xFFFFFFFF)
+
+
+def _strip_webp(data: bytes, keep_orientation: bool, keep_icc: bool) -> Tuple[bytes, Dict[str, object]]:
+    chunks: List[Tuple[bytes, bytes]] = []
+    removed: List[str] = []
+    orientation = None
+    end = min(len(data), 8 + struct.unpack("<I", data[4:8])[0])
+    pos = 12
+
+    while pos + 8 <= end:
+        fourcc, size = struct.unpack("<4sI", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + size]
+        if len(body) < size:
+            raise UnsupportedImage(f"Truncated WebP chunk at offset {pos}")
+        pos += 8 + size + (size & 1)
+
+        if fourcc == b"EXIF":
+            orientation = exif_orientation(body)
+            if not _is_kept_orientation_block(body, keep_orientation):
+                removed.append("EXIF")
+        elif fourcc == b"XMP ":
+            removed.append("XMP")
+        elif fourcc == b"ICCP" and not keep_icc:
+            removed.append("ICC")
+        else:
+            chunks.append((fourcc, body))
+
+    if not removed:
+        return data, {"format": "WEBP", "removed": []}
+
+    exif_body = orientation_exif(orientation) if keep_orientation and orientation not in (None, 1) else None
+    if chunks and chunks[0][0] == b"VP8X":
+        flags = chunks[0][1][0] & ~(_WEBP_EXIF | _WEBP_XMP)
+        if not any(fourcc == b"ICCP" for fourcc, _ in chunks):
+            flags &= ~_WEBP_ICC
+        if exif_body:
+            flags |= _WEBP_EXIF
+            chunks.append((b"EXIF", exif_body))
+        chunks[0] = (b"VP8X", bytes([flags]) + chunks[0][1][1:])
+
+    body = b"".join(fourcc + struct.pack("<I", len(chunk)) + chunk + (b"\x00" if len(chunk) & 1 else b"")
+                    for fourcc, chunk in chunks)
+    return b"RIFF" + struct.pack("<I", 4 + len(body)) + b"WEBP" + body, {"format": "WEBP", "removed": removed}
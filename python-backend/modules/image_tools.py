@@ -1,11 +1,9 @@
 import os
 import logging
 import traceback
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageEnhance, ImageFilter
-from pillow_heif import register_heif_opener
-register_heif_opener()
 import io
-import numpy as np
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Setup module-level logger
@@ -13,28 +11,100 @@ logger = logging.getLogger(__name__)
 
 try:
     from modules.security import validate_input_file
+    from modules import result_cache, progress, metrics, tracing, model_registry, inference, superres, bg_removal, image_metadata, pipeline
+    from modules.lazy_imports import lazy_module
 except ImportError:
     from security import validate_input_file
-
-# PREVENT DECOMPRESSION BOMBS
-# 20M pixels = approx 4.5k x 4.5k image. This is a more conservative limit
-# that prevents excessive memory usage while still supporting high-resolution images.
-# For reference: 20MP = ~60MB uncompressed RGB, 100MP = ~300MB
-Image.MAX_IMAGE_PIXELS = 20_000_000
+    import result_cache
+    import progress
+    import metrics
+    import tracing
+    import model_registry
+    import inference
+    import superres
+    import bg_removal
+    import image_metadata
+    import pipeline
+    from lazy_imports import lazy_module
+
+
+def _setup_pil(image_module):
+    """Runs once when PIL.Image is first used by an action."""
+    # PREVENT DECOMPRESSION BOMBS
+    # 20M pixels = approx 4.5k x 4.5k image. This is a more conservative limit
+    # that prevents excessive memory usage while still supporting high-resolution images.
+    # For reference: 20MP = ~60MB uncompressed RGB, 100MP = ~300MB
+    image_module.MAX_IMAGE_PIXELS = 20_000_000
+
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+
+
+# Pillow is imported by the first action that needs it (see lazy_imports.py)
+Image = lazy_module("PIL.Image", on_load=_setup_pil)
+ImageDraw = lazy_module("PIL.ImageDraw")
+ImageFont = lazy_module("PIL.ImageFont")
+ImageOps = lazy_module("PIL.ImageOps")
+ImageEnhance = lazy_module("PIL.ImageEnhance")
+ImageFilter = lazy_module("PIL.ImageFilter")
+
+# CPU-bound actions that api.py runs in a worker process (see worker_pool.py).
+# Palette extraction works on a thumbnail and stays on the thread pool. remove_bg
+# and upscale run in workers too, so a model OOM or native crash only costs that
+# worker; each worker keeps its own models and batch scheduler (inference.py).
+PROCESS_ACTIONS = {
+    "convert", "resize", "compress", "passport", "remove_metadata", "watermark",
+    "grid_split", "generate_icons", "crop", "design", "heic_to_jpg", "pipeline",
+    "remove_bg", "upscale",
+}
+
+# Every action _dispatch_image_action routes; the action comes from the URL, so
+# anything else is rejected before it reaches the cache or a /metrics label
+ACTIONS = PROCESS_ACTIONS | {"extract_palette"}
 
 def handle_image_action(action, payload):
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
     logger.info(f"Handling image action: {action}")
     
     # Security Check
-    files = payload.get("files", [])
-    for f in files:
+    with tracing.span("validate"):
+        files = payload.get("files", [])
+        for f in files:
+            if isinstance(f, str):
+                validate_input_file(f)
+
+        wm_file = payload.get("watermark_file")
+        if wm_file and isinstance(wm_file, str):
+            validate_input_file(wm_file)
+
+    # Timed and counted for /metrics; identical inputs + parameters reuse the stored artifacts
+    with tracing.span("action"):
+        return metrics.observe_action("image_tools", action, payload, _cached_dispatch)
+
+def _cached_dispatch(action, payload):
+    return result_cache.cached_call("image_tools", action, payload, _counted_dispatch)
+
+def _counted_dispatch(action, payload):
+    # Megapixels are counted only when the action runs: a cache hit opens no input
+    _count_megapixels(payload)
+    return _dispatch_image_action(action, payload)
+
+def _count_megapixels(payload):
+    """Input megapixels for /metrics; Image.open only parses the header."""
+    total = 0
+    for f in payload.get("files", []):
         if isinstance(f, str):
-            validate_input_file(f)
-            
-    wm_file = payload.get("watermark_file")
-    if wm_file and isinstance(wm_file, str):
-        validate_input_file(wm_file)
-
+            try:
+                with Image.open(f) as img:
+                    total += img.width * img.height
+            except Exception as e:
+                # A broken input is the action's to report, not the metrics'
+                logger.debug(f"Could not count megapixels of {f}: {e}")
+    if total:
+        metrics.count("megapixels", total / 1_000_000)
+
+def _dispatch_image_action(action, payload):
     if action == "convert":
         return convert_images(payload)
     elif action == "resize":
@@ -63,68 +133,72 @@ def handle_image_action(action, payload):
         return heic_to_jpg(payload)
     elif action == "upscale":
         return upscale_images(payload)
+    elif action == "pipeline":
+        return run_pipeline(payload)
     else:
         raise ValueError(f"Unknown action: {action}")
 
+# Map common format aliases
+FORMAT_MAP = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+    'bmp': 'BMP',
+    'ico': 'ICO',
+    'pdf': 'PDF'
+}
+
+def _prepare_for_format(img, pil_format):
+    """Convert the image mode if the target format needs it."""
+    # JPEG doesn't support transparency
+    if pil_format == 'JPEG' and img.mode in ('RGBA', 'P'):
+        img = img.convert('RGB')
+    elif pil_format == 'PDF':
+        # PDF conversion often prefers RGB, though some support exists for others
+        # Standardizing on RGB helps avoid errors
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+    elif pil_format == 'ICO':
+        if img.mode == 'P': img = img.convert('RGBA')
+    return img
+
 def convert_images(payload):
     files = payload.get("files", [])
     target_format = payload.get("target_format", "png").lower()
     processed_files = []
     errors = []
-    
-    # Map common format aliases
-    format_map = {
-        'jpg': 'JPEG',
-        'jpeg': 'JPEG',
-        'png': 'PNG',
-        'webp': 'WEBP',
-        'bmp': 'BMP',
-        'ico': 'ICO',
-        'pdf': 'PDF'
-    }
-    
-    pil_format = format_map.get(target_format, target_format.upper())
-    
-    for file_path in files:
+
+    pil_format = FORMAT_MAP.get(target_format, target_format.upper())
+
+    for file_path in progress.each(files, "Converting image"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
 
             with Image.open(file_path) as img:
                 # Convert mode if necessary
-                # JPEG doesn't support transparency
-                if pil_format == 'JPEG' and img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-                elif pil_format == 'PDF':
-                    # PDF conversion often prefers RGB, though some support exists for others
-                    # Standardizing on RGB helps avoid errors
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                elif pil_format == 'ICO':
-                     if img.mode == 'P': img = img.convert('RGBA')
-                
+                img = _prepare_for_format(img, pil_format)
+
                 base, _ = os.path.splitext(file_path)
                 output_path = f"{base}.{target_format}"
-                
+
                 if output_path == file_path:
                     output_path = f"{base}_converted.{target_format}"
-                
+
                 img.save(output_path, format=pil_format)
                 processed_files.append(output_path)
-                
+
         except Exception as e:
             logger.error(f"Error converting {file_path}: {e}")
             errors.append({"file": file_path, "error": str(e)})
-            
+
     return {"processed_files": processed_files, "errors": errors}
 
-def resize_images(payload):
-    files = payload.get("files", [])
-    width = payload.get("width")
-    height = payload.get("height")
-    percentage = payload.get("percentage")
-    resize_mode = payload.get("resize_mode", "pixel")  # "pixel" or "percentage"
-    maintain_aspect = payload.get("maintain_aspect", True)
+def _resize_options(params):
+    width = params.get("width")
+    height = params.get("height")
+    percentage = params.get("percentage")
 
     # Convert numeric strings to proper types
     try:
@@ -137,52 +211,71 @@ def resize_images(payload):
     except (ValueError, TypeError):
         pass
 
+    return {
+        "width": width,
+        "height": height,
+        "percentage": percentage,
+        "resize_mode": params.get("resize_mode", "pixel"),  # "pixel" or "percentage"
+        "maintain_aspect": params.get("maintain_aspect", True),
+    }
+
+def _resize_image(img, options):
+    """Resize per _resize_options(); returns the resized image (thumbnail works in place)."""
+    width, height, percentage = options["width"], options["height"], options["percentage"]
+    maintain_aspect = options["maintain_aspect"]
+    original_w, original_h = img.size
+    new_w, new_h = original_w, original_h
+
+    # Use resize_mode to determine which parameters to use
+    if options["resize_mode"] == "percentage" and percentage:
+        factor = percentage / 100.0
+        new_w = int(original_w * factor)
+        new_h = int(original_h * factor)
+    else:
+        # Pixel mode (default)
+        if width and height:
+            if maintain_aspect:
+                # If both provided with aspect, fit within box
+                img.thumbnail((width, height), Image.Resampling.LANCZOS)
+                # thumbnail modifies in place and preserves aspect
+                new_w, new_h = img.size
+                # We don't need to resize again if we used thumbnail
+            else:
+                new_w, new_h = width, height
+        elif width:
+            new_w = width
+            if maintain_aspect:
+                ratio = width / original_w
+                new_h = int(original_h * ratio)
+        elif height:
+            new_h = height
+            if maintain_aspect:
+                ratio = height / original_h
+                new_w = int(original_w * ratio)
+
+    # Perform resize if we didn't use thumbnail
+    if (new_w, new_h) != img.size:
+        img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    return img
+
+def resize_images(payload):
+    files = payload.get("files", [])
+    options = _resize_options(payload)
+
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Resizing image"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
 
             with Image.open(file_path) as img:
-                original_w, original_h = img.size
-                new_w, new_h = original_w, original_h
-
-                # Use resize_mode to determine which parameters to use
-                if resize_mode == "percentage" and percentage:
-                    factor = percentage / 100.0
-                    new_w = int(original_w * factor)
-                    new_h = int(original_h * factor)
-                else:
-                    # Pixel mode (default)
-                    if width and height:
-                        if maintain_aspect:
-                            # If both provided with aspect, fit within box
-                            img.thumbnail((width, height), Image.Resampling.LANCZOS)
-                            # thumbnail modifies in place and preserves aspect
-                            new_w, new_h = img.size
-                            # We don't need to resize again if we used thumbnail
-                        else:
-                            new_w, new_h = width, height
-                    elif width:
-                        new_w = width
-                        if maintain_aspect:
-                            ratio = width / original_w
-                            new_h = int(original_h * ratio)
-                    elif height:
-                        new_h = height
-                        if maintain_aspect:
-                            ratio = height / original_h
-                            new_w = int(original_w * ratio)
-
-                # Perform resize if we didn't use thumbnail
-                if (new_w, new_h) != img.size:
-                    img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+                img = _resize_image(img, options)
 
                 base, ext = os.path.splitext(file_path)
                 output_path = f"{base}_resized{ext}"
-                
+
                 img.save(output_path)
                 processed_files.append(output_path)
 
@@ -192,19 +285,90 @@ def resize_images(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
-def compress_images(payload):
-    files = payload.get("files", [])
-    quality = payload.get("quality", 80) # 1-100
+def _save_compressed(img, output_path, save_format, params, **save_options):
+    """
+    Encode with the compress action's settings: quality (1-100), level (0-2)
+    or target_size_kb. PNG is quantized, JPEG/WEBP use the quality setting.
+    save_options (e.g. exif) are passed to the final save only.
+    """
+    quality = params.get("quality", 80) # 1-100
     if quality is None:
         quality = 80
-    target_size_kb = payload.get("target_size_kb") # Optional target size in KB
+    target_size_kb = params.get("target_size_kb") # Optional target size in KB
+
+    if target_size_kb:
+        target_bytes = target_size_kb * 1024
+
+        if save_format == 'PNG':
+            # PNG Strategy: Reduce colors (Quantize)
+            # We try to reduce colors until it fits
+            colors = 256
+            best_img = img
+
+            while colors >= 16:
+                buf = io.BytesIO()
+                temp_img = img.quantize(colors=colors, method=2)
+                temp_img.save(buf, format=save_format, optimize=True)
+                if buf.tell() <= target_bytes:
+                    best_img = temp_img
+                    break
+                colors //= 2
+
+            best_img.save(output_path, format=save_format, optimize=True, **save_options)
+
+        else:
+            # JPEG/WEBP Strategy: Binary search quality
+            min_q = 5
+            max_q = 100
+            best_q = 5 # Default fallback
+
+            while min_q <= max_q:
+                curr_q = (min_q + max_q) // 2
+                buf = io.BytesIO()
+                img.save(buf, format=save_format, quality=curr_q, optimize=True)
+                size = buf.tell()
+
+                if size <= target_bytes:
+                    best_q = curr_q
+                    min_q = curr_q + 1 # Try higher quality if it fits
+                else:
+                    max_q = curr_q - 1 # Needs lower quality
+
+            img.save(output_path, format=save_format, quality=best_q, optimize=True, **save_options)
+
+    else:
+        # Level-based / Fixed Quality
+        level = params.get("level")
+        if level is not None:
+            try:
+                level = int(level)
+                if level == 0: quality = 90 # Low compression
+                elif level == 1: quality = 75 # Medium
+                elif level == 2: quality = 30 # High compression (Aggressive)
+            except:
+                pass
+
+        if save_format == 'PNG':
+            # PNG Quantization Strategy
+            colors = 256
+            if quality <= 80: colors = 128
+            if quality <= 40: colors = 32
+
+            logger.info(f"PNG Compression. Quality:{quality} -> Colors:{colors}")
+            img = img.quantize(colors=colors, method=2)
+            img.save(output_path, format=save_format, optimize=True, **save_options)
+        else:
+            # JPEG/WEBP
+            logger.info(f"JPEG/WEBP Compression. Quality: {quality}")
+            img.save(output_path, format=save_format, quality=quality, optimize=True, **save_options)
+
+def compress_images(payload):
+    files = payload.get("files", [])
 
     processed_files = []
     errors = []
 
-    import io
-
-    for file_path in files:
+    for file_path in progress.each(files, "Compressing image"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
@@ -241,71 +405,7 @@ def compress_images(payload):
                 initial_size = os.path.getsize(file_path)
                 logger.info(f"Compressing {file_path}. Initial Size: {initial_size} bytes. Format: {save_format}")
 
-                if target_size_kb:
-                    target_bytes = target_size_kb * 1024
-                    
-                    if save_format == 'PNG':
-                        # PNG Strategy: Reduce colors (Quantize)
-                        # We try to reduce colors until it fits
-                        colors = 256
-                        best_img = img
-                        
-                        while colors >= 16:
-                            buf = io.BytesIO()
-                            temp_img = img.quantize(colors=colors, method=2)
-                            temp_img.save(buf, format=save_format, optimize=True)
-                            if buf.tell() <= target_bytes:
-                                best_img = temp_img
-                                break
-                            colors //= 2
-                            
-                        best_img.save(output_path, format=save_format, optimize=True)
-                        
-                    else:
-                        # JPEG/WEBP Strategy: Binary search quality
-                        min_q = 5
-                        max_q = 100
-                        best_q = 5 # Default fallback
-                        
-                        while min_q <= max_q:
-                            curr_q = (min_q + max_q) // 2
-                            buf = io.BytesIO()
-                            img.save(buf, format=save_format, quality=curr_q, optimize=True)
-                            size = buf.tell()
-                            
-                            if size <= target_bytes:
-                                best_q = curr_q
-                                min_q = curr_q + 1 # Try higher quality if it fits
-                            else:
-                                max_q = curr_q - 1 # Needs lower quality
-                                
-                        img.save(output_path, format=save_format, quality=best_q, optimize=True)
-
-                else:
-                    # Level-based / Fixed Quality
-                    level = payload.get("level")
-                    if level is not None:
-                        try:
-                            level = int(level)
-                            if level == 0: quality = 90 # Low compression
-                            elif level == 1: quality = 75 # Medium
-                            elif level == 2: quality = 30 # High compression (Aggressive)
-                        except:
-                            pass
-                    
-                    if save_format == 'PNG':
-                        # PNG Quantization Strategy
-                        colors = 256
-                        if quality <= 80: colors = 128
-                        if quality <= 40: colors = 32
-                        
-                        logger.info(f"PNG Compression. Quality:{quality} -> Colors:{colors}")
-                        img = img.quantize(colors=colors, method=2)
-                        img.save(output_path, format=save_format, optimize=True)
-                    else:
-                        # JPEG/WEBP
-                        logger.info(f"JPEG/WEBP Compression. Quality: {quality}")
-                        img.save(output_path, format=save_format, quality=quality, optimize=True)
+                _save_compressed(img, output_path, save_format, payload)
 
                 final_size = os.path.exists(output_path) and os.path.getsize(output_path) or 0
                 logger.info(f"Compressed {file_path}. Final Size: {final_size} bytes.")
@@ -349,7 +449,7 @@ def create_passport_photos(payload):
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Creating passport photo"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File path not found: {file_path}")
@@ -428,57 +528,69 @@ def create_passport_photos(payload):
     return {"processed_files": processed_files, "errors": errors}
 
 def remove_metadata(payload):
+    """
+    Strip EXIF/XMP/IPTC/ICC/text metadata into {base}_clean{ext}.
+
+    JPEG, PNG and WebP are rewritten at the container level without decoding
+    pixels (see image_metadata.py), so the image data is bit-identical. Other
+    formats, or files the container parser rejects, are copied through a
+    pixel buffer and re-saved. Options: keep_orientation (default true) and
+    keep_icc (default false).
+    """
     files = payload.get("files", [])
+    keep_orientation = payload.get("keep_orientation", True)
+    keep_icc = payload.get("keep_icc", False)
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Removing metadata"):
         try:
-            with Image.open(file_path) as img:
-                data = list(img.getdata())
-                # Create a new image without metadata
-                clean_img = Image.new(img.mode, img.size)
-                clean_img.putdata(data)
-                
-                base, ext = os.path.splitext(file_path)
-                output_path = f"{base}_clean{ext}"
-                
-                # Save without extra info
-                clean_img.save(output_path)
-                processed_files.append(output_path)
+            base, ext = os.path.splitext(file_path)
+            output_path = f"{base}_clean{ext}"
+            with open(file_path, "rb") as f:
+                data = f.read()
+            try:
+                clean, info = image_metadata.strip(data, keep_orientation=keep_orientation, keep_icc=keep_icc)
+                with open(output_path, "wb") as f:
+                    f.write(clean)
+                metrics.count("metadata_strip_container")
+                logger.debug(f"Stripped {info['format']} {file_path}: {', '.join(info['removed']) or 'nothing'}")
+            except image_metadata.UnsupportedImage as e:
+                logger.debug(f"Container strip not possible for {file_path} ({e}); copying pixels")
+                _copy_without_metadata(file_path, output_path, keep_icc)
+                metrics.count("metadata_strip_fallback")
+            processed_files.append(output_path)
         except Exception as e:
             errors.append({"file": file_path, "error": str(e)})
 
     return {"processed_files": processed_files, "errors": errors}
 
-def watermark_images(payload):
-    files = payload.get("files", [])
-    
-    # Text Settings
-    text = payload.get("text", "Watermark")
+def _copy_without_metadata(file_path, output_path, keep_icc):
+    """Fallback for formats without a container stripper: one C-level buffer copy, then save."""
+    with Image.open(file_path) as img:
+        img.load()
+        clean_img = Image.frombytes(img.mode, img.size, img.tobytes())
+        if img.mode in ("P", "PA"):
+            clean_img.putpalette(img.getpalette())
+        save_options = {}
+        if "transparency" in img.info:
+            save_options["transparency"] = img.info["transparency"]
+        if keep_icc and img.info.get("icc_profile"):
+            save_options["icc_profile"] = img.info["icc_profile"]
+        if img.format in ("JPEG", "WEBP"):
+            # Only malformed files get here; re-encode at high quality
+            save_options["quality"] = 95
+        clean_img.save(output_path, format=img.format, **save_options)
+
+def _watermark_options(params):
+    """Watermark settings from a payload (or a pipeline step)."""
     # Opacity from frontend is 0.0-1.0, PIL needs 0-255
-    opacity_float = payload.get("opacity")
+    opacity_float = params.get("opacity")
     if opacity_float is None: opacity_float = 0.5
     else: opacity_float = float(opacity_float)
-    opacity = int(opacity_float * 255)
-    
-    text_size_percent = payload.get("size", 10) # size of text/image relative to main image height
-    # We can use font_size param if provided, otherwise fallback to percentage logic
-    font_size_param = payload.get("font_size")
-    
-    color_hex = payload.get("color")
-    if not color_hex: color_hex = "#FFFFFF"
 
-    # Image Settings
-    watermark_file = payload.get("watermark_file") 
-    if isinstance(watermark_file, list) and len(watermark_file) > 0:
-        watermark_file = watermark_file[0]
-    
-    # Position
-    position = payload.get("position", "center")
-    
-    processed_files = []
-    errors = []
+    color_hex = params.get("color")
+    if not color_hex: color_hex = "#FFFFFF"
 
     # Helper to convert hex to rgb
     def hex_to_rgb(h):
@@ -487,129 +599,166 @@ def watermark_images(payload):
             return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
         except:
             return (255, 255, 255) # Fallback to white
-    
-    text_color_rgb = hex_to_rgb(color_hex)
 
-    for file_path in files:
+    # Image Settings
+    watermark_file = params.get("watermark_file")
+    if isinstance(watermark_file, list) and len(watermark_file) > 0:
+        watermark_file = watermark_file[0]
+
+    return {
+        # Text Settings
+        "text": params.get("text", "Watermark"),
+        "opacity": int(opacity_float * 255),
+        "text_size_percent": params.get("size", 10), # size of text/image relative to main image height
+        # We can use font_size param if provided, otherwise fallback to percentage logic
+        "font_size": params.get("font_size"),
+        "text_color_rgb": hex_to_rgb(color_hex),
+        "watermark_file": watermark_file,
+        # Position
+        "position": params.get("position", "center"),
+        "x": params.get("x", 0.5),
+        "y": params.get("y", 0.5),
+    }
+
+def _watermark_image(img, options):
+    """Composite the text or image watermark onto an RGBA image; returns the new image."""
+    text = options["text"]
+    opacity = options["opacity"]
+    text_size_percent = options["text_size_percent"]
+    font_size_param = options["font_size"]
+    text_color_rgb = options["text_color_rgb"]
+    watermark_file = options["watermark_file"]
+    position = options["position"]
+
+    # Create a transparent layer for the watermark
+    watermark_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
+
+    wm_width, wm_height = 0, 0
+    wm_content = None # For image watermark
+    font = None # For text watermark
+
+    # --- Prepare Watermark Content ---
+    if watermark_file and isinstance(watermark_file, str) and os.path.exists(watermark_file):
+        # Image Watermark
+        with Image.open(watermark_file).convert("RGBA") as wm_img:
+            # Resize watermark logic
+            # If font_size_param is provided, treat it as percentage (10-100)
+            scale_percent = 15 # Default 15%
+            if font_size_param:
+                try:
+                    val = float(font_size_param)
+                    if val > 0: scale_percent = val
+                except: pass
+
+            target_h = int(img.height * (scale_percent / 100))
+            # Min size constraint
+            if target_h < 20: target_h = 20
+
+            aspect = wm_img.width / wm_img.height
+            target_w = int(target_h * aspect)
+
+            wm_content = wm_img.resize((target_w, target_h), Image.Resampling.LANCZOS)
+
+            # Apply opacity to image
+            if opacity < 255:
+                # Get alpha channel
+                r, g, b, a_channel = wm_content.split()
+                # Apply factor
+                alpha_factor = opacity / 255.0
+                a_channel = a_channel.point(lambda p: int(p * alpha_factor))
+                wm_content.putalpha(a_channel)
+
+            wm_width, wm_height = wm_content.size
+    else:
+        # Text Watermark
+        draw_dummy = ImageDraw.Draw(watermark_layer)
+
+        if font_size_param:
+             fontsize = int(font_size_param)
+        else:
+             fontsize = int(img.height * (text_size_percent / 100))
+
+        if fontsize < 10: fontsize = 10
+
+        try:
+            font = ImageFont.truetype("arial.ttf", fontsize)
+        except:
+            try:
+                # Try generic naming for linux/mac if needed, or fallback
+                font = ImageFont.truetype("Arial", fontsize)
+            except:
+                font = ImageFont.load_default()
+
+        # Calculate text size using textbbox (Fixes AttributeError)
+        try:
+             bbox = draw_dummy.textbbox((0, 0), text, font=font)
+             wm_width = bbox[2] - bbox[0]
+             wm_height = bbox[3] - bbox[1]
+        except AttributeError:
+             # Fallback for very old Pillow if somehow present
+             w, h = draw_dummy.textsize(text, font=font)
+             wm_width, wm_height = w, h
+
+    # --- Calculate Position ---
+    margin = 20
+
+    if position == "custom":
+        # Custom Logic (Percent 0-1)
+        try:
+            percent_x = float(options["x"])
+            percent_y = float(options["y"])
+            draw_x = int(img.width * percent_x)
+            draw_y = int(img.height * percent_y)
+        except:
+            draw_x = (img.width - wm_width) // 2
+            draw_y = (img.height - wm_height) // 2
+    elif position == "top-left":
+        draw_x = margin
+        draw_y = margin
+    elif position == "top-center":
+        draw_x = (img.width - wm_width) // 2
+        draw_y = margin
+    elif position == "top-right":
+        draw_x = img.width - wm_width - margin
+        draw_y = margin
+    elif position == "bottom-left":
+        draw_x = margin
+        draw_y = img.height - wm_height - margin
+    elif position == "bottom-center":
+        draw_x = (img.width - wm_width) // 2
+        draw_y = img.height - wm_height - margin
+    elif position == "bottom-right":
+        draw_x = img.width - wm_width - margin
+        draw_y = img.height - wm_height - margin
+    else:
+        # Center
+        draw_x = (img.width - wm_width) // 2
+        draw_y = (img.height - wm_height) // 2
+
+    # --- Apply Watermark ---
+    if wm_content:
+         # Paste Image
+         watermark_layer.paste(wm_content, (draw_x, draw_y))
+    else:
+         # Draw Text
+         draw = ImageDraw.Draw(watermark_layer)
+         draw.text((draw_x, draw_y), text, fill=text_color_rgb + (opacity,), font=font)
+
+    # Composite
+    return Image.alpha_composite(img, watermark_layer)
+
+def watermark_images(payload):
+    files = payload.get("files", [])
+    options = _watermark_options(payload)
+
+    processed_files = []
+    errors = []
+
+    for file_path in progress.each(files, "Watermarking image"):
         try:
             with Image.open(file_path).convert("RGBA") as img:
-                # Create a transparent layer for the watermark
-                watermark_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
-                
-                wm_width, wm_height = 0, 0
-                wm_content = None # For image watermark
-                font = None # For text watermark
-                
-                # --- Prepare Watermark Content ---
-                if watermark_file and isinstance(watermark_file, str) and os.path.exists(watermark_file):
-                    # Image Watermark
-                    with Image.open(watermark_file).convert("RGBA") as wm_img:
-                        # Resize watermark logic
-                        # If font_size_param is provided, treat it as percentage (10-100)
-                        scale_percent = 15 # Default 15%
-                        if font_size_param:
-                            try:
-                                val = float(font_size_param)
-                                if val > 0: scale_percent = val
-                            except: pass
-                        
-                        target_h = int(img.height * (scale_percent / 100))
-                        # Min size constraint
-                        if target_h < 20: target_h = 20
-                        
-                        aspect = wm_img.width / wm_img.height
-                        target_w = int(target_h * aspect)
-                        
-                        wm_content = wm_img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-                        
-                        # Apply opacity to image
-                        if opacity < 255:
-                            # Get alpha channel
-                            r, g, b, a_channel = wm_content.split()
-                            # Apply factor
-                            alpha_factor = opacity / 255.0
-                            a_channel = a_channel.point(lambda p: int(p * alpha_factor))
-                            wm_content.putalpha(a_channel)
-                            
-                        wm_width, wm_height = wm_content.size
-                else:
-                    # Text Watermark
-                    draw_dummy = ImageDraw.Draw(watermark_layer)
-                    
-                    if font_size_param:
-                         fontsize = int(font_size_param)
-                    else:
-                         fontsize = int(img.height * (text_size_percent / 100))
-                         
-                    if fontsize < 10: fontsize = 10
-                    
-                    try:
-                        font = ImageFont.truetype("arial.ttf", fontsize)
-                    except:
-                        try:
-                            # Try generic naming for linux/mac if needed, or fallback
-                            font = ImageFont.truetype("Arial", fontsize)
-                        except:
-                            font = ImageFont.load_default()
-                        
-                    # Calculate text size using textbbox (Fixes AttributeError)
-                    try:
-                         bbox = draw_dummy.textbbox((0, 0), text, font=font)
-                         wm_width = bbox[2] - bbox[0]
-                         wm_height = bbox[3] - bbox[1]
-                    except AttributeError:
-                         # Fallback for very old Pillow if somehow present
-                         w, h = draw_dummy.textsize(text, font=font)
-                         wm_width, wm_height = w, h
-                    
-                # --- Calculate Position ---
-                margin = 20
-                
-                if position == "custom":
-                    # Custom Logic (Percent 0-1)
-                    try:
-                        percent_x = float(payload.get("x", 0.5))
-                        percent_y = float(payload.get("y", 0.5))
-                        draw_x = int(img.width * percent_x)
-                        draw_y = int(img.height * percent_y)
-                    except:
-                        draw_x = (img.width - wm_width) // 2
-                        draw_y = (img.height - wm_height) // 2
-                elif position == "top-left":
-                    draw_x = margin
-                    draw_y = margin
-                elif position == "top-center":
-                    draw_x = (img.width - wm_width) // 2
-                    draw_y = margin
-                elif position == "top-right":
-                    draw_x = img.width - wm_width - margin
-                    draw_y = margin
-                elif position == "bottom-left":
-                    draw_x = margin
-                    draw_y = img.height - wm_height - margin
-                elif position == "bottom-center":
-                    draw_x = (img.width - wm_width) // 2
-                    draw_y = img.height - wm_height - margin
-                elif position == "bottom-right":
-                    draw_x = img.width - wm_width - margin
-                    draw_y = img.height - wm_height - margin
-                else:
-                    # Center
-                    draw_x = (img.width - wm_width) // 2
-                    draw_y = (img.height - wm_height) // 2
-                    
-                # --- Apply Watermark ---
-                if wm_content:
-                     # Paste Image
-                     watermark_layer.paste(wm_content, (draw_x, draw_y))
-                else:
-                     # Draw Text
-                     draw = ImageDraw.Draw(watermark_layer)
-                     draw.text((draw_x, draw_y), text, fill=text_color_rgb + (opacity,), font=font)
-                
-                # Composite
-                out = Image.alpha_composite(img, watermark_layer)
-                
+                out = _watermark_image(img, options)
+
                 base, ext = os.path.splitext(file_path)
                 output_path = f"{base}_watermarked.png"
                 
@@ -634,7 +783,7 @@ def grid_split(payload):
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Splitting image"):
         try:
             with Image.open(file_path) as img:
                 w, h = img.size
@@ -667,7 +816,7 @@ def generate_icons(payload):
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Generating icons"):
         try:
             with Image.open(file_path) as img:
                 # Ensure square
@@ -700,7 +849,7 @@ def extract_palette(payload):
     results = {}
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Extracting palette"):
         try:
             with Image.open(file_path) as img:
                 # Resize to speed up
@@ -725,14 +874,47 @@ def extract_palette(payload):
     # 'extract_palette' returns data, not just files
     return {"data": results, "processed_files": [], "errors": errors}
 
+def _crop_image(img, crop_box, file_path):
+    """Crop to crop_box ({x, y, width, height}, or {file_path: box} per file); full image if unset."""
+    # Resolve crop box
+    logger.debug(f"crop_box: {crop_box}")
+    current_crop = None
+    if isinstance(crop_box, dict):
+        if 'x' in crop_box or 'width' in crop_box or 'height' in crop_box:
+            current_crop = crop_box
+        elif file_path in crop_box:
+            current_crop = crop_box[file_path]
+
+    if not current_crop:
+        # No crop defined - Fallback to full image
+        logger.warning(f"No crop coordinates provided for {file_path}, using full image.")
+        current_crop = {'x': 0, 'y': 0, 'width': img.width, 'height': img.height}
+
+    def safe_int(val, default=0):
+        try:
+            if val is None: return default
+            return int(float(val))
+        except (ValueError, TypeError):
+            return default
+
+    x = safe_int(current_crop.get('x'), 0)
+    y = safe_int(current_crop.get('y'), 0)
+    w = safe_int(current_crop.get('width'), img.width)
+    h = safe_int(current_crop.get('height'), img.height)
+
+    # Check bounds
+    if w <= 0: w = 1
+    if h <= 0: h = 1
+
+    # Perform Crop
+    return img.crop((x, y, x + w, y + h))
+
 def crop_images(payload):
     files = payload.get('files', [])
-    crop_box = payload.get('crop_box') # {x, y, width, height} or {file_path: box}
-    
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Cropping image"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f'File not found: {file_path}')
@@ -744,40 +926,8 @@ def crop_images(payload):
                 except:
                     pass
 
-                # Resolve crop box
-                crop_box = payload.get("crop_box")
-                print(f"DEBUG: image_tools crop_box: {crop_box}")
-                current_crop = None
-                if isinstance(crop_box, dict):
-                    if 'x' in crop_box or 'width' in crop_box or 'height' in crop_box:
-                        current_crop = crop_box
-                    elif file_path in crop_box:
-                        current_crop = crop_box[file_path]
-                
-                if not current_crop:
-                    # No crop defined - Fallback to full image
-                    print(f"WARNING: No crop coordinates provided for {file_path}, using full image.")
-                    current_crop = {'x': 0, 'y': 0, 'width': img.width, 'height': img.height}
+                cropped = _crop_image(img, payload.get("crop_box"), file_path)
 
-                def safe_int(val, default=0):
-                    try:
-                        if val is None: return default
-                        return int(float(val))
-                    except (ValueError, TypeError):
-                        return default
-
-                x = safe_int(current_crop.get('x'), 0)
-                y = safe_int(current_crop.get('y'), 0)
-                w = safe_int(current_crop.get('width'), img.width)
-                h = safe_int(current_crop.get('height'), img.height)
-                
-                # Check bounds
-                if w <= 0: w = 1
-                if h <= 0: h = 1
-                
-                # Perform Crop
-                cropped = img.crop((x, y, x + w, y + h))
-                
                 base, ext = os.path.splitext(file_path)
                 output_path = f'{base}_cropped{ext}'
                 
@@ -814,7 +964,7 @@ def design_images(payload):
     processed_files = []
     errors = []
 
-    for file_path in files:
+    for file_path in progress.each(files, "Designing image"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
@@ -957,46 +1107,83 @@ def design_images(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
+def _load_rembg_session(model_name):
+    """
+    model_registry loader: a rembg session and the size of its ONNX file. The
+    onnxruntime session inside is wrapped so that concurrent requests are
+    micro-batched (see inference.py).
+    """
+    from rembg import new_session
+    session = new_session(model_name)
+    if hasattr(session, "inner_session"):
+        session.inner_session = inference.BatchedOnnxSession(session.inner_session, f"rembg:{model_name}")
+    model_home = os.getenv("U2NET_HOME", os.path.join(os.path.expanduser("~"), ".u2net"))
+    model_file = os.path.join(model_home, f"{model_name}.onnx")
+    return session, os.path.getsize(model_file) if os.path.exists(model_file) else 0
+
 def remove_background(payload):
     try:
-        from rembg import remove, new_session
+        from rembg import remove
     except ImportError:
         return {"processed_files": [], "errors": ["rembg module not allowed or missing."]}
 
     files = payload.get("files", [])
     model_name = payload.get("model", "u2net") # u2net (general), u2netp (lightweight), u2net_human_seg (human)
+    # CPU mode (bg_removal.py): int8 variants, tuned onnxruntime options, mask inferred at mask_size
+    precision = payload.get("precision")
+    mask_size = payload.get("mask_size")
+    try:
+        mask_size = int(mask_size) if mask_size else None
+    except (ValueError, TypeError):
+        return {"processed_files": [], "errors": [f"Invalid mask_size: {mask_size}"]}
+    cpu_mode = bool(precision or mask_size) or (bg_removal.REMBG_CPU_MODE and model_name in bg_removal.CPU_MODELS)
     
     processed_files = []
     errors = []
     
-    # Pre-initialize session
+    # Loaded once per process and shared between requests
     try:
-        session = new_session(model_name)
+        if cpu_mode:
+            cpu_model = model_registry.get("rembg_cpu", f"{model_name}:{precision or 'fp32'}")
+        else:
+            session = model_registry.get("rembg", model_name)
     except Exception as e:
         logger.error(f"Failed to load rembg model {model_name}: {e}")
         return {"processed_files": [], "errors": [f"Model load error: {str(e)}. Internet required for first run."]}
 
-    for file_path in files:
-        try:
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"File not found: {file_path}")
-            
-            with open(file_path, 'rb') as i:
-                input_data = i.read()
-                # Run rembg
-                output_data = remove(input_data, session=session)
-                
-            base, ext = os.path.splitext(file_path)
-            output_path = f"{base}_nobg.png" # Always PNG for transparency
-            
-            with open(output_path, 'wb') as o:
-                o.write(output_data)
-                
-            processed_files.append(output_path)
-            
-        except Exception as e:
-            logger.error(f"Error removing bg for {file_path}: {e}")
-            errors.append({"file": file_path, "error": str(e)})
+    def remove_one(file_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        base, ext = os.path.splitext(file_path)
+        output_path = f"{base}_nobg.png" # Always PNG for transparency
+
+        if cpu_mode:
+            with Image.open(file_path) as img:
+                img = ImageOps.exif_transpose(img)
+                cpu_model.cutout(img, mask_size).save(output_path, format="PNG")
+            return output_path
+
+        with open(file_path, 'rb') as i:
+            input_data = i.read()
+            # Run rembg
+            output_data = remove(input_data, session=session)
+
+        with open(output_path, 'wb') as o:
+            o.write(output_data)
+        return output_path
+
+    # Files go to the model concurrently so the inference scheduler can batch them
+    workers = max(1, min(len(files), inference.INFERENCE_MAX_BATCH))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="remove-bg") as executor:
+        futures = [executor.submit(contextvars.copy_context().run, remove_one, f) for f in files]
+        for index, (file_path, future) in enumerate(zip(files, futures)):
+            progress.report(index, len(files), f"Removing background {index + 1}/{len(files)}")
+            try:
+                processed_files.append(future.result())
+            except Exception as e:
+                logger.error(f"Error removing bg for {file_path}: {e}")
+                errors.append({"file": file_path, "error": str(e)})
 
     return {"processed_files": processed_files, "errors": errors}
 
@@ -1008,7 +1195,7 @@ def heic_to_jpg(payload):
     processed_files = []
     errors = []
     
-    for file_path in files:
+    for file_path in progress.each(files, "Converting HEIC"):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
@@ -1069,12 +1256,12 @@ def _get_upscale_model_path(scale: int) -> str:
     if scale not in model_urls:
         raise ValueError(f"Unsupported scale factor: {scale}. Supported: 2, 4")
     
-    # Cache directory
-    cache_dir = Path.home() / ".cache" / "offline-tools" / "upscale"
+    # Cache directory (UPSCALE_MODEL_DIR, shared with the ESPCN/FSRCNN models)
+    cache_dir = Path(superres.UPSCALE_MODEL_DIR)
     cache_dir.mkdir(parents=True, exist_ok=True)
     
-    model_filename = f"EDSR_x{scale}.pb"
-    model_path = cache_dir / model_filename
+    model_path = Path(superres.model_path("edsr", scale))
+    model_filename = model_path.name
     
     # If model doesn't exist, download it
     if not model_path.exists():
@@ -1106,55 +1293,84 @@ def _get_upscale_model_path(scale: int) -> str:
     return str(model_path)
 
 
+def _load_upscale_model(model_name):
+    """
+    model_registry loader for names like "edsr_x4" or "fsrcnn_x2": a
+    superres.SuperResModel (tiled, with a pool of network instances) and the
+    model file size. EDSR is downloaded on first use; ESPCN and FSRCNN must
+    already be in UPSCALE_MODEL_DIR.
+    """
+    algorithm, _, scale = model_name.partition("_x")
+    if algorithm not in superres.MODELS or not scale.isdigit() or int(scale) not in superres.MODELS[algorithm]["scales"]:
+        raise ValueError(f"Unknown upscaling model: {model_name}")
+    scale = int(scale)
+    if algorithm == "edsr":
+        model_path = _get_upscale_model_path(scale)
+    else:
+        model_path = superres.model_path(algorithm, scale)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{os.path.basename(model_path)} not found in {superres.UPSCALE_MODEL_DIR}")
+    return superres.SuperResModel(algorithm, scale, model_path), os.path.getsize(model_path)
+
+
+model_registry.register_loader("rembg", _load_rembg_session)
+model_registry.register_loader("rembg_cpu", bg_removal.load)
+model_registry.register_loader("upscale", _load_upscale_model)
+
+
 def upscale_images(payload):
     """
-    Upscale images using OpenCV's dnn_superres with EDSR model.
+    Upscale images using OpenCV's dnn_superres, tile by tile (see superres.py).
     
     Args:
         payload: Dictionary containing:
             - files: List of image file paths
-            - scale_factor: Integer (2 or 4) for upscaling factor
+            - scale_factor: Integer upscaling factor (edsr: 2 or 4; espcn/fsrcnn: 2, 3 or 4)
+            - model: "edsr" (default, best quality), "espcn" or "fsrcnn" (fast)
+            - tile_size: Optional cap on the tile side in pixels
             
     Returns:
         Dictionary with processed_files and errors
     """
     try:
         import cv2
-        from cv2 import dnn_superres
     except ImportError:
         return {"processed_files": [], "errors": ["opencv-contrib-python is required for upscaling. Please install it."]}
     
     files = payload.get("files", [])
     scale_factor = payload.get("scale_factor", 2)
-    
+    algorithm = str(payload.get("model") or "edsr").lower()
+    tile_size = payload.get("tile_size")
+
+    if algorithm not in superres.MODELS:
+        return {"processed_files": [], "errors": [f"Unknown upscaling model: {algorithm}. Supported: {', '.join(superres.MODELS)}"]}
+    supported = superres.MODELS[algorithm]["scales"]
+    supported_text = ", ".join(str(s) for s in supported)
+
     # Validate scale factor
     try:
         scale_factor = int(scale_factor)
-        if scale_factor not in [2, 4]:
-            return {"processed_files": [], "errors": [f"Invalid scale factor: {scale_factor}. Supported: 2, 4"]}
+        if scale_factor not in supported:
+            return {"processed_files": [], "errors": [f"Invalid scale factor: {scale_factor}. Supported: {supported_text}"]}
     except (ValueError, TypeError):
-        return {"processed_files": [], "errors": [f"Invalid scale factor: {scale_factor}. Must be 2 or 4"]}
+        return {"processed_files": [], "errors": [f"Invalid scale factor: {scale_factor}. Must be one of {supported_text}"]}
+
+    try:
+        tile_size = int(tile_size) if tile_size else None
+    except (ValueError, TypeError):
+        tile_size = None
     
     processed_files = []
     errors = []
     
-    # Get model path (downloads if needed)
-    try:
-        model_path = _get_upscale_model_path(scale_factor)
-    except Exception as e:
-        return {"processed_files": [], "errors": [f"Model download failed: {str(e)}"]}
-    
-    # Initialize super resolution object
+    # Loaded once per process (EDSR downloaded on first use) and shared between requests
     try:
-        sr = dnn_superres.DnnSuperResImpl_create()
-        sr.readModel(model_path)
-        sr.setModel("edsr", scale_factor)
-        logger.info(f"EDSR x{scale_factor} model loaded successfully")
+        sr = model_registry.get("upscale", f"{algorithm}_x{scale_factor}")
     except Exception as e:
-        logger.error(f"Failed to load EDSR model: {e}")
+        logger.error(f"Failed to load {algorithm} model: {e}")
         return {"processed_files": [], "errors": [f"Failed to load upscaling model: {str(e)}"]}
-    
-    for file_path in files:
+
+    for index, file_path in enumerate(progress.each(files, "Upscaling image")):
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
@@ -1167,8 +1383,11 @@ def upscale_images(payload):
             original_height, original_width = img.shape[:2]
             logger.info(f"Upscaling {file_path} from {original_width}x{original_height} to {original_width*scale_factor}x{original_height*scale_factor}")
             
-            # Upscale the image
-            upscaled = sr.upsample(img)
+            def on_tile(done, total, index=index):
+                progress.report(index + done / total, len(files), f"Upscaling image {index + 1}/{len(files)}, tile {done}/{total}")
+
+            # Upscale the image in overlapping tiles, several at once
+            upscaled = sr.upscale(img, tile_size=tile_size, on_progress=on_tile)
             
             # Save the upscaled image
             base, ext = os.path.splitext(file_path)
@@ -1189,3 +1408,105 @@ def upscale_images(payload):
             errors.append({"file": file_path, "error": str(e)})
     
     return {"processed_files": processed_files, "errors": errors}
+
+# Pipeline: several steps on one decoded image, encoded once
+
+# Formats whose encoder is driven by _save_compressed
+_COMPRESSIBLE_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+class _PipelineImage:
+    """
+    The working image of a pipeline plus the encode settings collected by the
+    steps: convert picks the output format, compress the encoder options and
+    remove_metadata drops EXIF/ICC. Nothing is written until save().
+    """
+
+    def __init__(self, file_path):
+        with Image.open(file_path) as src:
+            source_format = src.format
+            img = ImageOps.exif_transpose(src)
+            img.load()
+        self.img = img
+        self.exif = img.info.get("exif")
+        self.icc_profile = img.info.get("icc_profile")
+        self.file_path = file_path
+
+        ext = os.path.splitext(file_path)[1].lower().lstrip(".")
+        self.extension = ext or (source_format or "png").lower()
+        self.save_format = FORMAT_MAP.get(self.extension, source_format or "PNG")
+        self.compress_params = None
+        self.strip_metadata = False
+
+    def output_path(self):
+        base, _ = os.path.splitext(self.file_path)
+        return f"{base}_processed.{self.extension}"
+
+    def save(self, output_path):
+        img = _prepare_for_format(self.img, self.save_format)
+        if self.save_format == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+            img = img.convert('RGB')
+
+        save_options = {}
+        if self.strip_metadata:
+            img.info = {}
+        else:
+            if self.exif and self.save_format in ('JPEG', 'PNG', 'WEBP'):
+                save_options["exif"] = self.exif
+            if self.icc_profile:
+                save_options["icc_profile"] = self.icc_profile
+
+        if self.compress_params is not None and self.save_format in _COMPRESSIBLE_FORMATS:
+            _save_compressed(img, output_path, self.save_format, self.compress_params, **save_options)
+        else:
+            img.save(output_path, format=self.save_format, **save_options)
+
+def _step_resize(image, params):
+    image.img = _resize_image(image.img, _resize_options(params))
+
+def _step_crop(image, params):
+    # Either {"crop_box": {...}} as for the crop action or x/y/width/height on the step
+    crop_box = params.get("crop_box") or {k: params[k] for k in ("x", "y", "width", "height") if k in params}
+    image.img = _crop_image(image.img, crop_box, image.file_path)
+
+def _step_watermark(image, params):
+    options = _watermark_options(params)
+    if options["watermark_file"]:
+        validate_input_file(options["watermark_file"])
+    image.img = _watermark_image(image.img.convert("RGBA"), options)
+
+def _step_convert(image, params):
+    target_format = str(params.get("target_format", "png")).lower()
+    image.extension = target_format
+    image.save_format = FORMAT_MAP.get(target_format, target_format.upper())
+
+def _step_compress(image, params):
+    image.compress_params = params
+
+def _step_remove_metadata(image, params):
+    image.strip_metadata = True
+
+# Step name -> handler(image, params); params are those of the standalone action
+PIPELINE_STEPS = {
+    "resize": _step_resize,
+    "crop": _step_crop,
+    "watermark": _step_watermark,
+    "convert": _step_convert,
+    "compress": _step_compress,
+    "remove_metadata": _step_remove_metadata,
+}
+
+def run_pipeline(payload):
+    """
+    Apply an ordered list of steps to each image with one decode and one encode.
+
+    payload["steps"] is a list like
+    [{"action": "resize", "width": 1200}, {"action": "watermark", "text": "DRAFT"},
+     {"action": "compress", "quality": 70}].
+    Each step takes the parameters of the standalone action and works on the
+    decoded PIL image. convert, compress and remove_metadata only change how
+    the result is encoded, wherever they appear in the list. EXIF and ICC
+    data are kept unless remove_metadata is a step.
+
+    Returns processed_files, errors and per-step timings ("steps", see pipeline.run).
+    """
+    return pipeline.run(payload, PIPELINE_STEPS, _PipelineImage, open_label="decode", save_label="encode")
@@ -0,0 +1,253 @@
+"""
+Micro-batching scheduler for ML inference.
+
+Concurrent remove_bg requests used to call onnxruntime one at a time, each
+with its own batch of one. A BatchScheduler puts one thread in front of a
+model. Callers submit() an input and block. The scheduler thread takes the
+first queued input, waits up to INFERENCE_MAX_WAIT_MS for more compatible
+ones (at most INFERENCE_MAX_BATCH), runs them as one call and hands every
+caller its own result. Larger batches give more throughput on CPU-only nodes
+at the cost of up to max_wait of extra latency. INFERENCE_MAX_BATCH=1 turns
+batching off but keeps the single queue.
+
+BatchedOnnxSession wraps an onnxruntime.InferenceSession (e.g. the
+inner_session of a rembg session), so the library's own pre- and
+post-processing stay as they are. Only run() goes through the scheduler.
+Inputs whose shapes match apart from the batch axis are concatenated and
+the outputs split again. If a batched run fails, the inputs are retried one
+by one and the scheduler stops batching.
+
+Only models whose ONNX inputs declare a symbolic batch dimension batch. The
+stock rembg exports of u2net, u2netp, u2net_human_seg and silueta declare a
+fixed [1, 3, 320, 320] input, so they run one input at a time (still through
+the queue); a model re-exported with a dynamic batch axis is batched. Which
+way a model went is logged when it is wrapped.
+
+Schedulers live in the process that loaded the model: remove_bg runs in the
+worker pool, so batches form from the concurrent inputs of one request (its
+files are submitted together) plus any other request on the same worker.
+Workers ship their counters back with each result (drain() / merge()).
+
+A scheduler thread exits after a while without work and starts again on
+the next submit(), so models evicted from model_registry don't leave
+threads behind.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from modules import tracing
+    from modules.lazy_imports import lazy_module
+except ImportError:
+    import tracing
+    from lazy_imports import lazy_module
+
+np = lazy_module("numpy")
+
+logger = logging.getLogger(__name__)
+
+# Most inputs run together in one model call
+INFERENCE_MAX_BATCH = max(1, int(os.getenv("INFERENCE_MAX_BATCH", "4")))
+# How long the first input of a batch waits for others, in milliseconds
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+# Seconds an idle scheduler thread lingers before exiting
+_IDLE_SECONDS = 30
+
+_schedulers: "weakref.WeakSet[BatchScheduler]" = weakref.WeakSet()
+_totals_lock = threading.Lock()
+_totals = {"requests": 0, "batches": 0, "fallbacks": 0}
+
+
+class _Request:
+    __slots__ = ("item", "key", "future")
+
+    def __init__(self, item: Any, key: Any):
+        self.item = item
+        self.key = key
+        self.future: Future = Future()
+
+
+class BatchScheduler:
+    """
+    Runs run_batch(items) -> results (same order) on one thread, grouping
+    inputs submitted within max_wait_ms of each other. Only inputs with equal
+    batch_key(item) share a batch.
+    """
+
+    def __init__(self, name: str, run_batch: Callable[[List[Any]], List[Any]],
+                 max_batch: Optional[int] = None, max_wait_ms: Optional[float] = None,
+                 batch_key: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.max_batch = max(1, max_batch if max_batch is not None else INFERENCE_MAX_BATCH)
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else INFERENCE_MAX_WAIT_MS) / 1000
+        self._run_batch = run_batch
+        self._batch_key = batch_key or (lambda item: None)
+        self._pending: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        _schedulers.add(self)
+
+    def submit(self, item: Any) -> Any:
+        """Queue item, wait for its batch to run and return its result (or raise its error)."""
+        request = _Request(item, self._batch_key(item))
+        with self._cond:
+            self._pending.append(request)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"inference {self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        with tracing.span("inference"):
+            return request.future.result()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(_IDLE_SECONDS)
+                if not self._pending:
+                    self._thread = None
+                    return
+                batch = [self._pending.popleft()]
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch:
+                    request = self._take_compatible(batch[0].key)
+                    if request is not None:
+                        batch.append(request)
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self._run(batch)
+
+    def _take_compatible(self, key: Any) -> Optional[_Request]:
+        """Remove and return the oldest pending request with this key (lock held)."""
+        for request in self._pending:
+            if request.key == key:
+                self._pending.remove(request)
+                return request
+        return None
+
+    def _run(self, batch: List[_Request]) -> None:
+        self.requests += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        with _totals_lock:
+            _totals["requests"] += len(batch)
+            _totals["batches"] += 1
+
+        try:
+            results = self._run_batch([r.item for r in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{len(results)} results for {len(batch)} inputs")
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+                return
+            # Keep one bad input (or a model that can't batch) from failing the others
+            logger.warning(f"Batched inference on {self.name} failed ({e}); running inputs one by one, batching off")
+            self.max_batch = 1
+            with _totals_lock:
+                _totals["fallbacks"] += 1
+            for request in batch:
+                try:
+                    request.future.set_result(self._run_batch([request.item])[0])
+                except Exception as single_error:
+                    request.future.set_exception(single_error)
+            return
+
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+
+
+class BatchedOnnxSession:
+    """onnxruntime.InferenceSession stand-in whose run() calls are micro-batched."""
+
+    def __init__(self, session: Any, name: str, max_batch: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self._session = session
+        if not _dynamic_batch(session):
+            logger.info(f"{name}: fixed batch size in the model inputs, running inputs one at a time")
+            max_batch = 1
+        else:
+            logger.info(f"{name}: dynamic batch axis, micro-batching up to {max_batch or INFERENCE_MAX_BATCH} inputs")
+        self.scheduler = BatchScheduler(name, self._run_batch, max_batch, max_wait_ms, batch_key=_feed_key)
+
+    def run(self, output_names, input_feed, run_options=None):
+        if run_options is not None:
+            return self._session.run(output_names, input_feed, run_options)
+        return self.scheduler.submit((output_names, input_feed))
+
+    def __getattr__(self, attr):
+        return getattr(self._session, attr)
+
+    def _run_batch(self, items):
+        output_names = items[0][0]
+        if len(items) == 1:
+            return [self._session.run(output_names, items[0][1])]
+
+        sizes = [len(next(iter(feed.values()))) for _, feed in items]
+        merged = {name: np.concatenate([feed[name] for _, feed in items], axis=0) for name in items[0][1]}
+        outputs = self._session.run(output_names, merged)
+        total = sum(sizes)
+        if any(getattr(out, "shape", ())[:1] != (total,) for out in outputs):
+            raise ValueError("model outputs have no batch axis")
+        split_points = np.cumsum(sizes)[:-1]
+        per_output = [np.split(out, split_points) for out in outputs]
+        return [[parts[i] for parts in per_output] for i in range(len(items))]
+
+
+def stats() -> Dict[str, Any]:
+    """Totals over all schedulers for /metrics."""
+    with _totals_lock:
+        totals = dict(_totals)
+    schedulers = list(_schedulers)
+    return {
+        **totals,
+        "schedulers": len(schedulers),
+        "queued": sum(len(s._pending) for s in schedulers),
+        "average_batch": round(totals["requests"] / totals["batches"], 3) if totals["batches"] else 0.0,
+    }
+
+
+def drain() -> Dict[str, int]:
+    """Counters added since the last call (worker side, shipped with each result)."""
+    with _totals_lock:
+        totals = dict(_totals)
+        for key in _totals:
+            _totals[key] = 0
+    return totals
+
+
+def merge(totals: Optional[Dict[str, int]]) -> None:
+    """Add counters shipped back from a worker process (parent side)."""
+    with _totals_lock:
+        for key, value in (totals or {}).items():
+            if key in _totals:
+                _totals[key] += value
+
+
+# Helper functions
+
+def _dynamic_batch(session: Any) -> bool:
+    """True if every input's first dimension is symbolic (e.g. "batch_size") rather than fixed."""
+    try:
+        inputs = session.get_inputs()
+    except Exception:
+        return False
+    return bool(inputs) and all(inp.shape and not isinstance(inp.shape[0], int) for inp in inputs)
+
+
+def _feed_key(item):
+    output_names, feed = item
+    names = tuple(output_names) if output_names else None
+    return names, tuple((name, tuple(value.shape[1:]), str(value.dtype)) for name, value in sorted(feed.items()))
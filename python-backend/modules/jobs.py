@@ -0,0 +1,264 @@
+"""
+Asynchronous jobs for long-running tool actions.
+
+Submitting a job returns an id immediately; the action then runs on a bounded
+pool of job runners (which hand CPU-bound actions to worker_pool). State,
+progress and results are kept in a SQLite table inside JOBS_DIR, and each job
+gets its own directory for inputs and artifacts, so completed results survive
+a server restart. JOBS_DIR is persistent storage, not the tmpfs workspace:
+jobs are bounded by JOB_QUEUE_LIMIT and JOB_TTL rather than the workspace
+quota. Jobs that were queued or running when the server stopped are
+marked as failed on start-up.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from modules import worker_pool, workspace, tracing
+except ImportError:
+    import worker_pool
+    import workspace
+    import tracing
+
+logger = logging.getLogger(__name__)
+
+# Job table and job files; must outlive the process (not the tmpfs WORKSPACE_DIR)
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.expanduser("~"), ".offline-tools", "jobs"))
+# Jobs running at the same time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Jobs waiting for a runner before new submissions are rejected
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+# Finished jobs and their files are deleted this long after completion (seconds)
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATES = (SUCCEEDED, FAILED)
+
+# Progress is held in memory for live readers and written to the table at most this often
+_PROGRESS_FLUSH_SECONDS = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    module TEXT NOT NULL,
+    action TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress INTEGER,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+
+class JobQueueFullError(Exception):
+    """Raised when JOB_QUEUE_LIMIT jobs are already waiting."""
+
+
+_db = None
+_db_lock = threading.Lock()
+_runner = None
+_live = {}  # job_id -> {"progress", "message", "flushed_at"} for running jobs
+_live_lock = threading.Lock()
+
+
+def init():
+    """Open the job table, fail jobs interrupted by a restart and start the runners."""
+    global _db, _runner
+    with _db_lock:
+        if _db is not None:
+            return
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        _db = sqlite3.connect(os.path.join(JOBS_DIR, "jobs.sqlite3"), check_same_thread=False)
+        _db.row_factory = sqlite3.Row
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(_SCHEMA)
+        interrupted = _db.execute(
+            "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE state IN (?, ?)",
+            (FAILED, "Interrupted by server restart", time.time(), QUEUED, RUNNING),
+        ).rowcount
+        _db.commit()
+
+    _runner = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job-runner")
+    # The workspace janitor also expires finished jobs; their files don't count against its quota
+    workspace.register_cleanup(purge_expired)
+    workspace.exclude_from_quota(JOBS_DIR)
+    if interrupted:
+        logger.warning(f"Marked {interrupted} interrupted job(s) as failed")
+    logger.info(f"Job runner started with {JOB_WORKERS} workers, table in {JOBS_DIR}")
+
+
+def shutdown():
+    if _runner is not None:
+        _runner.shutdown(wait=False, cancel_futures=True)
+
+
+def new_job_dir():
+    """Create the directory a job's uploads (and therefore its artifacts) go into. Returns (job_id, path)."""
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    os.makedirs(job_dir)
+    return job_id, job_dir
+
+
+def submit(job_id, module_name, action, payload, profile=None):
+    """
+    Queue an action for a job created with new_job_dir().
+    profile ("cprofile" or "sample") runs it under a profiler and writes
+    profile.* files into the job directory.
+    """
+    with _db_lock:
+        queued = _db.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (QUEUED,)).fetchone()[0]
+        if queued >= JOB_QUEUE_LIMIT:
+            raise JobQueueFullError(f"{queued} jobs are already queued")
+        _db.execute(
+            "INSERT INTO jobs (id, module, action, state, progress, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, module_name, action, QUEUED, 0, time.time()),
+        )
+        _db.commit()
+
+    _runner.submit(_run, job_id, module_name, action, payload, profile)
+    return job_id
+
+
+def get(job_id):
+    """Job status as a dict, or None if unknown. Running jobs report their latest progress."""
+    with _db_lock:
+        row = _db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    with _live_lock:
+        live = _live.get(job_id)
+        if live:
+            job["progress"] = live["progress"]
+            job["message"] = live["message"]
+    return job
+
+
+def job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def delete(job_id):
+    """Remove a finished job and its files. Returns False if it is unknown or still active."""
+    job = get(job_id)
+    if job is None or job["state"] not in TERMINAL_STATES:
+        return False
+
+    with _db_lock:
+        _db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        _db.commit()
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    return True
+
+
+def purge_expired():
+    """Delete jobs that finished more than JOB_TTL seconds ago. Returns the number deleted."""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    with _db_lock:
+        rows = _db.execute(
+            "SELECT id FROM jobs WHERE state IN (?, ?) AND finished_at < ?",
+            (*TERMINAL_STATES, cutoff),
+        ).fetchall()
+        _db.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND finished_at < ?",
+            (*TERMINAL_STATES, cutoff),
+        )
+        _db.commit()
+
+    for (job_id,) in rows:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    if rows:
+        logger.info(f"Deleted {len(rows)} expired job(s)")
+    return len(rows)
+
+
+def stats():
+    """Number of jobs per state."""
+    with _db_lock:
+        rows = _db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+    return {state: count for state, count in rows}
+
+
+# Helper functions
+
+def _update(job_id, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with _db_lock:
+        _db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        _db.commit()
+
+
+def _on_progress(job_id, percent, message):
+    now = time.monotonic()
+    with _live_lock:
+        live = _live.setdefault(job_id, {"progress": 0, "message": None, "flushed_at": 0.0})
+        if percent is not None:
+            live["progress"] = percent
+        if message:
+            live["message"] = message
+        flush = now - live["flushed_at"] >= _PROGRESS_FLUSH_SECONDS
+        if flush:
+            live["flushed_at"] = now
+            snapshot = (live["progress"], live["message"])
+
+    if flush:
+        _update(job_id, progress=snapshot[0], message=snapshot[1])
+
+
+def _run(job_id, module_name, action, payload, profile=None):
+    with tracing.traced(f"job {module_name}.{action}", job_id=job_id):
+        _run_traced(job_id, module_name, action, payload, profile)
+
+
+def _run_traced(job_id, module_name, action, payload, profile):
+    _update(job_id, state=RUNNING, started_at=time.time())
+    with _live_lock:
+        _live[job_id] = {"progress": 0, "message": None, "flushed_at": 0.0}
+
+    try:
+        result = worker_pool.run_action_blocking(
+            module_name, action, payload,
+            on_progress=lambda percent, message: _on_progress(job_id, percent, message),
+            profile=(profile, job_dir(job_id)) if profile else None,
+        )
+        errors = result.get("errors") if isinstance(result, dict) else None
+        if errors and not result.get("processed_files") and not result.get("data") and not result.get("image"):
+            _update(job_id, state=FAILED, result=json.dumps(result, default=str),
+                    error=_format_errors(errors), finished_at=time.time())
+        else:
+            _update(job_id, state=SUCCEEDED, progress=100, result=json.dumps(result, default=str),
+                    finished_at=time.time())
+    except Exception as e:
+        logger.exception(f"Job {job_id} ({module_name}.{action}) failed")
+        _update(job_id, state=FAILED, error=str(e), finished_at=time.time())
+    finally:
+        with _live_lock:
+            _live.pop(job_id, None)
+
+
+def _format_errors(errors):
+    messages = []
+    for err in errors:
+        if isinstance(err, dict):
+            messages.append(err.get("error", str(err)))
+        else:
+            messages.append(str(err))
+    return ". ".join(messages) if messages else "Processing failed"
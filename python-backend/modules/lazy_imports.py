@@ -0,0 +1,142 @@
+"""
+Deferred imports for heavy third-party dependencies.
+
+pdf_tools and image_tools declare their dependencies with lazy_module() instead
+of a plain import. The real import happens on first attribute access, i.e. the
+first time an action actually uses the library, so importing a tool module
+(and answering a license check) no longer pays for PyMuPDF, pandas, pikepdf,
+pyhanko, Pillow, ... up front. After loading, the proxy rebinds the module-level
+name in its owner to the real module, so later accesses cost nothing extra.
+
+Every deferred import is timed; profile() / report() list what was loaded, how
+long it took and which function needed it first. prewarm() loads everything
+that is still pending, e.g. from a background thread once the app is idle.
+"""
+
+import importlib
+import logging
+import sys
+import threading
+import time
+import types
+
+logger = logging.getLogger(__name__)
+
+_registry = []  # every LazyModule created, in declaration order
+_profile = {}  # module name -> {"seconds", "first_used_by"}
+_profile_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name, on_load=None, owner_globals=None):
+        super().__init__(name)
+        self.__dict__["_lazy_on_load"] = on_load
+        self.__dict__["_lazy_owner"] = owner_globals
+        self.__dict__["_lazy_module"] = None
+        self.__dict__["_lazy_lock"] = threading.RLock()
+
+    def _lazy_load(self, first_used_by=None):
+        module = self.__dict__["_lazy_module"]
+        if module is not None:
+            return module
+
+        with self.__dict__["_lazy_lock"]:
+            module = self.__dict__["_lazy_module"]
+            if module is not None:
+                return module
+
+            name = self.__name__
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            on_load = self.__dict__["_lazy_on_load"]
+            if on_load is not None:
+                on_load(module)
+            elapsed = time.perf_counter() - start
+
+            self.__dict__["_lazy_module"] = module
+            self._rebind_owner(module)
+
+            with _profile_lock:
+                _profile.setdefault(name, {"seconds": elapsed, "first_used_by": first_used_by})
+            logger.info(f"Loaded {name} in {elapsed * 1000:.0f} ms (first used by {first_used_by})")
+            return module
+
+    def _rebind_owner(self, module):
+        owner = self.__dict__["_lazy_owner"]
+        if owner is None:
+            return
+        for key, value in list(owner.items()):
+            if value is self:
+                owner[key] = module
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") and attr.endswith("__"):
+            # Keep introspection (copy, pickle, inspect) from triggering imports
+            raise AttributeError(attr)
+        caller = sys._getframe(1).f_code.co_name
+        return getattr(self._lazy_load(caller), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_load(sys._getframe(1).f_code.co_name), attr, value)
+
+    def __dir__(self):
+        return dir(self._lazy_load("dir"))
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_module(name, on_load=None):
+    """
+    Declare a module-level dependency that is imported on first use.
+
+    Args:
+        name: Dotted module name, e.g. "pandas" or "PIL.Image"
+        on_load: Optional callback(module) run once right after the import,
+                 for set-up that used to happen at import time
+
+    Returns:
+        A proxy to assign to the module-level name, e.g. pd = lazy_module("pandas")
+    """
+    proxy = LazyModule(name, on_load=on_load, owner_globals=sys._getframe(1).f_globals)
+    _registry.append(proxy)
+    return proxy
+
+
+def prewarm():
+    """Import every dependency that has not been loaded yet. Returns the number loaded."""
+    loaded = 0
+    for proxy in list(_registry):
+        if proxy.__dict__["_lazy_module"] is not None:
+            continue
+        try:
+            proxy._lazy_load("prewarm")
+            loaded += 1
+        except Exception as e:
+            logger.warning(f"Pre-warm of {proxy.__name__} failed: {e}")
+    return loaded
+
+
+def profile():
+    """Deferred imports performed so far, slowest first."""
+    with _profile_lock:
+        items = [{"module": name, **data} for name, data in _profile.items()]
+    pending = sorted({p.__name__ for p in _registry if p.__dict__["_lazy_module"] is None} - set(_profile))
+    items.sort(key=lambda item: -item["seconds"])
+    return {"loaded": items, "pending": pending}
+
+
+def report():
+    """Human-readable import-time profile."""
+    data = profile()
+    lines = [f"{'module':<28} {'ms':>8}  first used by"]
+    for item in data["loaded"]:
+        lines.append(f"{item['module']:<28} {item['seconds'] * 1000:>8.1f}  {item['first_used_by']}")
+    total = sum(item["seconds"] for item in data["loaded"])
+    lines.append(f"{'total':<28} {total * 1000:>8.1f}")
+    if data["pending"]:
+        lines.append(f"not loaded yet: {', '.join(data['pending'])}")
+    return "\n".join(lines)
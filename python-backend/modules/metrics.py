@@ -0,0 +1,357 @@
+"""
+Prometheus-style metrics for tool actions.
+
+observe_action() wraps handle_pdf_action / handle_image_action, so every
+action, including new ones, gets the following without extra code:
+
+- latency histogram
+- bytes in and out
+- pages or megapixels
+- error counts by category
+
+Code running inside an action can add its own counts with count(); the result
+cache uses it for hits and misses.
+
+Actions that api.py runs in worker processes record into a local buffer.
+worker_pool ships that buffer back with the result and merges it into the
+parent, which serves /metrics. Recording an action costs a few dict updates
+under a lock plus a stat() per file, so metrics stay on in production
+(METRICS_ENABLED=false turns them off).
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Latency buckets in seconds: quick previews up to long OCR runs
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Keyword -> category for error strings returned in result["errors"]
+_ERROR_KEYWORDS = (
+    ("password", "password"),
+    ("encrypt", "password"),
+    ("not found", "not_found"),
+    ("no such file", "not_found"),
+    ("corrupt", "invalid_input"),
+    ("damaged", "invalid_input"),
+    ("invalid", "invalid_input"),
+    ("cannot identify", "invalid_input"),
+    ("unsupported", "invalid_input"),
+    ("too large", "limit"),
+    ("exceeds", "limit"),
+    ("decompression bomb", "limit"),
+    ("memory", "memory"),
+    ("timed out", "timeout"),
+    ("timeout", "timeout"),
+    ("tesseract", "dependency"),
+    ("not installed", "dependency"),
+    ("not available", "dependency"),
+)
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, str], List[Any]] = {}  # (module, action) -> [bucket counts, sum, count]
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}  # (name, labels) -> value
+_collectors: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+# Worker processes buffer samples instead of recording them (see buffer_samples())
+_buffering = False
+_pending: List[Dict[str, Any]] = []
+
+# Extra counts for the action currently running in this context
+_current_counts = contextvars.ContextVar("metrics_counts", default=None)
+
+
+def observe_action(module_name: str, action: str, payload: Dict[str, Any],
+                   func: Callable[[str, Dict[str, Any]], Any],
+                   count_units: Optional[Callable[[Dict[str, Any]], None]] = None) -> Any:
+    """
+    Run func(action, payload) and record one sample for it.
+
+    Args:
+        module_name: e.g. "pdf_tools"
+        action: Action name
+        payload: Action payload (input files are measured before the call)
+        func: Dispatcher to time
+        count_units: Optional callback(payload) that calls count("pages", n) /
+                     count("megapixels", n) for the inputs
+
+    Returns:
+        Whatever func returns; exceptions propagate after being recorded
+    """
+    if not METRICS_ENABLED:
+        return func(action, payload)
+
+    counts: Dict[str, float] = {}
+    token = _current_counts.set(counts)
+    bytes_in = _files_size(payload)
+    if count_units is not None:
+        try:
+            count_units(payload)
+        except Exception as e:
+            logger.debug(f"Unit counting failed for {module_name}.{action}: {e}")
+
+    start = time.perf_counter()
+    result = None
+    errors: Dict[str, int] = {}
+    try:
+        result = func(action, payload)
+        return result
+    except Exception as e:
+        category = categorize_exception(e)
+        errors[category] = errors.get(category, 0) + 1
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _current_counts.reset(token)
+        if isinstance(result, dict):
+            for err in result.get("errors") or ():
+                category = categorize_error(err)
+                errors[category] = errors.get(category, 0) + 1
+        _record({
+            "module": module_name,
+            "action": action,
+            "seconds": seconds,
+            "failed": bool(errors) and not _has_output(result),
+            "errors": errors,
+            "bytes_in": bytes_in,
+            "bytes_out": _output_size(result),
+            "counts": counts,
+        })
+
+
+def count(name: str, value: float = 1) -> None:
+    """Add to a per-action counter (e.g. "pages", "cache_hit") of the action running in this context."""
+    counts = _current_counts.get()
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + value
+
+
+def register_collector(collector: Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]) -> None:
+    """
+    Add a callback evaluated on every scrape for gauges owned by other modules.
+    It returns a list of (name, help, type, [(labels, value), ...]).
+    """
+    _collectors.append(collector)
+
+
+def register_stats(prefix: str, stats_fn: Callable[[], Dict[str, Any]],
+                   counters: Tuple[str, ...] = (), label: Optional[str] = None) -> None:
+    """
+    Export a module's stats() dict on every scrape.
+
+    Numeric entries become gauges named <prefix>_<key> (booleans as 0/1); keys
+    listed in counters are exported as <prefix>_<key>_total counters. With
+    label, the dict is one gauge <prefix> and its keys become that label's
+    values (e.g. jobs per state).
+    """
+    def collect():
+        values = {k: v for k, v in stats_fn().items() if isinstance(v, (int, float))}
+        if label:
+            return [(prefix, f"{prefix} by {label}", "gauge",
+                     [({label: k}, float(v)) for k, v in sorted(values.items())])]
+        families = []
+        for key, value in values.items():
+            if key in counters:
+                families.append((f"{prefix}_{key}_total", f"{prefix} {key}", "counter", [({}, float(value))]))
+            else:
+                families.append((f"{prefix}_{key}", f"{prefix} {key}", "gauge", [({}, float(value))]))
+        return families
+
+    collect.__name__ = f"{prefix}_stats"
+    register_collector(collect)
+
+
+def buffer_samples() -> None:
+    """Called in worker processes: keep samples for drain() instead of recording them."""
+    global _buffering
+    _buffering = True
+
+
+def drain() -> List[Dict[str, Any]]:
+    """Samples buffered since the last call (worker side)."""
+    with _lock:
+        samples = list(_pending)
+        _pending.clear()
+    return samples
+
+
+def merge(samples: Optional[List[Dict[str, Any]]]) -> None:
+    """Record samples shipped back from a worker process (parent side)."""
+    for sample in samples or ():
+        _apply(sample)
+
+
+def categorize_exception(exc: BaseException) -> str:
+    if isinstance(exc, FileNotFoundError):
+        return "not_found"
+    if isinstance(exc, PermissionError):
+        return "permission"
+    if isinstance(exc, MemoryError):
+        return "memory"
+    if isinstance(exc, TimeoutError):
+        return "timeout"
+    if isinstance(exc, ImportError):
+        return "dependency"
+    if "Password" in type(exc).__name__:
+        return "password"
+    if isinstance(exc, (ValueError, KeyError, TypeError)):
+        return "invalid_input"
+    return categorize_error(str(exc))
+
+
+def categorize_error(err: Any) -> str:
+    """Category of an entry in result["errors"] (a string or {"error": ...} dict)."""
+    text = err.get("error", "") if isinstance(err, dict) else str(err)
+    text = str(text).lower()
+    for keyword, category in _ERROR_KEYWORDS:
+        if keyword in text:
+            return category
+    return "processing"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        histograms = {key: [list(h[0]), h[1], h[2]] for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines.append("# HELP tool_action_duration_seconds Time spent in a tool action")
+    lines.append("# TYPE tool_action_duration_seconds histogram")
+    for (module_name, action), (buckets, total, n) in sorted(histograms.items()):
+        labels = f'module="{module_name}",action="{action}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, buckets):
+            cumulative += bucket_count
+            lines.append(f'tool_action_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'tool_action_duration_seconds_bucket{{{labels},le="+Inf"}} {n}')
+        lines.append(f"tool_action_duration_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"tool_action_duration_seconds_count{{{labels}}} {n}")
+
+    by_name: Dict[str, List[Tuple[Tuple[Tuple[str, str], ...], float]]] = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name in sorted(by_name):
+        help_text = _COUNTER_HELP.get(name, name)
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{name}{_format_labels(dict(labels))} {_format_value(value)}")
+
+    for collector in list(_collectors):
+        try:
+            families = collector()
+        except Exception as e:
+            logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+            continue
+        for name, help_text, metric_type, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Helper functions
+
+_COUNTER_HELP = {
+    "tool_action_errors_total": "Errors raised or returned by tool actions, by category",
+    "tool_action_failures_total": "Tool action calls that produced no output",
+    "tool_action_input_bytes_total": "Bytes of input files passed to tool actions",
+    "tool_action_output_bytes_total": "Bytes of files produced by tool actions",
+    "tool_action_units_total": "Work units counted by tool actions (pages, megapixels, cache hits, ...)",
+}
+
+
+def _record(sample: Dict[str, Any]) -> None:
+    if _buffering:
+        with _lock:
+            _pending.append(sample)
+    else:
+        _apply(sample)
+
+
+def _apply(sample: Dict[str, Any]) -> None:
+    module_name, action = sample["module"], sample["action"]
+    base = (("module", module_name), ("action", action))
+    with _lock:
+        hist = _histograms.get((module_name, action))
+        if hist is None:
+            hist = _histograms[(module_name, action)] = [[0] * len(BUCKETS), 0.0, 0]
+        seconds = sample["seconds"]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[0][i] += 1
+                break
+        hist[1] += seconds
+        hist[2] += 1
+
+        _add_locked("tool_action_input_bytes_total", base, sample["bytes_in"])
+        _add_locked("tool_action_output_bytes_total", base, sample["bytes_out"])
+        if sample["failed"]:
+            _add_locked("tool_action_failures_total", base, 1)
+        for category, n in sample["errors"].items():
+            _add_locked("tool_action_errors_total", base + (("category", category),), n)
+        for unit, n in sample["counts"].items():
+            _add_locked("tool_action_units_total", base + (("unit", unit),), n)
+
+
+def _add_locked(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> None:
+    key = (name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+
+def _iter_files(value: Any):
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from _iter_files(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _iter_files(v)
+    elif isinstance(value, str) and os.path.isabs(value):
+        yield value
+
+
+def _files_size(value: Any) -> int:
+    total = 0
+    for path in set(_iter_files(value)):
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def _has_output(result: Any) -> bool:
+    return isinstance(result, dict) and bool(result.get("processed_files") or result.get("data") or result.get("image"))
+
+
+def _output_size(result: Any) -> int:
+    if not isinstance(result, dict):
+        return 0
+    outputs = list(result.get("processed_files") or [])
+    if result.get("output_file"):
+        outputs.append(result["output_file"])
+    return _files_size(outputs)
@@ -0,0 +1,330 @@
+"""
+Process-wide registry of loaded ML models.
+
+remove_background (rembg ONNX sessions) and upscale_images (OpenCV dnn_superres
+networks) used to load their model on every request. A load takes seconds
+and hundreds of MB, so they now ask the registry. It loads each model once
+per process and shares it between requests. When the estimated resident
+size of all models exceeds MODEL_CACHE_BYTES, the least recently used ones
+are evicted.
+
+Tool modules register a loader per model kind:
+
+    model_registry.register_loader("rembg", _load_rembg_session)
+
+    with model_registry.use("rembg", "u2net") as session:
+        ...
+
+MODEL_PREWARM (e.g. "rembg:u2net,upscale:edsr_x4") lists models to load ahead of
+the first request; every worker process loads them at start-up (api.py
+does when the worker pool is disabled). Every load is
+timed, and its resident size is the process RSS growth during the load,
+falling back to the size the loader reports (usually the model file).
+Loads and cache hits are also counted on the running action for /metrics
+(tool_action_units_total, unit="model_load" / "model_hit").
+
+Worker processes each have their own registry. worker_pool ships a worker's
+model list back with each result, so all_models() in the parent covers every
+live worker that has run a job.
+"""
+
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from modules import metrics
+except ImportError:
+    import metrics
+
+logger = logging.getLogger(__name__)
+
+# Estimated resident bytes of all models in one process before LRU eviction
+MODEL_CACHE_BYTES = int(os.getenv("MODEL_CACHE_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Comma-separated kind:name pairs loaded at start-up, e.g. "rembg:u2net,upscale:edsr_x4"
+MODEL_PREWARM = os.getenv("MODEL_PREWARM", "")
+
+
+class _Entry:
+    def __init__(self, kind: str, name: str, model: Any, load_seconds: float, size_bytes: int, exclusive: bool):
+        self.kind = kind
+        self.name = name
+        self.model = model
+        self.load_seconds = load_seconds
+        self.size_bytes = size_bytes
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.uses = 0
+        # Models that are not safe to call from several threads at once are used under this lock
+        self.lock = threading.Lock() if exclusive else None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "load_ms": round(self.load_seconds * 1000, 1),
+            "size_bytes": self.size_bytes,
+            "uses": self.uses,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+        }
+
+
+# kind -> (loader(name) -> (model, size_hint_bytes), exclusive)
+_loaders: Dict[str, Tuple[Callable[[str], Tuple[Any, int]], bool]] = {}
+_models: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()  # least recently used first
+_lock = threading.Lock()
+# Loads run one at a time: it keeps the RSS measurement meaningful and avoids two
+# requests loading the same model concurrently
+_load_lock = threading.Lock()
+_counters = {"loads": 0, "hits": 0, "evictions": 0, "load_failures": 0}
+_version = 0  # bumped on every load / eviction
+_shipped_version = 0  # _version at the last snapshot(), so an emptied registry is reported once
+_remote: Dict[int, List[Dict[str, Any]]] = {}  # worker pid -> its models
+
+
+def register_loader(kind: str, loader: Callable[[str], Tuple[Any, int]], exclusive: bool = False) -> None:
+    """
+    Declare how models of a kind are loaded.
+
+    Args:
+        kind: e.g. "rembg"
+        loader: loader(name) -> (model, size_hint_bytes); raises on failure
+        exclusive: The model must not be used by two threads at once; use()
+                   then holds a per-model lock
+    """
+    _loaders[kind] = (loader, exclusive)
+
+
+def get(kind: str, name: str) -> Any:
+    """The model, loaded on first use. Prefer use() for exclusive kinds."""
+    return _entry(kind, str(name)).model
+
+
+@contextmanager
+def use(kind: str, name: str) -> Iterator[Any]:
+    """Yield the model, holding its lock for the duration if the kind is exclusive."""
+    entry = _entry(kind, str(name))
+    if entry.lock is None:
+        yield entry.model
+        return
+    with entry.lock:
+        yield entry.model
+
+
+def prewarm(spec: Optional[str] = None) -> int:
+    """Load the models listed in spec (default MODEL_PREWARM). Returns the number loaded."""
+    loaded = 0
+    for kind, name in _parse_spec(MODEL_PREWARM if spec is None else spec):
+        if kind not in _loaders:
+            logger.warning(f"Model pre-warm: unknown kind {kind!r}")
+            continue
+        try:
+            _entry(kind, name)
+            loaded += 1
+        except Exception as e:
+            logger.warning(f"Model pre-warm of {kind}:{name} failed: {e}")
+    return loaded
+
+
+def evict(kind: Optional[str] = None, name: Optional[str] = None) -> int:
+    """Drop matching models (all when no filter is given). Returns the number evicted."""
+    global _version
+    with _lock:
+        keys = [k for k in _models if (kind is None or k[0] == kind) and (name is None or k[1] == str(name))]
+        for key in keys:
+            del _models[key]
+        _counters["evictions"] += len(keys)
+        if keys:
+            _version += 1
+    if keys:
+        gc.collect()
+    return len(keys)
+
+
+def models() -> List[Dict[str, Any]]:
+    """Models loaded in this process, least recently used first."""
+    with _lock:
+        return [entry.describe() for entry in _models.values()]
+
+
+def stats() -> Dict[str, Any]:
+    """Counts and sizes for /metrics (this process only)."""
+    with _lock:
+        resident = sum(entry.size_bytes for entry in _models.values())
+        return {
+            "models": len(_models),
+            "resident_bytes": resident,
+            "max_bytes": MODEL_CACHE_BYTES,
+            **_counters,
+        }
+
+
+def snapshot() -> Optional[Dict[str, Any]]:
+    """Worker side: this process's model list, or None if there is nothing new to report."""
+    global _shipped_version
+    with _lock:
+        if not _models and _version == _shipped_version:
+            return None
+        _shipped_version = _version
+    return {"pid": os.getpid(), "models": models()}
+
+
+def merge_snapshot(snapshot: Optional[Dict[str, Any]]) -> None:
+    """Parent side: remember the model list a worker process shipped back."""
+    if snapshot:
+        with _lock:
+            _remote[snapshot["pid"]] = snapshot["models"]
+
+
+def all_models(live_pids: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+    """
+    Models of this process and of the worker processes that reported theirs,
+    each with its "pid". Workers not in live_pids (recycled ones) are dropped.
+    """
+    pid = os.getpid()
+    result = [{**m, "pid": pid} for m in models()]
+    with _lock:
+        if live_pids is not None:
+            live = set(live_pids)
+            for dead in [p for p in _remote if p not in live]:
+                del _remote[dead]
+        remote = {p: list(ms) for p, ms in _remote.items()}
+    for worker_pid, worker_models in sorted(remote.items()):
+        result.extend({**m, "pid": worker_pid} for m in worker_models)
+    return result
+
+
+def metric_families(live_pids: Optional[Iterable[int]] = None):
+    """Per-model gauges for metrics.register_collector()."""
+    entries = all_models(live_pids)
+
+    def samples(key, scale=1.0):
+        return [({"kind": m["kind"], "model": m["name"], "pid": str(m["pid"])}, m[key] * scale) for m in entries]
+
+    return [
+        ("model_resident_bytes", "Estimated resident size of a loaded model", "gauge", samples("size_bytes")),
+        ("model_load_seconds", "Time it took to load a model", "gauge", samples("load_ms", 0.001)),
+        ("model_uses", "Requests served by a loaded model", "gauge", samples("uses")),
+    ]
+
+
+# Helper functions
+
+def _entry(kind: str, name: str) -> _Entry:
+    key = (kind, name)
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None:
+            _touch(entry, key)
+            _counters["hits"] += 1
+    if entry is not None:
+        metrics.count("model_hit")
+        return entry
+
+    with _load_lock:
+        # Another thread may have loaded it while we waited
+        with _lock:
+            entry = _models.get(key)
+            if entry is not None:
+                _touch(entry, key)
+                _counters["hits"] += 1
+        if entry is not None:
+            metrics.count("model_hit")
+            return entry
+        entry = _load(kind, name)
+        metrics.count("model_load")
+
+    with _lock:
+        _touch(entry, key)
+    return entry
+
+
+def _touch(entry: _Entry, key: Tuple[str, str]) -> None:
+    entry.uses += 1
+    entry.last_used = time.time()
+    _models.move_to_end(key)
+
+
+def _load(kind: str, name: str) -> _Entry:
+    global _version
+    if kind not in _loaders:
+        raise ValueError(f"Unknown model kind: {kind}")
+    loader, exclusive = _loaders[kind]
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    try:
+        model, size_hint = loader(name)
+    except Exception:
+        with _lock:
+            _counters["load_failures"] += 1
+        raise
+    seconds = time.perf_counter() - start
+    rss_after = _rss_bytes()
+
+    size = size_hint or 0
+    if rss_before is not None and rss_after is not None and rss_after - rss_before > 0:
+        size = rss_after - rss_before
+
+    entry = _Entry(kind, name, model, seconds, size, exclusive)
+    with _lock:
+        _models[(kind, name)] = entry
+        _counters["loads"] += 1
+        _version += 1
+        evicted = _evict_over_budget_locked(keep=(kind, name))
+    logger.info(f"Loaded model {kind}:{name} in {seconds * 1000:.0f} ms, ~{size / 1024 / 1024:.0f} MB resident")
+    for key in evicted:
+        logger.info(f"Evicted model {key[0]}:{key[1]} (MODEL_CACHE_BYTES={MODEL_CACHE_BYTES})")
+    if evicted:
+        gc.collect()
+    return entry
+
+
+def _evict_over_budget_locked(keep: Tuple[str, str]) -> List[Tuple[str, str]]:
+    global _version
+    evicted = []
+    total = sum(entry.size_bytes for entry in _models.values())
+    for key in list(_models):
+        if total <= MODEL_CACHE_BYTES:
+            break
+        if key == keep:
+            continue
+        total -= _models.pop(key).size_bytes
+        evicted.append(key)
+    if evicted:
+        _counters["evictions"] += len(evicted)
+        _version += 1
+    return evicted
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _parse_spec(spec: str) -> List[Tuple[str, str]]:
+    pairs = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        kind, _, name = item.partition(":")
+        if not name:
+            logger.warning(f"Model pre-warm: expected kind:name, got {item!r}")
+            continue
+        pairs.append((kind.strip(), name.strip()))
+    return pairs
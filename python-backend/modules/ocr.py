@@ -0,0 +1,310 @@
+"""
+Streaming, parallel page OCR for ocr_pdf.
+
+ocr_pdf used to decode every page to a 300 DPI image up front (pdf2image),
+so a 300-page scan needed tens of GB before the first word was recognized.
+It then ran Tesseract twice per page: image_to_data for the boxes and
+image_to_string for the text. iter_pages() works differently:
+
+- Pages are rendered one at a time with PyMuPDF, straight into a PIL image
+  without a PNG round trip, and only when a slot in the window is free.
+  At most OCR_WINDOW rendered pages are held at once, so memory no longer
+  grows with the page count.
+- Each page gets a single image_to_data pass. The page text is rebuilt
+  from its block/paragraph/line numbers.
+- Up to OCR_WORKERS batches of pages are recognized at once by the
+  engine from ocr_engine.py: warm in-process tesserocr APIs or tesseract
+  processes, both of which run outside the GIL, so the pages use separate
+  cores. OMP_THREAD_LIMIT defaults to 1 so parallel pages don't
+  oversubscribe the CPU with tesseract's own OpenMP threads.
+- Pages that already have a text layer are not rendered or recognized at
+  all (see has_text_layer: a scan with only a stamped header or Bates
+  number still counts as a scan).
+- Pages OCRed before, in this document or an earlier version of it, are
+  answered from ocr_cache.py by their content fingerprint.
+- Optional preprocessing steps (ocr_preprocess.py: deskew, rescale,
+  binarize, ...) run on each page in its OCR thread, and the word boxes are
+  mapped back onto the rendered page.
+
+Results come back in page order, so the caller can write the output page by
+page while later pages are still being recognized.
+"""
+
+import contextvars
+import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from modules import tracing, metrics, ocr_engine, ocr_cache, ocr_preprocess
+    from modules.lazy_imports import lazy_module
+except ImportError:
+    import tracing
+    import metrics
+    import ocr_engine
+    import ocr_cache
+    import ocr_preprocess
+    from lazy_imports import lazy_module
+
+Image = lazy_module("PIL.Image")
+fitz = lazy_module("fitz")  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# Batches of pages recognized in parallel
+OCR_WORKERS = max(1, int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1)))))
+# Rendered pages held at once (waiting for or in OCR); bounds memory
+OCR_WINDOW = int(os.getenv("OCR_WINDOW", "0")) or 2 * OCR_WORKERS
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Pages with less extractable text than this are always OCRed
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+# A page mostly covered by images is a scan; its text must cover this share of the image area
+OCR_MIN_TEXT_COVERAGE = float(os.getenv("OCR_MIN_TEXT_COVERAGE", "0.1"))
+# Images covering at least this share of the page make it a scan
+SCAN_IMAGE_COVERAGE = 0.5
+
+
+def has_text_layer(page) -> bool:
+    """
+    True if the PDF page already carries usable text: at least
+    OCR_MIN_TEXT_CHARS characters, and, on a page mostly covered by images
+    (a scan), text blocks over at least OCR_MIN_TEXT_COVERAGE of the image
+    area. A scanned page whose only text is a stamped header, page number
+    or Bates number is still OCRed.
+    """
+    blocks = [b for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()]
+    if sum(len(b[4].strip()) for b in blocks) < OCR_MIN_TEXT_CHARS:
+        return False
+
+    page_area = page.rect.get_area()
+    image_area = 0.0
+    for image in page.get_images(full=True):
+        for rect in page.get_image_rects(image[0]):
+            image_area += abs(rect.get_area())
+    image_area = min(image_area, page_area)  # overlapping or tiled strips
+    if image_area < SCAN_IMAGE_COVERAGE * page_area:
+        return True
+    text_area = sum(fitz.Rect(b[:4]).get_area() for b in blocks)
+    return text_area >= OCR_MIN_TEXT_COVERAGE * image_area
+
+
+def render_page(page, dpi: int = OCR_DPI, gray: bool = False):
+    """Render a PyMuPDF page to an RGB (or, with gray, L) PIL image."""
+    if gray:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def recognize(img, language: str = "eng", dpi: int = OCR_DPI, engine=None) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    One Tesseract pass over an image.
+
+    Returns:
+        (words, text): words are dicts with text, conf, left, top, width,
+        height (pixels) and line (block, paragraph, line numbers); text is
+        the page text, one line per OCR line and a blank line between
+        paragraphs.
+    """
+    engine = engine or ocr_engine.get_engine()
+    return _words_from_data(engine.recognize([img], language, dpi)[0])
+
+
+def iter_pages(doc, language: str = "eng", dpi: Optional[int] = None, skip_text_pages: bool = True,
+               workers: Optional[int] = None, window: Optional[int] = None, engine=None,
+               keep_images: bool = True, use_cache: bool = True,
+               preprocess: Sequence[str] = ()) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    OCR the pages of an open PyMuPDF document, yielding (page index, result) in page order.
+
+    A result has "skipped" (True for pages with a text layer, which have no
+    other keys) or the rendered "image", its "dpi", and the "words" and
+    "text" from recognize(). An OCR failure on one page is returned as
+    "error" with empty words instead of aborting the document. engine
+    defaults to ocr_engine.get_engine(); pages go to it in batches of its
+    batch_size.
+
+    With use_cache, pages whose fingerprint is in ocr_cache come back with
+    "cached": True and the stored words, without OCR. Without keep_images,
+    results carry no "image", and cached pages are not even rendered.
+
+    preprocess lists ocr_preprocess steps applied before recognition. The
+    words are always in pixels of the rendered "image" at "dpi", whatever
+    the steps did to the geometry.
+    """
+    dpi = dpi or OCR_DPI
+    preprocess = tuple(preprocess)
+    # Pages that are only recognized can be rendered grey: a third of the pixels to pass around
+    gray = "grayscale" in preprocess and not keep_images
+    engine = engine or ocr_engine.get_engine()
+    workers = max(1, workers or OCR_WORKERS)
+    window = max(workers * engine.batch_size, window or OCR_WINDOW)
+    if workers > 1:
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    pending: deque = deque()  # (index, finished result or _Batch), in page order
+    batch = None  # pages rendered but not submitted yet
+    rendered = set()  # pages rendered but not yielded yet
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr") as executor:
+        def submit():
+            nonlocal batch
+            if batch is not None:
+                batch.future = executor.submit(contextvars.copy_context().run, _recognize_batch, engine,
+                                               batch.images, language, dpi, batch.indexes, batch.keys, keep_images,
+                                               preprocess)
+                batch.images = None
+                batch = None
+
+        try:
+            for index in range(doc.page_count):
+                page = doc[index]
+                if skip_text_pages and has_text_layer(page):
+                    pending.append((index, {"skipped": True}))
+                    continue
+
+                key = cached = None
+                if use_cache:
+                    with tracing.span("ocr_cache"):
+                        key = ocr_cache.page_key(doc, page, language, dpi, variant=",".join(preprocess))
+                        cached = ocr_cache.get(key)
+                    metrics.count("ocr_cache_hit" if cached else "ocr_cache_miss")
+                if cached and not keep_images:
+                    pending.append((index, {"skipped": False, "cached": True, **cached}))
+                else:
+                    # Wait for the oldest page before rendering another one
+                    while len(rendered) >= window:
+                        submit()
+                        for ready in _pop_ready(pending, block=True):
+                            rendered.discard(ready[0])
+                            yield ready
+                    with tracing.span("ocr_render"):
+                        img = render_page(page, dpi, gray=gray)
+                    rendered.add(index)
+                    if cached:
+                        pending.append((index, {"skipped": False, "cached": True, "image": img, **cached}))
+                    else:
+                        if batch is None:
+                            batch = _Batch()
+                        batch.add(index, img, key)
+                        pending.append((index, batch))
+                        if len(batch.indexes) >= engine.batch_size:
+                            submit()
+                for ready in _pop_ready(pending, block=False):
+                    rendered.discard(ready[0])
+                    yield ready
+            submit()
+            while pending:
+                for ready in _pop_ready(pending, block=True):
+                    yield ready
+        finally:
+            # The consumer stopped early (error or close()): don't OCR the rest
+            for _, entry in pending:
+                if isinstance(entry, _Batch) and entry.future is not None:
+                    entry.future.cancel()
+
+
+# Helper functions
+
+class _Batch:
+    """Pages that go to the engine together; future holds their results once submitted."""
+
+    def __init__(self):
+        self.indexes: List[int] = []
+        self.keys: List[Optional[str]] = []  # ocr_cache keys (None without the cache)
+        self.images: Optional[List[Any]] = []
+        self.future: Optional[Future] = None
+
+    def add(self, index: int, img, key: Optional[str]) -> None:
+        self.indexes.append(index)
+        self.keys.append(key)
+        self.images.append(img)
+
+
+def _recognize_batch(engine, images: List[Any], language: str, dpi: int, indexes: List[int],
+                     keys: List[Optional[str]], keep_images: bool,
+                     preprocess: Sequence[str] = ()) -> Dict[int, Dict[str, Any]]:
+    prepared = images
+    dpis: Any = dpi
+    to_page: List[Any] = [None] * len(images)
+    try:
+        if preprocess:
+            with tracing.span("ocr_preprocess"):
+                prepared, dpis, to_page = map(list, zip(*(ocr_preprocess.prepare(img, preprocess, dpi) for img in images)))
+        with tracing.span("ocr_tesseract"):
+            data = engine.recognize(prepared, language, dpis)
+    except Exception as e:
+        if len(images) > 1:
+            # Find the page that broke the batch; the others still get their text
+            logger.warning(f"OCR batch of pages {indexes[0] + 1}-{indexes[-1] + 1} failed ({e}); retrying page by page")
+            results = {}
+            for img, index, key in zip(images, indexes, keys):
+                results.update(_recognize_batch(engine, [img], language, dpi, [index], [key], keep_images, preprocess))
+            return results
+        logger.error(f"OCR failed for page {indexes[0] + 1}: {e}")
+        result = {"skipped": False, "dpi": dpi, "words": [], "text": "", "error": str(e)}
+        if keep_images:
+            result["image"] = images[0]
+        return {indexes[0]: result}
+
+    results = {}
+    for img, index, key, page_data, matrix in zip(images, indexes, keys, data, to_page):
+        words, text = _words_from_data(page_data)
+        result = {"skipped": False, "dpi": dpi, "words": ocr_preprocess.map_words(words, matrix), "text": text}
+        if key:
+            ocr_cache.put(key, result)
+        if keep_images:
+            result["image"] = img
+        results[index] = result
+    return results
+
+
+def _pop_ready(pending: deque, block: bool) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Take finished results off the front of pending. With block, wait for at
+    least the first page in OCR (its batch must have been submitted).
+    """
+    ready = []
+    while pending:
+        index, entry = pending[0]
+        if isinstance(entry, _Batch):
+            if entry.future is None or not (block or entry.future.done()):
+                break
+            entry = entry.future.result()[index]
+            block = False
+        pending.popleft()
+        ready.append((index, entry))
+    return ready
+
+
+def _words_from_data(data: Dict[str, List[Any]]) -> Tuple[List[Dict[str, Any]], str]:
+    words = []
+    lines: List[List[str]] = []
+    last_line = last_par = None
+    for i, raw in enumerate(data.get("text", [])):
+        text = (raw or "").strip()
+        if not text:
+            continue
+        try:
+            conf = float(data["conf"][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        words.append({
+            "text": text,
+            "conf": conf,
+            "left": data["left"][i],
+            "top": data["top"][i],
+            "width": data["width"][i],
+            "height": data["height"][i],
+            "line": line,
+        })
+        if line != last_line:
+            if last_par is not None and line[:2] != last_par:
+                lines.append([])  # blank line between paragraphs
+            lines.append([])
+            last_line, last_par = line, line[:2]
+        lines[-1].append(text)
+    return words, "\n".join(" ".join(line) for line in lines)
@@ -0,0 +1,178 @@
+"""
+Per-page OCR result store.
+
+The result cache (result_cache.py) only helps when the whole file is
+unchanged. After a user fixes a few pages of a scanned contract and runs
+OCR again, every page would be recognized again. This store keeps the word
+boxes of every OCRed page under a fingerprint of the page itself:
+
+- the decompressed content streams of the page and of the form XObjects it
+  draws
+- the raw stream bytes of every image it shows
+- the page geometry (media box, crop box, rotation)
+- the OCR language, DPI and FINGERPRINT_VERSION
+
+Object numbers are left out, so a page that moved, or was rewritten by a
+save with garbage collection, still hits. No rendering is needed to build
+the key, so an unchanged 500-page document is answered from disk in
+seconds. Only new or changed pages go to Tesseract.
+
+Entries are small compressed JSON files under OCR_CACHE_DIR, shared by all
+worker processes, and evicted least-recently-used beyond
+OCR_CACHE_MAX_BYTES; the size bound is kept on disk (disk_lru.py), so it
+holds for all processes together. Hits and misses are counted as the action units
+"ocr_cache_hit" / "ocr_cache_miss".
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+import zlib
+from typing import Any, Dict, Optional
+
+try:
+    from modules import disk_lru
+except ImportError:
+    import disk_lru
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "offline_tools_ocr_cache"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Bump when the stored result format or the way pages are recognized changes
+FINGERPRINT_VERSION = 1
+
+
+def page_key(doc, page, language: str, dpi: int, variant: str = "") -> str:
+    """
+    Fingerprint of what OCR would see on a page. variant distinguishes
+    other settings that change the result.
+    """
+    h = hashlib.sha256()
+    h.update(f"v{FINGERPRINT_VERSION}|{language}|{dpi}|{variant}|{page.rotation}|"
+             f"{tuple(page.mediabox)}|{tuple(page.cropbox)}".encode())
+    h.update(page.read_contents())
+    for xobject in page.get_xobjects():
+        h.update(b"|form|")
+        h.update(doc.xref_stream(xobject[0]) or b"")
+    for image in page.get_images(full=True):
+        h.update(b"|image|")
+        h.update(doc.xref_stream_raw(image[0]) or b"")
+        smask = image[1]
+        if smask:
+            h.update(doc.xref_stream_raw(smask) or b"")
+    return h.hexdigest()
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """The stored {"words", "text", "dpi"} for a page key, or None."""
+    if not OCR_CACHE_ENABLED:
+        return None
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            entry = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, zlib.error) as e:
+        logger.warning(f"Dropping unreadable OCR cache entry {key}: {e}")
+        _drop(key)
+        return None
+
+    # Mark as recently used (eviction removes the oldest mtimes first)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    for word in entry["words"]:
+        word["line"] = tuple(word["line"])
+    return entry
+
+
+def put(key: str, result: Dict[str, Any]) -> None:
+    """Store the words, text and dpi of a freshly recognized page."""
+    if not OCR_CACHE_ENABLED:
+        return
+    data = zlib.compress(json.dumps({
+        "words": result["words"],
+        "text": result["text"],
+        "dpi": result["dpi"],
+    }, separators=(",", ":")).encode(), 6)
+
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(staging, "wb") as f:
+            f.write(data)
+        replaced = _file_size(path)
+        os.replace(staging, path)
+    except OSError as e:
+        logger.warning(f"Could not store OCR cache entry {key}: {e}")
+        try:
+            os.remove(staging)
+        except OSError:
+            pass
+        return
+
+    # A page stored again (by another worker, say) replaces the entry rather than adding one
+    _lru.added(len(data) - (replaced or 0), entries=0 if replaced is not None else 1)
+
+
+def clear() -> None:
+    """Remove every stored page."""
+    _lru.clear()
+
+
+# Helper functions
+
+def _entry_path(key: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, key[:2], f"{key}.json.z")
+
+
+def _remove(key: str) -> None:
+    try:
+        os.remove(_entry_path(key))
+    except OSError:
+        pass
+
+
+def _drop(key: str) -> None:
+    size = _file_size(_entry_path(key))
+    _remove(key)
+    if size is not None:
+        _lru.removed(size)
+
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _scan_entries():
+    """(mtime, key, size) for every stored page."""
+    if not os.path.isdir(OCR_CACHE_DIR):
+        return
+    for shard in os.listdir(OCR_CACHE_DIR):
+        shard_dir = os.path.join(OCR_CACHE_DIR, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for name in os.listdir(shard_dir):
+            if not name.endswith(".json.z"):
+                continue
+            try:
+                st = os.stat(os.path.join(shard_dir, name))
+            except OSError:
+                continue
+            yield st.st_mtime, name[:-len(".json.z")], st.st_size
+
+
+# Size bound shared by every process using OCR_CACHE_DIR
+_lru = disk_lru.DiskLRU(OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES, _scan_entries, _remove)
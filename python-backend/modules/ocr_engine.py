@@ -0,0 +1,229 @@
+"""
+Tesseract engines for ocr.py.
+
+pytesseract starts a new tesseract process for every call, and each one
+loads the language model from tessdata again. That startup is a large share
+of the time per page, especially for the bundled desktop binary. The
+engines here amortize it:
+
+    tesserocr   Warm TessBaseAPI instances kept in the process, one per
+                page in flight, shared by all jobs that run in the worker.
+                Images are passed in memory. tesserocr releases the GIL while
+                recognizing, so threads use separate cores. Optional
+                dependency: pip install tesserocr.
+    batch       The tesseract CLI in list-file mode: one process recognizes
+                OCR_BATCH_PAGES pages, loading the model once. Pages are
+                written as uncompressed PNM to a temp directory.
+    subprocess  pytesseract, one process per page (the old behaviour; the
+                baseline for bench_ocr.py).
+
+OCR_ENGINE=auto picks tesserocr when it is installed and batch otherwise.
+Every engine returns image_to_data-style column dicts parsed from
+Tesseract's TSV output, so the results are identical in shape.
+"""
+
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    from modules import model_registry
+except ImportError:
+    import model_registry
+
+logger = logging.getLogger(__name__)
+
+# auto | tesserocr | batch | subprocess
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+# Pages per tesseract process in batch mode
+OCR_BATCH_PAGES = max(1, int(os.getenv("OCR_BATCH_PAGES", "4")))
+# Warm TessBaseAPI instances per language: one per page recognized at once (ocr.OCR_WORKERS)
+OCR_API_INSTANCES = max(1, int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1)))))
+
+ENGINES = ("tesserocr", "batch", "subprocess")
+TSV_COLUMNS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text")
+
+_engines: Dict[str, Any] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name: Optional[str] = None):
+    """The engine for name (default OCR_ENGINE); engines are created once per process."""
+    name = (name or OCR_ENGINE).lower()
+    if name == "auto":
+        name = "tesserocr" if _has_tesserocr() else "batch"
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine: {name}. Supported: auto, {', '.join(ENGINES)}")
+    with _engines_lock:
+        if name not in _engines:
+            _engines[name] = {"tesserocr": TesserocrEngine, "batch": BatchEngine, "subprocess": SubprocessEngine}[name]()
+            logger.info(f"OCR engine: {name}")
+        return _engines[name]
+
+
+class SubprocessEngine:
+    """pytesseract.image_to_data: one tesseract process per page."""
+
+    name = "subprocess"
+    batch_size = 1
+
+    def recognize(self, images: List[Any], language: str, dpi: Union[int, Sequence[int]]) -> List[Dict[str, List[Any]]]:
+        import pytesseract
+        return [pytesseract.image_to_data(img, lang=language, config=f"--dpi {page_dpi}",
+                                          output_type=pytesseract.Output.DICT)
+                for img, page_dpi in zip(images, _per_image(dpi, len(images)))]
+
+
+class BatchEngine:
+    """The tesseract CLI in list-file mode: one process (one model load) per batch of pages."""
+
+    name = "batch"
+    batch_size = OCR_BATCH_PAGES
+
+    def recognize(self, images: List[Any], language: str, dpi: Union[int, Sequence[int]]) -> List[Dict[str, List[Any]]]:
+        import pytesseract
+        with tempfile.TemporaryDirectory(prefix="ocr_batch_") as tmp:
+            paths = []
+            for i, img in enumerate(images):
+                # PNM is uncompressed: much cheaper to write than PNG, and leptonica reads it natively
+                path = os.path.join(tmp, f"page{i}.pnm")
+                img.save(path, format="PPM")
+                paths.append(path)
+            list_file = os.path.join(tmp, "pages.txt")
+            with open(list_file, "w") as f:
+                f.write("\n".join(paths) + "\n")
+
+            out_base = os.path.join(tmp, "out")
+            # One --dpi for the whole list; pages rescaled by ocr_preprocess differ only a little
+            dpis = sorted(_per_image(dpi, len(images)))
+            cmd = [pytesseract.pytesseract.tesseract_cmd, list_file, out_base,
+                   "--dpi", str(dpis[len(dpis) // 2]), "-l", language, "tsv"]
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120 * len(images),
+                                    creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            if result.returncode != 0:
+                message = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+                raise RuntimeError(f"tesseract failed: {message}")
+            with open(f"{out_base}.tsv", encoding="utf-8") as f:
+                pages = parse_tsv(f.read())
+        return [pages.get(i + 1) or _empty_data() for i in range(len(images))]
+
+
+class TesserocrEngine:
+    """Warm in-process TessBaseAPI instances (see _ApiPool), one model load per instance."""
+
+    name = "tesserocr"
+    batch_size = 1
+
+    def recognize(self, images: List[Any], language: str, dpi: Union[int, Sequence[int]]) -> List[Dict[str, List[Any]]]:
+        pool = model_registry.get("tesseract", language)
+        results = []
+        for img, page_dpi in zip(images, _per_image(dpi, len(images))):
+            with pool.instance() as api:
+                api.SetImage(img)
+                api.SetSourceResolution(page_dpi)
+                tsv = api.GetTSVText(0)
+                api.Clear()
+            results.append(parse_tsv(tsv).get(1) or _empty_data())
+        return results
+
+
+def parse_tsv(tsv: str) -> Dict[int, Dict[str, List[Any]]]:
+    """
+    Tesseract TSV (with or without the header line) as image_to_data-style
+    column dicts, keyed by page_num (1-based position in a batch).
+    """
+    pages: Dict[int, Dict[str, List[Any]]] = {}
+    for line in tsv.splitlines():
+        if not line or line.startswith("level"):
+            continue
+        fields = line.split("\t", len(TSV_COLUMNS) - 1)
+        if len(fields) < len(TSV_COLUMNS) - 1:
+            continue
+        fields += [""] * (len(TSV_COLUMNS) - len(fields))
+        page = pages.setdefault(int(fields[1]), _empty_data())
+        for column, value in zip(TSV_COLUMNS, fields):
+            page[column].append(value if column in ("text", "conf") else int(value))
+    return pages
+
+
+class _ApiPool:
+    """
+    Up to OCR_API_INSTANCES tesserocr APIs for one language. An API is not
+    thread-safe; each serves one page at a time and is created the first
+    time all others are busy.
+    """
+
+    def __init__(self, language: str):
+        self.language = language
+        self._free: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 1
+        self._free.put(self._load())
+
+    def _load(self):
+        import tesserocr
+        tessdata = os.environ.get("TESSDATA_PREFIX")
+        if tessdata:
+            return tesserocr.PyTessBaseAPI(path=tessdata.rstrip("/\\") + os.sep, lang=self.language)
+        return tesserocr.PyTessBaseAPI(lang=self.language)
+
+    @contextmanager
+    def instance(self):
+        try:
+            api = self._free.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < OCR_API_INSTANCES
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    api = self._load()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                api = self._free.get()
+        try:
+            yield api
+        finally:
+            self._free.put(api)
+
+
+def _load_api_pool(language: str) -> Tuple[_ApiPool, int]:
+    """model_registry loader: a pool with one warm API, sized by its traineddata files."""
+    pool = _ApiPool(language)
+    tessdata = os.environ.get("TESSDATA_PREFIX", "")
+    size = sum(os.path.getsize(path) for path in
+               (os.path.join(tessdata, f"{lang}.traineddata") for lang in language.split("+"))
+               if os.path.exists(path))
+    return pool, size
+
+
+model_registry.register_loader("tesseract", _load_api_pool)
+
+
+# Helper functions
+
+def _has_tesserocr() -> bool:
+    try:
+        import tesserocr  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _empty_data() -> Dict[str, List[Any]]:
+    return {column: [] for column in TSV_COLUMNS}
+
+
+def _per_image(dpi: Union[int, Sequence[int]], count: int) -> List[int]:
+    """The resolution of each image: one for all of them, or one per image."""
+    return [dpi] * count if isinstance(dpi, int) else list(dpi)
@@ -0,0 +1,276 @@
+"""
+Image conditioning before OCR.
+
+Scans arrive as 300-600 DPI colour images with noise, uneven lighting and
+a slight skew, and Tesseract spends much of its time on them. prepare()
+turns a rendered page into what Tesseract handles best. It runs in the OCR
+threads (ocr._recognize_batch), one page per thread. Every step is
+vectorized NumPy or a Pillow C routine, both of which release the GIL for
+the heavy parts. The steps, in order:
+
+    grayscale  Drop colour (pages are rendered grey when possible).
+    orient     Tesseract OSD on a half-size copy; fixes pages scanned at
+               90/180/270 degrees. It costs an extra Tesseract call and
+               needs osd.traineddata, so it is not a default step.
+    deskew     Skew angle within +-MAX_SKEW degrees, estimated on a copy
+               about 1000 px wide from the row profile of its ink pixels
+               (a shear approximation, so no rotation per candidate angle).
+    rescale    Median text line height from the row profile of that copy;
+               pages with larger text are shrunk until lines are about
+               TARGET_LINE_HEIGHT px, where Tesseract is most accurate, so
+               it has fewer pixels to look at. Pages are never enlarged.
+               Rotation and scaling are one affine resample of the page.
+    binarize   Adaptive (Bradley) threshold against the local mean, from
+               box sums over an integer integral image. It copes with
+               shadows and yellowed paper where a global threshold fails.
+    despeckle  Drops ink pixels with at most one ink neighbour (scanner
+               dust), counted with eight shifted views of the page.
+
+Orientation, deskew and rescale change the geometry. prepare() returns the
+matrix that maps coordinates in the prepared image back to the rendered
+page, and map_words() applies it to the word boxes, so the text layer
+still lines up with the original page.
+
+benchmarks/bench_ocr_preprocess.py reports the time saved and the accuracy
+change on a local corpus.
+"""
+
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from modules.lazy_imports import lazy_module
+except ImportError:
+    from lazy_imports import lazy_module
+
+np = lazy_module("numpy")
+Image = lazy_module("PIL.Image")
+
+logger = logging.getLogger(__name__)
+
+STEPS = ("grayscale", "orient", "deskew", "rescale", "binarize", "despeckle")
+DEFAULT_STEPS = ("grayscale", "deskew", "rescale", "binarize", "despeckle")
+
+# Steps applied to every ocr_pdf request: "", "default", or a comma-separated list
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "")
+
+# Skew angles searched, in degrees
+MAX_SKEW = 5.0
+SKEW_STEP = 0.1
+# Smaller skew is left alone: Tesseract copes, and the rotation isn't worth it
+MIN_SKEW = 0.3
+# Text line height (ascender to descender, px) that rescale aims for
+TARGET_LINE_HEIGHT = 40
+# Bradley threshold: ink is darker than the local mean by this fraction
+BINARIZE_K = 0.15
+
+
+def parse_steps(value: Any) -> Tuple[str, ...]:
+    """
+    Steps from a payload value or OCR_PREPROCESS: True/"default" for
+    DEFAULT_STEPS, a list or comma-separated string of step names, or
+    nothing. Returned in the order they run.
+    """
+    if value is None or value is False or value == "":
+        return ()
+    if value is True or (isinstance(value, str) and value.lower() in ("default", "true")):
+        return DEFAULT_STEPS
+    names = [v.strip().lower() for v in (value.split(",") if isinstance(value, str) else value) if v.strip()]
+    unknown = [n for n in names if n not in STEPS]
+    if unknown:
+        raise ValueError(f"Unknown preprocessing step(s): {', '.join(unknown)}. Supported: {', '.join(STEPS)}")
+    return tuple(step for step in STEPS if step in names)
+
+
+def prepare(img, steps: Sequence[str], dpi: int) -> Tuple[Any, int, Optional[Any]]:
+    """
+    Apply the steps to a rendered page.
+
+    Returns:
+        (image, dpi, to_page): the prepared image, its effective resolution
+        and a 3x3 matrix mapping its pixel coordinates back to img's (None
+        if the geometry did not change)
+    """
+    forward = np.eye(3)
+    if "grayscale" in steps or "binarize" in steps or "despeckle" in steps:
+        img = img.convert("L")
+
+    if "orient" in steps:
+        quarter_turns = _detect_orientation(img)
+        if quarter_turns:
+            before = img.size
+            # Tesseract reports the clockwise rotation that makes the page upright
+            img = img.transpose({1: Image.Transpose.ROTATE_270, 2: Image.Transpose.ROTATE_180,
+                                 3: Image.Transpose.ROTATE_90}[quarter_turns])
+            forward = _rotation(-90 * quarter_turns, before, img.size) @ forward
+
+    # Deskew and rescale are resampled together, in one pass over the page
+    angle = estimate_skew(img) if "deskew" in steps else 0.0
+    if abs(angle) < MIN_SKEW:
+        angle = 0.0
+    scale = 1.0
+    if "rescale" in steps:
+        small, factor = _reduced(img, 1000)
+        if angle:
+            small = small.rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+        line_height = estimate_line_height(small)
+        if line_height and line_height * factor > TARGET_LINE_HEIGHT * 1.25:
+            scale = TARGET_LINE_HEIGHT / (line_height * factor)
+
+    if angle or scale != 1.0:
+        rotated_size = _rotated_size(img.size, angle)
+        size = (max(1, round(rotated_size[0] * scale)), max(1, round(rotated_size[1] * scale)))
+        step = np.diag([size[0] / rotated_size[0], size[1] / rotated_size[1], 1.0]) @ _rotation(angle, img.size, rotated_size)
+        fill = 255 if img.mode == "L" else (255, 255, 255)
+        # AFFINE takes the output-to-input mapping
+        img = img.transform(size, Image.Transform.AFFINE, data=tuple(np.linalg.inv(step)[:2].ravel()),
+                            resample=Image.Resampling.BILINEAR, fillcolor=fill)
+        forward = step @ forward
+        dpi = max(1, round(dpi * scale))
+
+    if "binarize" in steps:
+        img = Image.fromarray(binarize(np.asarray(img), window=max(15, (dpi // 6) | 1)))
+
+    if "despeckle" in steps:
+        img = Image.fromarray(despeckle(np.asarray(img)))
+
+    if np.allclose(forward, np.eye(3)):
+        return img, dpi, None
+    return img, dpi, np.linalg.inv(forward)
+
+
+def map_words(words: List[Dict[str, Any]], to_page) -> List[Dict[str, Any]]:
+    """Word boxes from prepared-image pixels to rendered-page pixels (axis-aligned bounds of the mapped corners)."""
+    if to_page is None or not words:
+        return words
+    for word in words:
+        x0, y0 = word["left"], word["top"]
+        x1, y1 = x0 + word["width"], y0 + word["height"]
+        corners = np.array([[x0, x1, x1, x0], [y0, y0, y1, y1], [1, 1, 1, 1]], dtype=np.float64)
+        xs, ys, _ = to_page @ corners
+        word["left"], word["top"] = int(round(xs.min())), int(round(ys.min()))
+        word["width"] = max(1, int(round(xs.max())) - word["left"])
+        word["height"] = max(1, int(round(ys.max())) - word["top"])
+    return words
+
+
+def estimate_skew(img) -> float:
+    """Skew in degrees (counter-clockwise rotation that straightens the lines), from a copy about 1000 px wide."""
+    small = np.asarray(_reduced(img, 1000)[0])
+    ink = _ink_mask(small)
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 200:
+        return 0.0
+    # Subsample very dense pages; the profile only needs the shape of the lines
+    if len(ys) > 200_000:
+        pick = np.random.default_rng(0).choice(len(ys), 200_000, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    ys = ys.astype(np.float64)
+    xs = xs.astype(np.float64) - small.shape[1] / 2
+
+    def score(angle):
+        # Shearing rows by x*tan(angle) approximates the rotation for small angles;
+        # aligned text lines give the peakiest row histogram
+        rows = np.round(ys + xs * math.tan(math.radians(angle))).astype(np.int64)
+        hist = np.bincount(rows - rows.min())
+        return float(np.dot(hist, hist))
+
+    coarse = np.arange(-MAX_SKEW, MAX_SKEW + 1e-9, 0.5)
+    best = max(coarse, key=score)
+    fine = np.arange(best - 0.5, best + 0.5 + 1e-9, SKEW_STEP)
+    # The shear that flattens lines sloping down to the right is negative;
+    # straightening them is a counter-clockwise (positive) rotation
+    return round(-float(max(fine, key=score)), 2)
+
+
+def estimate_line_height(img) -> Optional[float]:
+    """Median height in px of the text lines (runs of inked rows), or None without enough lines."""
+    pixels = np.asarray(img.convert("L") if img.mode != "L" else img)
+    factor = max(1, pixels.shape[1] // 1000)
+    ink = _ink_mask(pixels[:, ::factor])  # rows at full resolution, columns thinned
+    inked_rows = ink.sum(axis=1) > max(2, ink.shape[1] // 200)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], inked_rows.astype(np.int8), [0]))))
+    heights = edges[1::2] - edges[0::2]
+    heights = heights[heights >= 4]
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights))
+
+
+def binarize(gray, window: int = 51, k: float = BINARIZE_K):
+    """Bradley adaptive threshold of a uint8 greyscale array: 0 for ink, 255 for paper."""
+    r = window // 2
+    padded = np.pad(gray, r + 1, mode="edge").astype(np.int32)
+    # Box sums along y, then x, from cumulative sums (int32 holds 255 * window * width)
+    c = np.cumsum(padded, axis=0)
+    rows = c[window:] - c[:-window]
+    c = np.cumsum(rows, axis=1)
+    sums = c[:, window:] - c[:, :-window]
+    sums = sums[:gray.shape[0], :gray.shape[1]]
+    ink = gray.astype(np.int32) * (window * window) * 100 < sums * int(100 * (1 - k))
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def despeckle(binary):
+    """Remove ink pixels (0) with at most one inked 8-neighbour."""
+    ink = (binary == 0)
+    padded = np.pad(ink, 1).astype(np.uint8)
+    h, w = ink.shape
+    neighbours = sum(padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+                     for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx)
+    cleaned = binary.copy()
+    cleaned[ink & (neighbours <= 1)] = 255
+    return cleaned
+
+
+# Helper functions
+
+def _detect_orientation(img) -> int:
+    """Clockwise quarter turns that make the page upright (Tesseract OSD), 0 if unknown."""
+    try:
+        import pytesseract
+        half = img.reduce(2) if min(img.size) > 1200 else img
+        osd = pytesseract.image_to_osd(half)
+    except Exception as e:
+        logger.debug(f"Orientation detection skipped: {e}")
+        return 0
+    match = re.search(r"Rotate:\s*(\d+)", osd)
+    return (int(match.group(1)) // 90) % 4 if match else 0
+
+
+def _reduced(img, width: int):
+    """(greyscale copy of img reduced to about width px wide, reduction factor)."""
+    gray = img.convert("L") if img.mode != "L" else img
+    factor = max(1, gray.width // width)
+    return (gray.reduce(factor) if factor > 1 else gray), factor
+
+
+def _ink_mask(gray):
+    """Pixels darker than Otsu's threshold."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    between = (mean[-1] * weight - mean * total) ** 2 / np.maximum(weight * (total - weight), 1)
+    return gray <= int(np.argmax(between))
+
+
+def _rotation(angle: float, before: Tuple[int, int], after: Tuple[int, int]):
+    """Forward matrix of a counter-clockwise rotation by angle about the centre, with expand=True."""
+    a = math.radians(angle)
+    cos, sin = math.cos(a), math.sin(a)
+    to_origin = np.array([[1, 0, -before[0] / 2], [0, 1, -before[1] / 2], [0, 0, 1]])
+    rotate = np.array([[cos, sin, 0], [-sin, cos, 0], [0, 0, 1]])
+    to_centre = np.array([[1, 0, after[0] / 2], [0, 1, after[1] / 2], [0, 0, 1]])
+    return to_centre @ rotate @ to_origin
+
+
+def _rotated_size(size: Tuple[int, int], angle: float) -> Tuple[int, int]:
+    """Size of the bounding box of an image rotated by angle (Pillow's expand=True)."""
+    a = math.radians(angle)
+    cos, sin = abs(math.cos(a)), abs(math.sin(a))
+    return (math.ceil(size[0] * cos + size[1] * sin - 1e-6), math.ceil(size[0] * sin + size[1] * cos - 1e-6))
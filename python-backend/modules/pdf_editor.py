@@ -9,27 +9,76 @@ import io
 import base64
 import json
 import fitz  # PyMuPDF
+from contextlib import contextmanager
 from typing import List, Dict, Any, Optional, Tuple
 
+try:
+    from modules import pdf_sessions
+except ImportError:
+    import pdf_sessions
+
 logger = logging.getLogger(__name__)
 
 
-def get_pdf_info(payload: Dict[str, Any]) -> Dict[str, Any]:
+class SessionNotFoundError(Exception):
+    """Raised when a payload references a doc_id that is unknown or has expired."""
+
+
+def _session_error(doc_id: str) -> Dict[str, Any]:
+    return {"error": f"Document session not found or expired: {doc_id}", "code": "SESSION_NOT_FOUND"}
+
+
+@contextmanager
+def _open_document(payload: Dict[str, Any]):
     """
-    Get PDF document information (page count, dimensions, etc.)
+    Yield the fitz.Document a payload refers to.
+
+    With "doc_id" the already-open session document is used (and kept open);
+    otherwise "file" is opened and closed again afterwards.
+    """
+    doc_id = payload.get("doc_id")
+    if doc_id:
+        session = pdf_sessions.get_session(doc_id)
+        if session is None:
+            raise SessionNotFoundError(doc_id)
+        with session.lock:
+            yield session.doc
+        return
+
+    doc = fitz.open(payload.get("file"))
+    try:
+        yield doc
+    finally:
+        doc.close()
+
+
+def _check_source(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return an error dict if the payload has neither a live session nor an existing file."""
+    if payload.get("doc_id"):
+        return None
+
+    file_path = payload.get("file")
+    if not file_path or not os.path.exists(file_path):
+        return {"error": f"File not found: {file_path}"}
+    return None
+
+
+def open_session(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Open a PDF as an editor session so later calls can pass "doc_id" instead of the file
 
     Args:
         payload: {
-            "file": "path/to/pdf.pdf"
+            "file": "path/to/pdf.pdf",
+            "owns_file": true,  # optional, delete the file when the session closes
+            "on_close": callable  # optional, in-process callers only: runs once the session is closed
         }
 
     Returns:
         {
+            "doc_id": str,
             "page_count": int,
-            "pages": [
-                {"page_num": 1, "width": float, "height": float, "rotation": int},
-                ...
-            ]
+            "pages": [...]  # same as get_pdf_info
         }
     """
     file_path = payload.get("file")
@@ -38,26 +87,80 @@ def get_pdf_info(payload: Dict[str, Any]) -> Dict[str, Any]:
         return {"error": f"File not found: {file_path}"}
 
     try:
-        doc = fitz.open(file_path)
+        session = pdf_sessions.open_session(file_path, owns_file=payload.get("owns_file", True),
+                                            on_close=payload.get("on_close"))
+    except Exception as e:
+        logger.error(f"Error opening PDF session: {e}", exc_info=True)
+        return {"error": str(e)}
 
-        pages_info = []
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            rect = page.rect
-            pages_info.append({
-                "page_num": page_num + 1,  # 1-indexed for display
-                "width": rect.width,
-                "height": rect.height,
-                "rotation": page.rotation
-            })
+    info = get_pdf_info({"doc_id": session.doc_id})
+    if "error" in info:
+        pdf_sessions.close_session(session.doc_id)
+        return info
 
-        doc.close()
+    return {"doc_id": session.doc_id, **info}
+
+
+def close_session(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Close an editor session and release its document
+
+    Args:
+        payload: {
+            "doc_id": str
+        }
+
+    Returns:
+        {
+            "closed": bool
+        }
+    """
+    return {"closed": pdf_sessions.close_session(payload.get("doc_id"))}
+
+
+def get_pdf_info(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get PDF document information (page count, dimensions, etc.)
+
+    Args:
+        payload: {
+            "file": "path/to/pdf.pdf",  # or
+            "doc_id": str  # an open session
+        }
+
+    Returns:
+        {
+            "page_count": int,
+            "pages": [
+                {"page_num": 1, "width": float, "height": float, "rotation": int},
+                ...
+            ]
+        }
+    """
+    error = _check_source(payload)
+    if error:
+        return error
+
+    try:
+        with _open_document(payload) as doc:
+            pages_info = []
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+                rect = page.rect
+                pages_info.append({
+                    "page_num": page_num + 1,  # 1-indexed for display
+                    "width": rect.width,
+                    "height": rect.height,
+                    "rotation": page.rotation
+                })
 
         return {
             "page_count": len(pages_info),
             "pages": pages_info
         }
 
+    except SessionNotFoundError as e:
+        return _session_error(str(e))
     except Exception as e:
         logger.error(f"Error getting PDF info: {e}", exc_info=True)
         return {"error": str(e)}
@@ -69,7 +172,7 @@ def render_pdf_page(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     Args:
         payload: {
-            "file": "path/to/pdf.pdf",
+            "file": "path/to/pdf.pdf",  # or "doc_id": str
             "page": 0,  # 0-indexed
             "dpi": 150  # optional, default 150
         }
@@ -83,33 +186,31 @@ def render_pdf_page(payload: Dict[str, Any]) -> Dict[str, Any]:
             "page_height": float  # PDF points
         }
     """
-    file_path = payload.get("file")
     page_num = payload.get("page", 0)
     dpi = payload.get("dpi", 150)
 
-    if not file_path or not os.path.exists(file_path):
-        return {"error": f"File not found: {file_path}"}
+    error = _check_source(payload)
+    if error:
+        return error
 
     try:
-        doc = fitz.open(file_path)
+        with _open_document(payload) as doc:
+            if page_num < 0 or page_num >= len(doc):
+                return {"error": f"Invalid page number: {page_num} (PDF has {len(doc)} pages)"}
 
-        if page_num < 0 or page_num >= len(doc):
-            doc.close()
-            return {"error": f"Invalid page number: {page_num} (PDF has {len(doc)} pages)"}
-
-        page = doc[page_num]
+            page = doc[page_num]
 
-        # Get page dimensions in PDF points
-        page_rect = page.rect
-        page_width = page_rect.width
-        page_height = page_rect.height
+            # Get page dimensions in PDF points
+            page_rect = page.rect
+            page_width = page_rect.width
+            page_height = page_rect.height
 
-        # Render page to pixmap at specified DPI
-        # DPI 72 = 1:1 scale (PDF point = 1 pixel)
-        # DPI 150 = 2.08x scale (higher quality)
-        zoom = dpi / 72.0
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
+            # Render page to pixmap at specified DPI
+            # DPI 72 = 1:1 scale (PDF point = 1 pixel)
+            # DPI 150 = 2.08x scale (higher quality)
+            zoom = dpi / 72.0
+            mat = fitz.Matrix(zoom, zoom)
+            pix = page.get_pixmap(matrix=mat, alpha=False)
 
         # Convert to PNG bytes
         png_bytes = pix.tobytes("png")
@@ -118,8 +219,6 @@ def render_pdf_page(payload: Dict[str, Any]) -> Dict[str, Any]:
         base64_image = base64.b64encode(png_bytes).decode('utf-8')
         data_url = f"data:image/png;base64,{base64_image}"
 
-        doc.close()
-
         return {
             "image": data_url,
             "width": pix.width,
@@ -130,6 +229,8 @@ def render_pdf_page(payload: Dict[str, Any]) -> Dict[str, Any]:
             "zoom": zoom
         }
 
+    except SessionNotFoundError as e:
+        return _session_error(str(e))
     except Exception as e:
         logger.error(f"Error rendering PDF page: {e}", exc_info=True)
         return {"error": str(e)}
@@ -141,7 +242,7 @@ def load_annotations(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     Args:
         payload: {
-            "file": "path/to/pdf.pdf"
+            "file": "path/to/pdf.pdf"  # or "doc_id": str
         }
 
     Returns:
@@ -162,67 +263,65 @@ def load_annotations(payload: Dict[str, Any]) -> Dict[str, Any]:
             ]
         }
     """
-    file_path = payload.get("file")
-
-    if not file_path or not os.path.exists(file_path):
-        return {"error": f"File not found: {file_path}"}
+    error = _check_source(payload)
+    if error:
+        return error
 
     try:
-        doc = fitz.open(file_path)
-
-        all_annotations = []
-
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            annots = page.annots()
-
-            if not annots:
-                continue
+        with _open_document(payload) as doc:
+            all_annotations = []
 
-            for annot in annots:
-                try:
-                    annot_dict = {
-                        "id": f"annot_{page_num}_{annot.type[0]}_{len(all_annotations)}",
-                        "page": page_num,
-                        "type": _map_annot_type(annot.type[0]),
-                        "rect": _rect_to_dict(annot.rect)
-                    }
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+                annots = page.annots()
 
-                    # Get annotation properties based on type
-                    if annot.type[0] == fitz.PDF_ANNOT_FREE_TEXT:
-                        # Text annotation
-                        info = annot.info
-                        annot_dict["text"] = info.get("content", "")
-                        annot_dict["fontSize"] = annot.fontsize or 12
-                        annot_dict["color"] = _color_to_hex(annot.colors.get("stroke", (0, 0, 0)))
-
-                    elif annot.type[0] == fitz.PDF_ANNOT_HIGHLIGHT:
-                        # Highlight annotation
-                        annot_dict["color"] = _color_to_hex(annot.colors.get("stroke", (1, 1, 0)))
-                        annot_dict["opacity"] = annot.opacity or 0.5
-
-                    elif annot.type[0] in [fitz.PDF_ANNOT_SQUARE, fitz.PDF_ANNOT_CIRCLE]:
-                        # Shape annotations
-                        annot_dict["color"] = _color_to_hex(annot.colors.get("stroke", (0, 0, 0)))
-                        annot_dict["fillColor"] = _color_to_hex(annot.colors.get("fill"))
-                        annot_dict["strokeWidth"] = annot.border.get("width", 1)
-
-                    elif annot.type[0] == fitz.PDF_ANNOT_TEXT:
-                        # Comment/note annotation
-                        info = annot.info
-                        annot_dict["text"] = info.get("content", "")
-                        annot_dict["icon"] = annot.info.get("name", "Comment")
-
-                    all_annotations.append(annot_dict)
-
-                except Exception as e:
-                    logger.warning(f"Error reading annotation: {e}")
+                if not annots:
                     continue
 
-        doc.close()
+                for annot in annots:
+                    try:
+                        annot_dict = {
+                            "id": f"annot_{page_num}_{annot.type[0]}_{len(all_annotations)}",
+                            "page": page_num,
+                            "type": _map_annot_type(annot.type[0]),
+                            "rect": _rect_to_dict(annot.rect)
+                        }
+
+                        # Get annotation properties based on type
+                        if annot.type[0] == fitz.PDF_ANNOT_FREE_TEXT:
+                            # Text annotation
+                            info = annot.info
+                            annot_dict["text"] = info.get("content", "")
+                            annot_dict["fontSize"] = annot.fontsize or 12
+                            annot_dict["color"] = _color_to_hex(annot.colors.get("stroke", (0, 0, 0)))
+
+                        elif annot.type[0] == fitz.PDF_ANNOT_HIGHLIGHT:
+                            # Highlight annotation
+                            annot_dict["color"] = _color_to_hex(annot.colors.get("stroke", (1, 1, 0)))
+                            annot_dict["opacity"] = annot.opacity or 0.5
+
+                        elif annot.type[0] in [fitz.PDF_ANNOT_SQUARE, fitz.PDF_ANNOT_CIRCLE]:
+                            # Shape annotations
+                            annot_dict["color"] = _color_to_hex(annot.colors.get("stroke", (0, 0, 0)))
+                            annot_dict["fillColor"] = _color_to_hex(annot.colors.get("fill"))
+                            annot_dict["strokeWidth"] = annot.border.get("width", 1)
+
+                        elif annot.type[0] == fitz.PDF_ANNOT_TEXT:
+                            # Comment/note annotation
+                            info = annot.info
+                            annot_dict["text"] = info.get("content", "")
+                            annot_dict["icon"] = annot.info.get("name", "Comment")
+
+                        all_annotations.append(annot_dict)
+
+                    except Exception as e:
+                        logger.warning(f"Error reading annotation: {e}")
+                        continue
 
         return {"annotations": all_annotations}
 
+    except SessionNotFoundError as e:
+        return _session_error(str(e))
     except Exception as e:
         logger.error(f"Error loading annotations: {e}", exc_info=True)
         return {"error": str(e)}
@@ -234,7 +333,7 @@ def save_annotations(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     Args:
         payload: {
-            "file": "path/to/input.pdf",
+            "file": "path/to/input.pdf",  # or "doc_id": str
             "output": "path/to/output.pdf",
             "annotations": [
                 {
@@ -266,6 +365,15 @@ def save_annotations(payload: Dict[str, Any]) -> Dict[str, Any]:
     annotations = payload.get("annotations", [])
     flatten = payload.get("flatten", False)
 
+    # Annotations are written to a fresh copy so the open session document
+    # stays pristine for later renders and repeated saves
+    doc_id = payload.get("doc_id")
+    if doc_id:
+        session = pdf_sessions.get_session(doc_id)
+        if session is None:
+            return _session_error(doc_id)
+        file_path = session.file_path
+
     if not file_path or not os.path.exists(file_path):
         return {"error": f"File not found: {file_path}"}
 
@@ -464,5 +572,9 @@ def handle_pdf_editor_action(action: str, payload: Dict[str, Any]) -> Dict[str,
         return load_annotations(payload)
     elif action == "save_annotations":
         return save_annotations(payload)
+    elif action == "open_session":
+        return open_session(payload)
+    elif action == "close_session":
+        return close_session(payload)
     else:
         return {"error": f"Unknown action: {action}"}
@@ -0,0 +1,211 @@
+"""
+PDF Editor Sessions - keeps uploaded documents open between editor calls.
+
+The editor used to upload the whole PDF for every render/info/annotation call.
+A session uploads it once, keeps the fitz.Document open server-side and hands
+back a doc_id that later calls use instead of the file.
+
+Sessions are evicted when idle for longer than the TTL, or least-recently-used
+first when the open documents exceed the memory budget. The budget is measured
+in source file bytes, which is a close enough proxy for what MuPDF keeps
+resident for an open document.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# Idle time after which a session is closed (seconds)
+SESSION_TTL_SECONDS = int(os.getenv("PDF_SESSION_TTL", "900"))
+# Total size of open documents before LRU sessions are evicted (bytes)
+SESSION_MAX_BYTES = int(os.getenv("PDF_SESSION_MAX_BYTES", str(512 * 1024 * 1024)))
+# Hard cap on the number of open sessions
+SESSION_MAX_COUNT = int(os.getenv("PDF_SESSION_MAX_COUNT", "32"))
+# How often the background reaper looks for idle sessions (seconds)
+REAPER_INTERVAL_SECONDS = 60
+
+
+class PdfSession:
+    """An open PDF document plus the bookkeeping needed to evict it."""
+
+    def __init__(self, doc_id: str, file_path: str, doc: "fitz.Document", size_bytes: int, owns_file: bool,
+                 on_close: Optional[Callable[[], None]] = None):
+        self.doc_id = doc_id
+        self.file_path = file_path
+        self.doc = doc
+        self.size_bytes = size_bytes
+        self.owns_file = owns_file
+        self.on_close = on_close
+        self.created_at = time.time()
+        self.last_access = time.monotonic()
+        # PyMuPDF documents must not be used from two threads at once
+        self.lock = threading.RLock()
+
+    def touch(self) -> None:
+        self.last_access = time.monotonic()
+
+
+_sessions: "OrderedDict[str, PdfSession]" = OrderedDict()
+_registry_lock = threading.Lock()
+_reaper_started = False
+
+
+def open_session(file_path: str, owns_file: bool = True,
+                 on_close: Optional[Callable[[], None]] = None) -> PdfSession:
+    """
+    Open a PDF and register it as a new session.
+
+    Args:
+        file_path: Path to the PDF on disk
+        owns_file: Delete the file when the session is closed
+        on_close: Called after the session is closed, however that happens
+                  (e.g. api.py releases the session's workspace)
+
+    Returns:
+        The new PdfSession
+    """
+    doc = fitz.open(file_path)
+    try:
+        size_bytes = os.path.getsize(file_path)
+    except OSError:
+        size_bytes = 0
+
+    session = PdfSession(uuid.uuid4().hex, file_path, doc, size_bytes, owns_file, on_close)
+
+    with _registry_lock:
+        _sessions[session.doc_id] = session
+        evicted = _collect_evictions_locked()
+
+    for old in evicted:
+        _close(old)
+
+    _ensure_reaper()
+    logger.info(f"Opened PDF session {session.doc_id} ({len(doc)} pages, {size_bytes} bytes)")
+    return session
+
+
+def get_session(doc_id: str) -> Optional[PdfSession]:
+    """Look up a session and mark it as recently used. Returns None if unknown or expired."""
+    if not doc_id:
+        return None
+
+    with _registry_lock:
+        session = _sessions.get(doc_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_access > SESSION_TTL_SECONDS:
+            del _sessions[doc_id]
+            expired = session
+        else:
+            session.touch()
+            _sessions.move_to_end(doc_id)
+            return session
+
+    _close(expired)
+    return None
+
+
+def close_session(doc_id: str) -> bool:
+    """Close a session explicitly. Returns False if it did not exist."""
+    with _registry_lock:
+        session = _sessions.pop(doc_id, None)
+
+    if session is None:
+        return False
+
+    _close(session)
+    return True
+
+
+def evict_expired() -> int:
+    """Close every session idle for longer than the TTL. Returns the number closed."""
+    now = time.monotonic()
+    with _registry_lock:
+        expired = [s for s in _sessions.values() if now - s.last_access > SESSION_TTL_SECONDS]
+        for session in expired:
+            del _sessions[session.doc_id]
+
+    for session in expired:
+        _close(session)
+    return len(expired)
+
+
+def stats() -> Dict[str, Any]:
+    """Current session count and memory usage."""
+    with _registry_lock:
+        return {
+            "sessions": len(_sessions),
+            "bytes": sum(s.size_bytes for s in _sessions.values()),
+            "max_bytes": SESSION_MAX_BYTES,
+            "max_sessions": SESSION_MAX_COUNT,
+            "ttl_seconds": SESSION_TTL_SECONDS,
+        }
+
+
+# Helper functions
+
+def _collect_evictions_locked():
+    """Pop LRU sessions until count and byte budget are respected. Caller holds _registry_lock."""
+    evicted = []
+    total = sum(s.size_bytes for s in _sessions.values())
+
+    # Never evict the most recently opened session, even if it alone exceeds the budget
+    while len(_sessions) > 1 and (len(_sessions) > SESSION_MAX_COUNT or total > SESSION_MAX_BYTES):
+        _, session = _sessions.popitem(last=False)
+        total -= session.size_bytes
+        evicted.append(session)
+
+    return evicted
+
+
+def _close(session: PdfSession) -> None:
+    """Close the document (waiting for any in-flight call) and remove its file if we own it."""
+    with session.lock:
+        try:
+            session.doc.close()
+        except Exception as e:
+            logger.warning(f"Error closing PDF session {session.doc_id}: {e}")
+
+    if session.owns_file:
+        try:
+            os.unlink(session.file_path)
+        except OSError:
+            pass
+
+    if session.on_close is not None:
+        try:
+            session.on_close()
+        except Exception as e:
+            logger.warning(f"Close callback of PDF session {session.doc_id} failed: {e}")
+
+    logger.info(f"Closed PDF session {session.doc_id}")
+
+
+def _ensure_reaper() -> None:
+    """Start the background thread that closes idle sessions (once per process)."""
+    global _reaper_started
+
+    with _registry_lock:
+        if _reaper_started:
+            return
+        _reaper_started = True
+
+    def _reap_loop():
+        while True:
+            time.sleep(REAPER_INTERVAL_SECONDS)
+            try:
+                closed = evict_expired()
+                if closed:
+                    logger.info(f"Evicted {closed} idle PDF session(s)")
+            except Exception:
+                logger.exception("PDF session reaper failed")
+
+    threading.Thread(target=_reap_loop, name="pdf-session-reaper", daemon=True).start()
@@ -4,19 +4,22 @@ import os
 import io
 import platform
 import base64
-import fitz  # PyMuPDF
-from pypdf import PdfWriter, PdfReader
-import pdfplumber
-import pandas as pd
-import pikepdf
-from PIL import Image, ImageChops, ImageOps
-from pyhanko.sign import signers, fields
 try:
     from modules.security import validate_input_file
     from modules.tesseract_helper import is_tesseract_available, configure_tesseract
+    from modules import result_cache, progress, metrics, tracing, ocr, ocr_preprocess, pipeline
+    from modules.lazy_imports import lazy_module
 except ImportError:
     # Fallback for flat structure
     from security import validate_input_file
+    import result_cache
+    import progress
+    import metrics
+    import tracing
+    import ocr
+    import ocr_preprocess
+    import pipeline
+    from lazy_imports import lazy_module
     try:
         from tesseract_helper import is_tesseract_available, configure_tesseract
     except ImportError:
@@ -42,11 +45,42 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Heavy dependencies are imported by the first action that uses them
+# (see lazy_imports.py), so importing this module stays cheap
+fitz = lazy_module("fitz")  # PyMuPDF
+pypdf = lazy_module("pypdf")
+pdfplumber = lazy_module("pdfplumber")
+pd = lazy_module("pandas")
+pikepdf = lazy_module("pikepdf")
+Image = lazy_module("PIL.Image")
+ImageChops = lazy_module("PIL.ImageChops")
+fields = lazy_module("pyhanko.sign.fields")
+
+# CPU-bound actions that api.py runs in a worker process (see worker_pool.py).
+# They spend most of their time in GIL-holding Python loops; everything else
+# is quick or I/O-bound and stays on the thread pool.
+PROCESS_ACTIONS = {
+    "compress", "optimize", "grayscale", "repair", "scrub", "redact",
+    "pdf_to_word", "pdf_to_images", "pdf_to_pdfa", "extract_text",
+    "extract_images_from_pdf", "extract_tables", "diff", "booklet", "flatten",
+    "word_to_pdf", "powerpoint_to_pdf", "excel_to_pdf", "ocr_pdf", "pipeline",
+}
+
+# Every action _dispatch_pdf_action routes; the action comes from the URL, so
+# anything else is rejected before it reaches the cache or a /metrics label
+ACTIONS = PROCESS_ACTIONS | {
+    "merge", "split", "protect", "unlock", "watermark", "rotate", "remove_metadata",
+    "images_to_pdf", "page_numbers", "delete_pages", "sign", "html_to_pdf", "crop",
+    "organize", "reorder_pages", "extract_metadata", "extract_form_data", "preview",
+}
+
 def handle_pdf_action(action, payload):
     """
     Main dispatcher for PDF actions.
     Routes to appropriate function based on action name.
     """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown PDF action: {action}")
     logger.info(f"Handling PDF action: {action}")
 
     # Security Check
@@ -55,11 +89,37 @@ def handle_pdf_action(action, payload):
         files = [payload.get("file")] if payload.get("file") else []
         files = [f for f in files if f]  # Remove None values
 
+    with tracing.span("validate"):
+        for f in files:
+            if isinstance(f, str):
+                validate_input_file(f)
+
+    # Timed and counted for /metrics; identical inputs + parameters reuse the stored artifacts
+    with tracing.span("action"):
+        return metrics.observe_action("pdf_tools", action, payload, _cached_dispatch)
+
+def _cached_dispatch(action, payload):
+    return result_cache.cached_call("pdf_tools", action, payload, _counted_dispatch)
+
+def _counted_dispatch(action, payload):
+    # Pages are counted only when the action runs: a cache hit opens no input
+    _count_pages(payload)
+    return _dispatch_pdf_action(action, payload)
+
+def _count_pages(payload):
+    """Page count of the input PDFs for /metrics (reads only the page tree)."""
+    files = payload.get("files") or [payload.get("file")]
     for f in files:
-        if isinstance(f, str):
-            validate_input_file(f)
+        if isinstance(f, str) and f.lower().endswith(".pdf"):
+            try:
+                with fitz.open(f) as doc:
+                    metrics.count("pages", doc.page_count)
+            except Exception as e:
+                # A broken input is the action's to report, not the metrics'
+                logger.debug(f"Could not count pages of {f}: {e}")
 
-    # Route to appropriate handler
+def _dispatch_pdf_action(action, payload):
+    """Route to appropriate handler"""
     if action == "merge":
         return merge_pdfs(payload)
     elif action == "split":
@@ -132,6 +192,8 @@ def handle_pdf_action(action, payload):
         return extract_form_data(payload)
     elif action == "preview":
         return preview_pdf(payload)
+    elif action == "pipeline":
+        return run_pipeline(payload)
     else:
         raise ValueError(f"Unknown PDF action: {action}")
 
@@ -288,7 +350,7 @@ def merge_pdfs(payload):
     errors = []
 
     try:
-        merger = PdfWriter()
+        merger = pypdf.PdfWriter()
         for pdf_path in files:
             if not os.path.exists(pdf_path):
                 errors.append({"file": pdf_path, "error": f"File not found: {pdf_path}"})
@@ -489,130 +551,20 @@ def compress_pdf(payload):
             base, ext = os.path.splitext(file_path)
             output_path = f"{base}_compressed{ext}"
 
-            # Level 0: Minimal compression (just remove unused objects)
-            if level == 0:
+            if level <= 1:
+                # Level 0: just recompress streams; level 1 adds object streams
                 with pikepdf.open(file_path) as pdf:
-                    pdf.save(output_path, compress_streams=True)
-
-            # Level 1: Balanced compression (default)
-            elif level == 1:
-                with pikepdf.open(file_path) as pdf:
-                    pdf.save(
-                        output_path,
-                        compress_streams=True,
-                        object_stream_mode=pikepdf.ObjectStreamMode.generate
-                    )
-
-            # Level 2: High compression (optimize images + object streams)
-            elif level == 2:
+                    _pikepdf_save(pdf, output_path, level)
+            else:
+                # Levels 2-3: recompress images with PyMuPDF, then hand the
+                # cleaned document to pikepdf in memory for the final write
                 doc = fitz.open(file_path)
-
-                # Process each page to compress images
-                for page_num in range(len(doc)):
-                    page = doc[page_num]
-                    image_list = page.get_images(full=True)
-
-                    for img_index, img_info in enumerate(image_list):
-                        xref = img_info[0]
-                        try:
-                            # Extract and recompress image
-                            base_image = doc.extract_image(xref)
-                            image_bytes = base_image["image"]
-
-                            # Compress using PIL with quality 85
-                            img = Image.open(io.BytesIO(image_bytes))
-                            img_bytes_io = io.BytesIO()
-
-                            # Save with compression
-                            if img.mode == "RGBA":
-                                img.save(img_bytes_io, format="PNG", optimize=True, compress_level=9)
-                            else:
-                                img.save(img_bytes_io, format="JPEG", quality=85, optimize=True)
-
-                            compressed_bytes = img_bytes_io.getvalue()
-
-                            # Only replace if compressed version is smaller
-                            if len(compressed_bytes) < len(image_bytes):
-                                rects = page.get_image_rects(xref)
-                                if rects:
-                                    page.delete_image(xref)
-                                    for rect in rects:
-                                        page.insert_image(rect, stream=compressed_bytes)
-                        except Exception as e:
-                            logger.warning(f"Could not compress image {xref}: {e}")
-
-                # Save with garbage collection
-                doc.save(output_path, garbage=4, deflate=True, clean=True)
+                _recompress_images(doc, level)
+                data = doc.tobytes(garbage=4, deflate=True, clean=True)
                 doc.close()
-
-                # Further compress with pikepdf
-                with pikepdf.open(output_path) as pdf:
-                    pdf.save(
-                        output_path,
-                        compress_streams=True,
-                        object_stream_mode=pikepdf.ObjectStreamMode.generate
-                    )
-
-            # Level 3: Extreme compression (downsample images + max compression)
-            elif level == 3:
-                doc = fitz.open(file_path)
-
-                # Process each page to aggressively compress images
-                for page_num in range(len(doc)):
-                    page = doc[page_num]
-                    image_list = page.get_images(full=True)
-
-                    for img_index, img_info in enumerate(image_list):
-                        xref = img_info[0]
-                        try:
-                            # Extract image
-                            base_image = doc.extract_image(xref)
-                            image_bytes = base_image["image"]
-
-                            # Aggressively compress and downsample
-                            img = Image.open(io.BytesIO(image_bytes))
-
-                            # Downsample large images
-                            max_dimension = 1500
-                            if max(img.width, img.height) > max_dimension:
-                                ratio = max_dimension / max(img.width, img.height)
-                                new_size = (int(img.width * ratio), int(img.height * ratio))
-                                img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-                            img_bytes_io = io.BytesIO()
-
-                            # Save with aggressive compression
-                            if img.mode == "RGBA":
-                                img.save(img_bytes_io, format="PNG", optimize=True, compress_level=9)
-                            else:
-                                # Convert to RGB if needed
-                                if img.mode != "RGB":
-                                    img = img.convert("RGB")
-                                img.save(img_bytes_io, format="JPEG", quality=70, optimize=True)
-
-                            compressed_bytes = img_bytes_io.getvalue()
-
-                            # Replace image
-                            rects = page.get_image_rects(xref)
-                            if rects:
-                                page.delete_image(xref)
-                                for rect in rects:
-                                    page.insert_image(rect, stream=compressed_bytes)
-                        except Exception as e:
-                            logger.warning(f"Could not compress image {xref}: {e}")
-
-                # Save with maximum garbage collection
-                doc.save(output_path, garbage=4, deflate=True, clean=True)
-                doc.close()
-
-                # Final pass with pikepdf
-                with pikepdf.open(output_path) as pdf:
-                    pdf.save(
-                        output_path,
-                        compress_streams=True,
-                        object_stream_mode=pikepdf.ObjectStreamMode.generate,
-                        recompress_flate=True
-                    )
+                doc = None
+                with pikepdf.open(io.BytesIO(data)) as pdf:
+                    _pikepdf_save(pdf, output_path, level)
 
             if os.path.exists(output_path):
                 # Check compression ratio
@@ -633,6 +585,57 @@ def compress_pdf(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
+def _recompress_images(doc, level):
+    """
+    Re-encode the images of an open document in place.
+    Level 2 keeps sizes and replaces an image only if the JPEG/PNG is smaller;
+    level 3 also downsamples to 1500px and always replaces.
+    """
+    for page in doc:
+        for img_info in page.get_images(full=True):
+            xref = img_info[0]
+            try:
+                image_bytes = doc.extract_image(xref)["image"]
+                img = Image.open(io.BytesIO(image_bytes))
+
+                if level >= 3:
+                    # Downsample large images
+                    max_dimension = 1500
+                    if max(img.width, img.height) > max_dimension:
+                        ratio = max_dimension / max(img.width, img.height)
+                        new_size = (int(img.width * ratio), int(img.height * ratio))
+                        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+                img_bytes_io = io.BytesIO()
+                if img.mode == "RGBA":
+                    img.save(img_bytes_io, format="PNG", optimize=True, compress_level=9)
+                elif level >= 3:
+                    if img.mode != "RGB":
+                        img = img.convert("RGB")
+                    img.save(img_bytes_io, format="JPEG", quality=70, optimize=True)
+                else:
+                    img.save(img_bytes_io, format="JPEG", quality=85, optimize=True)
+                compressed_bytes = img_bytes_io.getvalue()
+
+                # Level 2 only replaces images that got smaller
+                if level >= 3 or len(compressed_bytes) < len(image_bytes):
+                    rects = page.get_image_rects(xref)
+                    if rects:
+                        page.delete_image(xref)
+                        for rect in rects:
+                            page.insert_image(rect, stream=compressed_bytes)
+            except Exception as e:
+                logger.warning(f"Could not compress image {xref}: {e}")
+
+def _pikepdf_save(pdf, output_path, level):
+    """Final write with the stream settings of a compression level (0-3)."""
+    options = {"compress_streams": True}
+    if level >= 1:
+        options["object_stream_mode"] = pikepdf.ObjectStreamMode.generate
+    if level >= 3:
+        options["recompress_flate"] = True
+    pdf.save(output_path, **options)
+
 def protect_pdf(payload):
     """Add password protection to PDF."""
     files = payload.get("files", [])
@@ -658,8 +661,8 @@ def protect_pdf(payload):
             base, ext = os.path.splitext(file_path)
             output_path = f"{base}_protected{ext}"
 
-            reader = PdfReader(file_path)
-            writer = PdfWriter()
+            reader = pypdf.PdfReader(file_path)
+            writer = pypdf.PdfWriter()
 
             for page in reader.pages:
                 writer.add_page(page)
@@ -695,7 +698,7 @@ def unlock_pdf(payload):
             base, ext = os.path.splitext(file_path)
             output_path = f"{base}_unlocked{ext}"
 
-            reader = PdfReader(file_path)
+            reader = pypdf.PdfReader(file_path)
             if reader.is_encrypted:
                 if not password:
                     errors.append({"file": file_path, "error": "This PDF is password-protected. Please provide the password."})
@@ -705,7 +708,7 @@ def unlock_pdf(payload):
                     errors.append({"file": file_path, "error": "Incorrect password. Please try again."})
                     continue
 
-            writer = PdfWriter()
+            writer = pypdf.PdfWriter()
             for page in reader.pages:
                 writer.add_page(page)
 
@@ -727,25 +730,76 @@ def _clamp(value, min_val, max_val, default):
         return default
 
 
-def watermark_pdf(payload):
-    """Add watermark to PDF pages."""
-    files = payload.get("files", [])
-    watermark_type = payload.get("watermark_type", "text")
-    text = payload.get("text", "CONFIDENTIAL")
-
-    # Validate and clamp numeric parameters
-    opacity = _clamp(payload.get("opacity"), 0.0, 1.0, 0.5)
-    watermark_file = payload.get("watermark_file")
-    color = str(payload.get("color", "gray"))
-    font_size = int(_clamp(payload.get("font_size"), 8, 500, 72))  # Min 8pt, max 500pt
-    x_percent = _clamp(payload.get("x"), 0.0, 1.0, 0.5)  # 0-1 range
-    y_percent = _clamp(payload.get("y"), 0.0, 1.0, 0.5)  # 0-1 range
+def _watermark_options(params):
+    """Validated watermark settings from a payload (or a pipeline step)."""
+    text = params.get("text", "CONFIDENTIAL")
 
     # Validate text length to prevent memory issues
     MAX_WATERMARK_TEXT_LENGTH = 500
     if text and len(text) > MAX_WATERMARK_TEXT_LENGTH:
         text = text[:MAX_WATERMARK_TEXT_LENGTH]
 
+    return {
+        "watermark_type": params.get("watermark_type", "text"),
+        "text": text,
+        # Validate and clamp numeric parameters
+        "opacity": _clamp(params.get("opacity"), 0.0, 1.0, 0.5),
+        "watermark_file": params.get("watermark_file"),
+        "color": str(params.get("color", "gray")),
+        "font_size": int(_clamp(params.get("font_size"), 8, 500, 72)),  # Min 8pt, max 500pt
+        "x": _clamp(params.get("x"), 0.0, 1.0, 0.5),  # 0-1 range
+        "y": _clamp(params.get("y"), 0.0, 1.0, 0.5),  # 0-1 range
+    }
+
+def _watermark_page(page, options):
+    """Draw the text or image watermark described by _watermark_options() on one page."""
+    rect = page.rect
+    opacity = options["opacity"]
+
+    if options["watermark_type"] == "text":
+        # Parse color - convert to RGBA with opacity
+        # Support both color names and hex colors
+        color = options["color"]
+        if color.startswith("#"):
+            # Hex color (e.g., "#ff0000")
+            hex_color = color.lstrip("#")
+            if len(hex_color) == 6:
+                r = int(hex_color[0:2], 16) / 255.0
+                g = int(hex_color[2:4], 16) / 255.0
+                b = int(hex_color[4:6], 16) / 255.0
+                base_color = (r, g, b)
+            else:
+                base_color = (0.5, 0.5, 0.5)  # fallback
+        elif color == "gray":
+            base_color = (0.5, 0.5, 0.5)
+        elif color == "red":
+            base_color = (1, 0, 0)
+        elif color == "blue":
+            base_color = (0, 0, 1)
+        else:
+            base_color = (0.5, 0.5, 0.5)
+
+        # Apply opacity to color (convert RGB to RGBA)
+        fill_color = base_color + (opacity,)
+
+        # Calculate position from percentages
+        point = fitz.Point(rect.width * options["x"], rect.height * options["y"])
+
+        # Insert text with RGBA color (includes opacity)
+        page.insert_text(point, options["text"], fontsize=options["font_size"], color=fill_color,
+                         render_mode=0)  # render_mode=0 for fill
+    elif options["watermark_type"] == "image" and options["watermark_file"]:
+        # Image watermark
+        img_rect = fitz.Rect(0, 0, rect.width, rect.height)
+        page.insert_image(img_rect, filename=options["watermark_file"], opacity=opacity)
+
+def watermark_pdf(payload):
+    """Add watermark to PDF pages."""
+    files = payload.get("files", [])
+    options = _watermark_options(payload)
+    watermark_type = options["watermark_type"]
+    watermark_file = options["watermark_file"]
+
     processed_files = []
     errors = []
 
@@ -764,55 +818,13 @@ def watermark_pdf(payload):
 
             doc = fitz.open(file_path)
 
-            for page in doc:
-                rect = page.rect
-
-                if watermark_type == "text":
-                    # Text watermark
-                    try:
-                        # Parse color - convert to RGBA with opacity
-                        # Support both color names and hex colors
-                        if color.startswith("#"):
-                            # Hex color (e.g., "#ff0000")
-                            hex_color = color.lstrip("#")
-                            if len(hex_color) == 6:
-                                r = int(hex_color[0:2], 16) / 255.0
-                                g = int(hex_color[2:4], 16) / 255.0
-                                b = int(hex_color[4:6], 16) / 255.0
-                                base_color = (r, g, b)
-                            else:
-                                base_color = (0.5, 0.5, 0.5)  # fallback
-                        elif color == "gray":
-                            base_color = (0.5, 0.5, 0.5)
-                        elif color == "red":
-                            base_color = (1, 0, 0)
-                        elif color == "blue":
-                            base_color = (0, 0, 1)
-                        else:
-                            base_color = (0.5, 0.5, 0.5)
-
-                        # Apply opacity to color (convert RGB to RGBA)
-                        fill_color = base_color + (opacity,)
-
-                        # Calculate position from percentages
-                        point = fitz.Point(rect.width * x_percent, rect.height * y_percent)
-
-                        # Insert text with RGBA color (includes opacity)
-                        page.insert_text(point, text, fontsize=font_size, color=fill_color,
-                                       render_mode=0)  # render_mode=0 for fill
-                    except Exception as e:
-                        errors.append({"file": file_path, "error": f"bad rotate value" if "rotate" in str(e).lower() else str(e)})
-                        doc.close()
-                        continue
-                elif watermark_type == "image" and watermark_file:
-                    # Image watermark
-                    try:
-                        img_rect = fitz.Rect(0, 0, rect.width, rect.height)
-                        page.insert_image(img_rect, filename=watermark_file, opacity=opacity)
-                    except Exception as e:
-                        errors.append({"file": file_path, "error": str(e)})
-                        doc.close()
-                        continue
+            try:
+                for page in doc:
+                    _watermark_page(page, options)
+            except Exception as e:
+                errors.append({"file": file_path, "error": f"bad rotate value" if "rotate" in str(e).lower() else str(e)})
+                doc.close()
+                continue
 
             doc.save(output_path)
             doc.close()
@@ -822,32 +834,34 @@ def watermark_pdf(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
-def rotate_pdf(payload):
-    """Rotate PDF pages."""
-    files = payload.get("files", [])
-    angle = payload.get("angle", 90)  # 90, 180, 270
-    pages = payload.get("pages", "")  # Optional: specific pages
-
-    # Convert angle to int and normalize to valid values (0, 90, 180, 270)
+def _normalize_angle(angle):
+    """Angle as one of 0, 90, 180, 270 (the only values PyMuPDF accepts); 90 if invalid."""
     try:
         angle = int(float(angle))  # Handle both string and float inputs
         # Normalize to 0-360 range
         angle = angle % 360
         if angle < 0:
             angle += 360
-        # Round to nearest 90 degrees (PyMuPDF only supports 0, 90, 180, 270)
+        # Round to nearest 90 degrees
         if angle < 45:
-            angle = 0
+            return 0
         elif angle < 135:
-            angle = 90
+            return 90
         elif angle < 225:
-            angle = 180
+            return 180
         elif angle < 315:
-            angle = 270
-        else:
-            angle = 0
+            return 270
+        return 0
     except (ValueError, TypeError):
-        angle = 90  # Default to 90 degrees if invalid
+        return 90  # Default to 90 degrees if invalid
+
+def rotate_pdf(payload):
+    """Rotate PDF pages."""
+    files = payload.get("files", [])
+    angle = payload.get("angle", 90)  # 90, 180, 270
+    pages = payload.get("pages", "")  # Optional: specific pages
+
+    angle = _normalize_angle(angle)
 
     processed_files = []
     errors = []
@@ -966,6 +980,7 @@ def pdf_to_images(payload):
                 continue
 
             for page_num in range(len(doc)):
+                progress.report(page_num, len(doc), f"Rendering page {page_num + 1}/{len(doc)}")
                 page = doc[page_num]
                 pix = page.get_pixmap(dpi=300)
                 output_path = f"{base}_page_{page_num + 1}.png"
@@ -1407,6 +1422,7 @@ def extract_tables(payload):
 
                     # Extract tables from each page - collect them for potential merging
                     for page_num, page_obj in enumerate(pdf.pages):
+                        progress.report(page_num, total_pages, f"Extracting tables from page {page_num + 1}/{total_pages}")
                         try:
                             # Extract tables with custom settings for better detection
                             tables = page_obj.extract_tables(table_settings=table_settings)
@@ -1895,6 +1911,24 @@ def flatten_pdf(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
+def _number_page(page, number, position):
+    """Write the page number in one corner (bottom-right, bottom-left, top-right, top-left)."""
+    rect = page.rect
+
+    # Calculate position
+    if position == "bottom-right":
+        point = fitz.Point(rect.width - 50, rect.height - 20)
+    elif position == "bottom-left":
+        point = fitz.Point(50, rect.height - 20)
+    elif position == "top-right":
+        point = fitz.Point(rect.width - 50, 30)
+    elif position == "top-left":
+        point = fitz.Point(50, 30)
+    else:
+        point = fitz.Point(rect.width - 50, rect.height - 20)
+
+    page.insert_text(point, str(number), fontsize=12, color=(0, 0, 0))
+
 def add_page_numbers(payload):
     """Add page numbers to PDF."""
     files = payload.get("files", [])
@@ -1911,21 +1945,7 @@ def add_page_numbers(payload):
             doc = fitz.open(file_path)
 
             for page_num, page in enumerate(doc):
-                rect = page.rect
-
-                # Calculate position
-                if position == "bottom-right":
-                    point = fitz.Point(rect.width - 50, rect.height - 20)
-                elif position == "bottom-left":
-                    point = fitz.Point(50, rect.height - 20)
-                elif position == "top-right":
-                    point = fitz.Point(rect.width - 50, 30)
-                elif position == "top-left":
-                    point = fitz.Point(50, 30)
-                else:
-                    point = fitz.Point(rect.width - 50, rect.height - 20)
-
-                page.insert_text(point, str(page_num + 1), fontsize=12, color=(0, 0, 0))
+                _number_page(page, page_num + 1, position)
 
             doc.save(output_path)
             doc.close()
@@ -3309,14 +3329,48 @@ def html_to_pdf(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
+# ocr_pdf output modes: keep the original pages and add a text layer, or rebuild them from the scans
+OCR_OUTPUT_MODES = ("overlay", "rasterize")
+
 def ocr_pdf(payload):
-    """Convert scanned PDF to searchable PDF using OCR."""
+    """
+    Convert scanned PDF to searchable PDF using OCR.
+
+    Pages are rendered and recognized as a stream, several at a time, with
+    one Tesseract pass each (see ocr.py). Pages that already have a text
+    layer are left alone unless force_ocr is set, and pages recognized in an
+    earlier run reuse their word boxes (see ocr_cache.py).
+
+    output_mode "overlay" (default) keeps the original pages, with their
+    vector content, images and geometry, and only adds invisible text over
+    the recognized words. "rasterize" replaces every OCRed page with its
+    300 DPI rendering plus the text layer.
+
+    preprocess conditions each page before recognition (see
+    ocr_preprocess.py): true for the default steps, or a list such as
+    ["deskew", "binarize"]. Defaults to OCR_PREPROCESS. Only the image
+    Tesseract reads changes; the output pages are never altered by it.
+    """
     files = payload.get("files", [])
     language = payload.get("language", "eng")  # Default English
+    force_ocr = payload.get("force_ocr", False)
+    output_mode = payload.get("output_mode", "overlay")
 
     processed_files = []
     errors = []
 
+    if output_mode not in OCR_OUTPUT_MODES:
+        for file_path in files:
+            errors.append({"file": file_path, "error": f"Unknown output_mode: {output_mode}. Supported: {', '.join(OCR_OUTPUT_MODES)}"})
+        return {"processed_files": processed_files, "errors": errors}
+
+    try:
+        preprocess = ocr_preprocess.parse_steps(payload.get("preprocess", ocr_preprocess.OCR_PREPROCESS))
+    except ValueError as e:
+        for file_path in files:
+            errors.append({"file": file_path, "error": str(e)})
+        return {"processed_files": processed_files, "errors": errors}
+
     # Configure Tesseract (bundled or system)
     configure_tesseract()
 
@@ -3332,135 +3386,60 @@ def ocr_pdf(payload):
             base, ext = os.path.splitext(file_path)
             output_path = f"{base}_ocr{ext}"
 
-            # Try pytesseract (Tesseract OCR)
             try:
-                import pytesseract
-                from pdf2image import convert_from_path
+                import pytesseract  # noqa: F401 - fail early with the install hint below
+
+                doc = fitz.open(file_path)
+                # Overlay writes into the source document; rasterize builds a new one
+                out_doc = doc if output_mode == "overlay" else fitz.open()
+                total_pages = doc.page_count
+                skipped = cached = 0
+                logger.info(f"Processing {total_pages} pages for OCR ({output_mode}"
+                            f"{', preprocess: ' + ','.join(preprocess) if preprocess else ''})")
 
-                # Convert PDF pages to images
                 try:
-                    images = convert_from_path(file_path, dpi=300)
-                except Exception as e:
-                    # Fallback: use PyMuPDF to render pages
-                    images = []
-                    doc = fitz.open(file_path)
-                    for page in doc:
-                        pix = page.get_pixmap(dpi=300)
-                        img_data = pix.tobytes("png")
-                        images.append(Image.open(io.BytesIO(img_data)))
-                    doc.close()
+                    pages = ocr.iter_pages(doc, language, skip_text_pages=not force_ocr,
+                                           keep_images=out_doc is not doc, preprocess=preprocess)
+                    for page_idx, result in pages:
+                        progress.report(page_idx, total_pages, f"OCR page {page_idx + 1}/{total_pages}")
+                        if result["skipped"]:
+                            # Already searchable: keep the original page
+                            if out_doc is not doc:
+                                out_doc.insert_pdf(doc, from_page=page_idx, to_page=page_idx)
+                            skipped += 1
+                            continue
 
-                # Create new PDF with OCR text
-                ocr_doc = fitz.open()
-                total_pages = len(images)
-                logger.info(f"Processing {total_pages} pages for OCR")
-
-                for page_idx, img in enumerate(images):
-                    logger.info(f"Processing page {page_idx + 1}/{total_pages}")
-                    
-                    # Perform OCR with detailed data (bounding boxes)
-                    ocr_data = None
-                    ocr_text = ""
-                    try:
-                        # Get OCR data with bounding boxes for accurate text positioning
-                        ocr_data = pytesseract.image_to_data(img, lang=language, output_type=pytesseract.Output.DICT)
-                        ocr_text = pytesseract.image_to_string(img, lang=language)
-                        logger.info(f"OCR extracted {len(ocr_text)} characters from page {page_idx + 1}")
-                    except Exception as ocr_err:
-                        logger.error(f"OCR failed for page {page_idx + 1}: {ocr_err}")
-                        # Fallback: try simple OCR without detailed data
-                        try:
-                            ocr_text = pytesseract.image_to_string(img, lang=language)
-                            logger.info(f"Fallback OCR extracted {len(ocr_text)} characters")
-                        except Exception as fallback_err:
-                            logger.error(f"Fallback OCR also failed: {fallback_err}")
-                            ocr_text = ""
-
-                    # Create new page
-                    page = ocr_doc.new_page(width=img.width, height=img.height)
-
-                    # Insert original image
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    page.insert_image(page.rect, stream=img_bytes.getvalue())
-
-                    # Add invisible text layer (for searchability)
-                    text_added = False
-                    if ocr_text.strip():
-                        if ocr_data and len(ocr_data.get('text', [])) > 0:
-                            # Use OCR bounding boxes for accurate text positioning
-                            n_boxes = len(ocr_data['text'])
-                            logger.info(f"Found {n_boxes} text boxes from OCR")
-                            for i in range(n_boxes):
-                                text = ocr_data['text'][i].strip()
-                                conf = int(ocr_data['conf'][i]) if ocr_data['conf'][i] else 0
-                                if text and conf > 0:  # Confidence > 0
-                                    x = ocr_data['left'][i]
-                                    y = ocr_data['top'][i]
-                                    w = ocr_data['width'][i]
-                                    h = ocr_data['height'][i]
-                                    
-                                    # Convert to PDF coordinates (OCR uses top-left, PyMuPDF uses bottom-left)
-                                    pdf_y = img.height - y - h
-                                    
-                                    # Insert invisible text (render_mode=3) for searchability
-                                    try:
-                                        page.insert_text(
-                                            fitz.Point(x, pdf_y + h),
-                                            text,
-                                            fontsize=max(8, min(h * 0.8, 12)),
-                                            color=(1, 1, 1),  # White (invisible on white background)
-                                            render_mode=3  # Invisible but searchable
-                                        )
-                                        text_added = True
-                                    except Exception as text_err:
-                                        logger.warning(f"Failed to insert text at position ({x}, {pdf_y}): {text_err}")
-                                        # Fallback: simple text insertion
-                                        try:
-                                            page.insert_text(
-                                                fitz.Point(x, pdf_y + h),
-                                                text[:50],  # Limit length
-                                                fontsize=10,
-                                                color=(1, 1, 1),
-                                                render_mode=3
-                                            )
-                                            text_added = True
-                                        except:
-                                            pass
-                        
-                        # Fallback: add text as lines if bounding boxes failed
-                        if not text_added:
-                            logger.info("Using fallback text positioning (lines)")
-                            lines = [l.strip() for l in ocr_text.split('\n') if l.strip()]
-                            if lines:
-                                line_height = img.height / max(len(lines), 1)
-                                line_idx = 0
-                                for line in lines[:200]:  # Limit lines for performance
-                                    y_pos = line_idx * line_height + 20
-                                    text_point = fitz.Point(10, min(y_pos, page.rect.height - 10))
-                                    # Use render_mode=3 (invisible) to make text searchable but not visible
-                                    try:
-                                        page.insert_text(
-                                            text_point,
-                                            line[:100],  # Limit line length
-                                            fontsize=12,
-                                            color=(1, 1, 1),
-                                            render_mode=3
-                                        )
-                                        text_added = True
-                                    except Exception as line_err:
-                                        logger.warning(f"Failed to insert line {line_idx}: {line_err}")
-                                    line_idx += 1
-                    
-                    if text_added:
-                        logger.info(f"Successfully added searchable text to page {page_idx + 1}")
+                        cached += result.get("cached", False)
+                        if out_doc is doc:
+                            page = doc[page_idx]
+                        else:
+                            img = result.pop("image")
+                            scale = 72 / result["dpi"]
+                            page = out_doc.new_page(width=img.width * scale, height=img.height * scale)
+                            img_bytes = io.BytesIO()
+                            img.save(img_bytes, format='PNG')
+                            page.insert_image(page.rect, stream=img_bytes.getvalue())
+                            del img, img_bytes
+
+                        if _insert_ocr_text(page, result):
+                            logger.info(f"Added searchable text to page {page_idx + 1} ({len(result['text'])} characters)")
+                        else:
+                            logger.warning(f"No text was added to page {page_idx + 1}")
+
+                    if skipped:
+                        logger.info(f"{skipped}/{total_pages} pages already had a text layer and were not OCRed")
+                    if cached:
+                        logger.info(f"{cached}/{total_pages} pages reused OCR results from an earlier run")
+                    if out_doc is doc:
+                        # Only the new text streams need compressing; existing objects are copied
+                        doc.save(output_path, garbage=1, deflate=True)
                     else:
-                        logger.warning(f"No text was added to page {page_idx + 1}")
+                        out_doc.save(output_path, garbage=4, deflate=True)
+                finally:
+                    if out_doc is not doc:
+                        out_doc.close()
+                    doc.close()
 
-                ocr_doc.save(output_path)
-                ocr_doc.close()
-                
                 # Verify output file was created
                 if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                     logger.info(f"OCR PDF saved successfully: {output_path} ({os.path.getsize(output_path)} bytes)")
@@ -3470,7 +3449,7 @@ def ocr_pdf(payload):
                     errors.append({"file": file_path, "error": "OCR processing completed but output file was not created"})
 
             except ImportError:
-                errors.append({"file": file_path, "error": "Python packages required. Install with: pip install pytesseract pdf2image"})
+                errors.append({"file": file_path, "error": "Python package required. Install with: pip install pytesseract"})
             except Exception as e:
                 error_str = str(e)
                 # Check if it's a Tesseract-specific error
@@ -3488,6 +3467,60 @@ def ocr_pdf(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
+def _insert_ocr_text(page, result):
+    """
+    Add the OCR words of one page as invisible, searchable text over their
+    boxes. Boxes are in pixels of the page as rendered at result["dpi"]
+    (rotation and crop box applied). Each word is sized to its box height and
+    stretched to its width, so selections line up with the scan. Falls back
+    to evenly spaced lines if no box could be placed. Returns True if any
+    text was added.
+    """
+    scale = 72 / result["dpi"]
+    rect = page.rect
+    # insert_text works in unrotated coordinates; boxes are in the displayed orientation
+    derotate = page.derotation_matrix
+    sideways = page.rotation in (90, 270)
+    shape = page.new_shape()
+    text_added = False
+
+    for word in result["words"]:
+        if word["conf"] <= 0:
+            continue
+        x, y = rect.x0 + word["left"] * scale, rect.y0 + word["top"] * scale
+        w, h = word["width"] * scale, word["height"] * scale
+        if w <= 0 or h <= 0:
+            continue
+        origin = fitz.Point(x, y + h) * derotate  # baseline at the bottom of the box
+        natural = fitz.get_text_length(word["text"], fontname="helv", fontsize=h)
+        stretch = w / natural if natural else 1
+        morph = (origin, fitz.Matrix(1, stretch) if sideways else fitz.Matrix(stretch, 1))
+        try:
+            shape.insert_text(origin, word["text"], fontsize=h, fontname="helv",
+                              rotate=page.rotation, morph=morph,
+                              render_mode=3)  # Invisible but searchable
+            text_added = True
+        except Exception as text_err:
+            logger.warning(f"Failed to insert text at position ({x:.0f}, {y:.0f}): {text_err}")
+
+    # Fallback: add text as lines if bounding boxes failed
+    if not text_added and result["text"].strip():
+        logger.info("Using fallback text positioning (lines)")
+        lines = [l.strip() for l in result["text"].split('\n') if l.strip()]
+        line_height = rect.height / max(len(lines), 1)
+        for line_idx, line in enumerate(lines[:200]):  # Limit lines for performance
+            y_pos = rect.y0 + min(line_idx * line_height + 20, rect.height - 10)
+            try:
+                shape.insert_text(fitz.Point(rect.x0 + 10, y_pos) * derotate, line[:100],  # Limit line length
+                                  fontsize=12, rotate=page.rotation, render_mode=3)
+                text_added = True
+            except Exception as line_err:
+                logger.warning(f"Failed to insert line {line_idx}: {line_err}")
+
+    if text_added:
+        shape.commit()
+    return text_added
+
 def pdf_to_pdfa(payload):
     """Convert PDF to PDF/A format (archival compliance).
 
@@ -3547,6 +3580,30 @@ def pdf_to_pdfa(payload):
 
     return {"processed_files": processed_files, "errors": errors}
 
+def _crop_page(page, x, y, width, height):
+    """Set the crop box of one page. Returns an error message if the rectangle is invalid."""
+    page_rect = page.rect
+
+    # Calculate crop rectangle
+    # x, y are from top-left, convert to fitz coordinates
+    crop_rect = fitz.Rect(
+        float(x),
+        float(y),
+        min(float(x) + float(width), page_rect.width),
+        min(float(y) + float(height), page_rect.height)
+    )
+
+    # Validate crop rectangle is within page bounds
+    if crop_rect.x1 <= crop_rect.x0 or crop_rect.y1 <= crop_rect.y0:
+        return "Invalid crop dimensions"
+
+    if crop_rect.x0 < 0 or crop_rect.y0 < 0:
+        return "Crop coordinates out of bounds"
+
+    # Set crop box (visible area)
+    page.set_cropbox(crop_rect)
+    return None
+
 def crop_pdf(payload):
     """Crop PDF pages to specific dimensions."""
     files = payload.get("files", [])
@@ -3607,29 +3664,9 @@ def crop_pdf(payload):
             # Process pages
             for page_num in range(total_pages):
                 if page_list is None or page_num in page_list:
-                    page = doc[page_num]
-                    page_rect = page.rect
-
-                    # Calculate crop rectangle
-                    # x, y are from top-left, convert to fitz coordinates
-                    crop_rect = fitz.Rect(
-                        float(x),
-                        float(y),
-                        min(float(x) + float(width), page_rect.width),
-                        min(float(y) + float(height), page_rect.height)
-                    )
-
-                    # Validate crop rectangle is within page bounds
-                    if crop_rect.x1 <= crop_rect.x0 or crop_rect.y1 <= crop_rect.y0:
-                        errors.append({"file": file_path, "error": f"Invalid crop dimensions for page {page_num + 1}"})
-                        continue
-
-                    if crop_rect.x0 < 0 or crop_rect.y0 < 0:
-                        errors.append({"file": file_path, "error": f"Crop coordinates out of bounds for page {page_num + 1}"})
-                        continue
-
-                    # Set crop box (visible area)
-                    page.set_cropbox(crop_rect)
+                    error = _crop_page(doc[page_num], x, y, width, height)
+                    if error:
+                        errors.append({"file": file_path, "error": f"{error} for page {page_num + 1}"})
 
             doc.save(output_path)
             if doc:
@@ -4313,4 +4350,175 @@ def extract_form_data(payload):
                     pass
 
     return {"processed_files": processed_files, "errors": errors}
+
+# ============================================================================
+# PDF PIPELINE
+# ============================================================================
+
+class _PipelineDocument:
+    """
+    The working document of a pipeline. It is held either as a PyMuPDF
+    document or as a pikepdf Pdf, and is handed over in memory only when a step
+    needs the other engine.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.doc = fitz.open(path)
+        self.pdf = None
+        self.compress_level = None  # set by a compress step, applied when saving
+        self.handovers = 0
+
+    def as_fitz(self):
+        if self.doc is None:
+            buffer = io.BytesIO()
+            self.pdf.save(buffer)
+            self.pdf.close()
+            self.pdf = None
+            self.doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
+            self.handovers += 1
+        return self.doc
+
+    def as_pikepdf(self, data=None):
+        if self.pdf is None:
+            if data is None:
+                data = self.doc.tobytes()
+            self.doc.close()
+            self.doc = None
+            self.pdf = pikepdf.open(io.BytesIO(data))
+            self.handovers += 1
+        return self.pdf
+
+    def output_path(self):
+        base, ext = os.path.splitext(self.path)
+        return f"{base}_processed{ext}"
+
+    def save(self, output_path):
+        level = self.compress_level
+        if level is None:
+            if self.doc is not None:
+                # garbage=1 drops pages removed by delete_pages/organize
+                self.doc.save(output_path, garbage=1)
+            else:
+                self.pdf.save(output_path)
+            return
+
+        data = None
+        if level >= 2 and self.doc is not None:
+            # Same cleanup compress_pdf does before the pikepdf write
+            data = self.doc.tobytes(garbage=4, deflate=True, clean=True)
+        _pikepdf_save(self.as_pikepdf(data), output_path, level)
+
+    def close(self):
+        if self.doc is not None:
+            self.doc.close()
+        if self.pdf is not None:
+            self.pdf.close()
+
+def _pipeline_pages(params, total_pages):
+    """Indices of the pages a step applies to; all pages when "pages" is empty."""
+    pages = str(params.get("pages") or "").strip()
+    if not pages:
+        return range(total_pages)
+    indices, error = _validate_page_spec(pages, total_pages)
+    if error:
+        raise ValueError(error)
+    return indices
+
+def _step_rotate(document, params):
+    doc = document.as_fitz()
+    angle = _normalize_angle(params.get("angle", 90))
+    for page_num in _pipeline_pages(params, len(doc)):
+        doc[page_num].set_rotation(angle)
+
+def _step_crop(document, params):
+    doc = document.as_fitz()
+    width, height = params.get("width"), params.get("height")
+    if width is None or height is None:
+        raise ValueError("Width and height are required for cropping")
+    if float(width) <= 0 or float(height) <= 0:
+        raise ValueError("Width and height must be positive")
+    for page_num in _pipeline_pages(params, len(doc)):
+        error = _crop_page(doc[page_num], params.get("x", 0), params.get("y", 0), width, height)
+        if error:
+            raise ValueError(f"{error} for page {page_num + 1}")
+
+def _step_watermark(document, params):
+    options = _watermark_options(params)
+    if options["watermark_type"] == "image" and options["watermark_file"]:
+        validate_input_file(options["watermark_file"])
+    for page in document.as_fitz():
+        _watermark_page(page, options)
+
+def _step_page_numbers(document, params):
+    position = params.get("position", "bottom-right")
+    for page_num, page in enumerate(document.as_fitz()):
+        _number_page(page, page_num + 1, position)
+
+def _step_delete_pages(document, params):
+    doc = document.as_fitz()
+    to_delete, error = _validate_page_spec(str(params.get("pages") or ""), len(doc))
+    if error:
+        raise ValueError(error)
+    to_delete = set(to_delete)
+    keep = [p for p in range(len(doc)) if p not in to_delete]
+    if not keep:
+        raise ValueError("Cannot delete every page")
+    doc.select(keep)
+
+def _step_organize(document, params):
+    doc = document.as_fitz()
+    order, error = _validate_page_spec(str(params.get("page_order") or ""), len(doc))
+    if error:
+        raise ValueError(error)
+    doc.select(order)
+
+def _step_remove_metadata(document, params):
+    pdf = document.as_pikepdf()
+    if '/Metadata' in pdf.Root:
+        del pdf.Root.Metadata
+    pdf.docinfo.clear()
+
+def _step_compress(document, params):
+    try:
+        level = max(0, min(3, int(params.get("level", 1))))
+    except (ValueError, TypeError):
+        level = 1
+    if level >= 2:
+        _recompress_images(document.as_fitz(), level)
+    document.compress_level = level
+
+# Step name -> handler(document, params); params are those of the standalone action
+PIPELINE_STEPS = {
+    "rotate": _step_rotate,
+    "crop": _step_crop,
+    "watermark": _step_watermark,
+    "page_numbers": _step_page_numbers,
+    "delete_pages": _step_delete_pages,
+    "organize": _step_organize,
+    "remove_metadata": _step_remove_metadata,
+    "compress": _step_compress,
+}
+
+def run_pipeline(payload):
+    """
+    Apply an ordered list of steps to each PDF with one parse and one write.
+
+    payload["steps"] is a list like
+    [{"action": "rotate", "angle": 90}, {"action": "watermark", "text": "DRAFT"},
+     {"action": "page_numbers"}, {"action": "compress", "level": 2}].
+    Each step takes the parameters of the standalone action. Steps edit the
+    open PyMuPDF document; remove_metadata runs on pikepdf, and the document is
+    handed over in memory when the engine changes. compress decides how the
+    final file is written, wherever it appears in the list.
+
+    Returns processed_files, errors, per-step timings ("steps") and the
+    number of engine handovers (see pipeline.run).
+    """
+    handovers = []
+    result = pipeline.run(payload, PIPELINE_STEPS, _PipelineDocument,
+                          on_saved=lambda document: handovers.append(document.handovers))
+    result["engine_handovers"] = sum(handovers)
+    return result
+
 # Trigger reload
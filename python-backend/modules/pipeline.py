@@ -0,0 +1,123 @@
+"""
+Shared driver for the "pipeline" actions of pdf_tools and image_tools.
+
+Both run an ordered list of steps on one open document per file and write it
+once. The step table and the working document differ; parsing and
+validating the steps, the per-step timing, progress and error reporting
+live here so the two pipelines behave the same.
+
+A document factory takes a file path and returns the working document. It
+provides output_path() and save(output_path), and optionally close(). Step
+handlers take (document, params), where params are the step's dict.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from modules import progress, tracing
+except ImportError:
+    import progress
+    import tracing
+
+logger = logging.getLogger(__name__)
+
+MAX_PIPELINE_STEPS = 20
+
+
+def parse_steps(payload: Dict[str, Any], step_table: Dict[str, Callable]) -> List[Dict[str, Any]]:
+    """
+    The validated step list of a pipeline payload (a list or its JSON text).
+    An uploaded watermark_file applies to watermark steps that don't name one.
+    Raises ValueError for an invalid list or an unsupported step.
+    """
+    steps = payload.get("steps") or []
+    if isinstance(steps, str):
+        try:
+            steps = json.loads(steps)
+        except json.JSONDecodeError:
+            raise ValueError("Invalid steps: expected a JSON list")
+
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("Invalid steps: expected a non-empty list")
+    if len(steps) > MAX_PIPELINE_STEPS:
+        raise ValueError(f"Too many steps (max {MAX_PIPELINE_STEPS})")
+    for step in steps:
+        if not isinstance(step, dict) or step.get("action") not in step_table:
+            action = step.get("action") if isinstance(step, dict) else step
+            raise ValueError(f"Unsupported pipeline step: {action}. Supported: {', '.join(step_table)}")
+        if step["action"] == "watermark" and payload.get("watermark_file"):
+            step.setdefault("watermark_file", payload["watermark_file"])
+    return steps
+
+
+def run(payload: Dict[str, Any], step_table: Dict[str, Callable], open_document: Callable[[str], Any],
+        open_label: Optional[str] = None, save_label: str = "save",
+        on_saved: Optional[Callable[[Any], None]] = None) -> Dict[str, Any]:
+    """
+    Apply payload["steps"] to every file in payload["files"].
+
+    open_label / save_label name the open and write phases in the timings
+    (an open phase is only reported with a label). on_saved(document) runs
+    after each successful write, for pipeline-specific statistics.
+
+    Returns processed_files, errors and per-step timings ("steps").
+    """
+    files = payload.get("files", [])
+    try:
+        steps = parse_steps(payload, step_table)
+    except ValueError as e:
+        return {"processed_files": [], "errors": [{"error": str(e)}]}
+
+    processed_files = []
+    errors = []
+    timings = [0.0] * len(steps)
+    open_ms = 0.0
+    save_ms = 0.0
+    total_steps = len(files) * len(steps)
+
+    for file_index, file_path in enumerate(files):
+        document = None
+        try:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File not found: {file_path}")
+
+            start = time.perf_counter()
+            with tracing.span(f"pipeline_{open_label or 'open'}"):
+                document = open_document(file_path)
+            open_ms += (time.perf_counter() - start) * 1000
+
+            for index, step in enumerate(steps):
+                action = step["action"]
+                start = time.perf_counter()
+                try:
+                    with tracing.span(f"pipeline_{action}"):
+                        step_table[action](document, step)
+                except Exception as e:
+                    raise ValueError(f"Step {index + 1} ({action}) failed: {e}") from e
+                timings[index] += (time.perf_counter() - start) * 1000
+                progress.report(file_index * len(steps) + index + 1, total_steps, f"{action} ({index + 1}/{len(steps)})")
+
+            output_path = document.output_path()
+            start = time.perf_counter()
+            with tracing.span(f"pipeline_{save_label}"):
+                document.save(output_path)
+            save_ms += (time.perf_counter() - start) * 1000
+            if on_saved is not None:
+                on_saved(document)
+            processed_files.append(output_path)
+        except Exception as e:
+            logger.error(f"Pipeline failed for {file_path}: {e}")
+            errors.append({"file": file_path, "error": str(e)})
+        finally:
+            if document is not None and hasattr(document, "close"):
+                document.close()
+
+    step_timings = [{"action": step["action"], "ms": round(ms, 1)} for step, ms in zip(steps, timings)]
+    if open_label:
+        step_timings.insert(0, {"action": open_label, "ms": round(open_ms, 1)})
+    step_timings.append({"action": save_label, "ms": round(save_ms, 1)})
+    return {"processed_files": processed_files, "errors": errors, "steps": step_timings}
@@ -0,0 +1,60 @@
+"""
+Progress reporting for long-running actions.
+
+Actions call report() per page or per file. Whoever runs the action (the job
+runner, the stdin bridge) installs a callback with reporting_to(); without one
+report() is a no-op, so tools stay unaware of how progress is delivered.
+The callback is held in a ContextVar, so concurrent requests never see each
+other's progress.
+"""
+
+import contextvars
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_callback = contextvars.ContextVar("progress_callback", default=None)
+
+
+def report(current, total=None, message=None):
+    """
+    Report progress of the running action.
+
+    Args:
+        current: Units done so far (pages, files, ...)
+        total: Total units, if known
+        message: Short human-readable status, e.g. "OCR page 3/40"
+    """
+    callback = _callback.get()
+    if callback is None:
+        return
+
+    if total:
+        percent = max(0, min(100, int(current * 100 / total)))
+    else:
+        percent = None
+
+    try:
+        callback(percent, message)
+    except Exception as e:
+        # A broken listener must never fail the action itself
+        logger.debug(f"Progress callback failed: {e}")
+
+
+def each(items, label="Processing"):
+    """Iterate over items, reporting "<label> <n>/<total>" before each one."""
+    total = len(items)
+    for index, item in enumerate(items):
+        report(index, total, f"{label} {index + 1}/{total}")
+        yield item
+
+
+@contextmanager
+def reporting_to(callback):
+    """Route report() calls made inside this block to callback(percent, message)."""
+    token = _callback.set(callback)
+    try:
+        yield
+    finally:
+        _callback.reset(token)
@@ -0,0 +1,346 @@
+"""
+Content-addressed result cache for tool actions.
+
+Results are keyed by the SHA-256 of every input file referenced in the payload,
+the module/action name and the remaining (normalized) payload parameters, with
+output locations stripped. A hit copies the stored artifacts next to the new
+inputs, exactly where the action itself would have written them, and returns
+the stored result with paths rewritten - PyMuPDF/pikepdf/Pillow never run.
+
+Entries live on disk under RESULT_CACHE_DIR, shared by all worker processes,
+and are evicted least-recently-used once the store grows beyond
+RESULT_CACHE_MAX_BYTES. The size bound and the hit/miss counters are kept on
+disk too (disk_lru.py), so they cover every process.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+try:
+    from modules import disk_lru, metrics, tracing
+except ImportError:
+    import disk_lru
+    import metrics
+    import tracing
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "offline_tools_cache"))
+CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Payload keys that only say where to write output - they never change the result
+OUTPUT_KEYS = {"output", "output_path", "output_dir", "output_file"}
+
+# Actions whose output must not be reused: signatures embed the signing time,
+# protect/unlock would keep decrypted or password-bound copies around, and
+# html_to_pdf may fetch remote resources that change independently of the input
+UNCACHEABLE_ACTIONS = {
+    "pdf_tools": {"sign", "protect", "unlock", "html_to_pdf"},
+    "image_tools": set(),
+}
+
+_HASH_CHUNK = 1024 * 1024
+_RESULT_FILE = "result.json"
+
+_COUNTERS = ("hits", "misses", "stores", "evictions", "skipped")
+
+_digest_memo = {}  # (path, size, mtime_ns) -> sha256 hex
+
+
+def cached_call(namespace, action, payload, func):
+    """
+    Run func(action, payload) through the cache.
+
+    Args:
+        namespace: Module name, e.g. "pdf_tools"
+        action: Action name
+        payload: Action payload (file paths must be absolute)
+        func: Dispatcher to call on a miss
+
+    Returns:
+        The action result (fresh or restored from the cache)
+    """
+    if not CACHE_ENABLED or action in UNCACHEABLE_ACTIONS.get(namespace, ()):
+        return func(action, payload)
+
+    with tracing.span("cache"):
+        try:
+            inputs = []
+            key = _make_key(namespace, action, payload, inputs)
+        except Exception as e:
+            logger.warning(f"Result cache key failed for {namespace}.{action}: {e}")
+            key = None
+
+        cached = None
+        if key is not None:
+            try:
+                cached = _lookup(key, inputs)
+            except Exception as e:
+                logger.warning(f"Result cache lookup failed for {namespace}.{action}: {e}")
+
+    if key is None:
+        return func(action, payload)
+
+    if cached is not None:
+        _lru.count("hits")
+        metrics.count("cache_hit")
+        logger.info(f"Result cache hit for {namespace}.{action} ({key[:12]})")
+        return cached
+
+    _lru.count("misses")
+    metrics.count("cache_miss")
+
+    result = func(action, payload)
+
+    try:
+        with tracing.span("cache"):
+            _store(key, result, inputs)
+    except Exception as e:
+        logger.warning(f"Result cache store failed for {namespace}.{action}: {e}")
+
+    return result
+
+
+def file_digest(path):
+    """SHA-256 of a file, memoized by path, size and mtime."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _digest_memo.get(memo_key)
+    if digest:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _remember(memo_key, digest)
+    return digest
+
+
+def remember_digest(path, digest):
+    """Record a digest computed elsewhere (e.g. while an upload was written) so file_digest() skips the read."""
+    st = os.stat(path)
+    _remember((os.path.abspath(path), st.st_size, st.st_mtime_ns), digest)
+
+
+def stats():
+    """Hit/miss counters and store size, over all processes sharing CACHE_DIR."""
+    shared = _lru.stats()
+    counters = {name: shared.get(name, 0) for name in _COUNTERS}
+    requests = counters["hits"] + counters["misses"]
+    return {
+        **counters,
+        "hit_rate": round(counters["hits"] / requests, 4) if requests else 0.0,
+        "entries": shared["entries"],
+        "bytes": shared["bytes"],
+        "max_bytes": CACHE_MAX_BYTES,
+        "enabled": CACHE_ENABLED,
+    }
+
+
+def clear():
+    """Remove every cache entry."""
+    _lru.clear()
+
+
+# Helper functions
+
+def _remember(memo_key, digest):
+    # Bounded memo - uploads are short-lived so old entries are worthless
+    if len(_digest_memo) > 4096:
+        _digest_memo.clear()
+    _digest_memo[memo_key] = digest
+
+
+def _is_input_file(value):
+    return isinstance(value, str) and os.path.isabs(value) and os.path.isfile(value)
+
+
+def _normalize(value, inputs):
+    """Replace input file paths with content digests and drop empty values and output keys."""
+    if isinstance(value, dict):
+        normalized = {}
+        for k, v in value.items():
+            if k in OUTPUT_KEYS or v is None:
+                continue
+            # Dict keys can be file paths too (e.g. per-file crop boxes)
+            key = f"@{file_digest(k)}" if _is_input_file(k) else str(k)
+            normalized[key] = _normalize(v, inputs)
+        return normalized
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v, inputs) for v in value]
+    if _is_input_file(value):
+        if value not in inputs:
+            inputs.append(value)
+        return f"@{file_digest(value)}"
+    return value
+
+
+def _make_key(namespace, action, payload, inputs):
+    params = _normalize(payload, inputs)
+    raw = json.dumps([namespace, action, params], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _entry_dir(key):
+    return os.path.join(CACHE_DIR, key[:2], key)
+
+
+def _collect_strings(value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _collect_strings(k, out)
+            _collect_strings(v, out)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _collect_strings(v, out)
+    elif isinstance(value, str):
+        out.add(value)
+
+
+def _rewrite(value, mapping):
+    """Recursively replace exact string matches (including dict keys)."""
+    if isinstance(value, dict):
+        return {_rewrite(k, mapping): _rewrite(v, mapping) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rewrite(v, mapping) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_rewrite(v, mapping) for v in value)
+    if isinstance(value, str):
+        return mapping.get(value, value)
+    return value
+
+
+def _relative_to_input(path, inputs):
+    """Express an output path relative to the input it was derived from, e.g. (0, "_compressed.pdf")."""
+    candidates = sorted(enumerate(inputs), key=lambda item: -len(item[1]))
+    for idx, input_path in candidates:
+        base = os.path.splitext(input_path)[0]
+        if path.startswith(base):
+            return idx, path[len(base):]
+    return None, os.path.basename(path)
+
+
+def _store(key, result, inputs):
+    if not isinstance(result, dict) or result.get("errors") or not inputs:
+        _lru.count("skipped")
+        return
+
+    strings = set()
+    _collect_strings(result, strings)
+    artifacts = sorted(s for s in strings if _is_input_file(s) and s not in inputs)
+
+    size = sum(os.path.getsize(a) for a in artifacts)
+    if size > CACHE_MAX_BYTES // 4:
+        _lru.count("skipped")
+        return
+
+    entry_dir = _entry_dir(key)
+    if os.path.exists(entry_dir):
+        return
+
+    staging = os.path.join(CACHE_DIR, f".staging-{uuid.uuid4().hex}")
+    os.makedirs(staging)
+    try:
+        mapping = {}
+        artifact_meta = []
+        for n, artifact in enumerate(artifacts):
+            shutil.copyfile(artifact, os.path.join(staging, f"a{n}"))
+            input_idx, suffix = _relative_to_input(artifact, inputs)
+            artifact_meta.append({"input": input_idx, "suffix": suffix})
+            mapping[artifact] = f"\x00artifact:{n}"
+        for n, input_path in enumerate(inputs):
+            mapping[input_path] = f"\x00input:{n}"
+
+        meta = {
+            "result": _rewrite(result, mapping),
+            "artifacts": artifact_meta,
+            "size": size,
+            "created_at": time.time(),
+        }
+        with open(os.path.join(staging, _RESULT_FILE), "w") as f:
+            json.dump(meta, f)
+
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        try:
+            os.rename(staging, entry_dir)
+        except OSError:
+            # Another worker stored the same key first
+            return
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    _lru.count("stores")
+    _lru.added(_entry_size(entry_dir))
+
+
+def _lookup(key, inputs):
+    entry_dir = _entry_dir(key)
+    meta_path = os.path.join(entry_dir, _RESULT_FILE)
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    mapping = {}
+    for n, input_path in enumerate(inputs):
+        mapping[f"\x00input:{n}"] = input_path
+
+    fallback_dir = os.path.dirname(inputs[0]) if inputs else tempfile.gettempdir()
+    for n, art in enumerate(meta["artifacts"]):
+        if art["input"] is not None and art["input"] < len(inputs):
+            target = os.path.splitext(inputs[art["input"]])[0] + art["suffix"]
+        else:
+            target = os.path.join(fallback_dir, art["suffix"])
+
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        shutil.copyfile(os.path.join(entry_dir, f"a{n}"), target)
+        mapping[f"\x00artifact:{n}"] = target
+
+    # Mark as recently used (eviction removes the oldest mtimes first)
+    os.utime(meta_path)
+    return _rewrite(meta["result"], mapping)
+
+
+def _scan_entries():
+    """(mtime of result.json, key, bytes on disk) for every stored entry."""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for shard in os.listdir(CACHE_DIR):
+        shard_dir = os.path.join(CACHE_DIR, shard)
+        if shard.startswith(".") or not os.path.isdir(shard_dir):
+            continue
+        for key in os.listdir(shard_dir):
+            entry_dir = os.path.join(shard_dir, key)
+            try:
+                mtime = os.path.getmtime(os.path.join(entry_dir, _RESULT_FILE))
+            except OSError:
+                continue
+            yield mtime, key, _entry_size(entry_dir)
+
+
+def _entry_size(entry_dir):
+    total = 0
+    for name in os.listdir(entry_dir):
+        try:
+            total += os.path.getsize(os.path.join(entry_dir, name))
+        except OSError:
+            pass
+    return total
+
+
+def _remove_entry(key):
+    shutil.rmtree(_entry_dir(key), ignore_errors=True)
+
+
+# Size bound and counters shared by every process using CACHE_DIR
+_lru = disk_lru.DiskLRU(CACHE_DIR, CACHE_MAX_BYTES, _scan_entries, _remove_entry)
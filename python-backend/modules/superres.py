@@ -0,0 +1,244 @@
+"""
+Tiled, memory-bounded super-resolution with OpenCV dnn_superres.
+
+upscale_images used to pass the whole photo to a single upsample() call.
+EDSR x4 on a 3000x2000 image needs gigabytes of activations and runs for
+minutes on one core. SuperResModel.upscale() does the following instead:
+
+- Cuts the image into tiles that overlap by UPSCALE_TILE_OVERLAP pixels.
+- Upscales up to UPSCALE_THREADS tiles at once, each on its own network
+  instance. OpenCV releases the GIL, so the threads use separate cores.
+- Cross-fades the overlapping borders with linear weights that sum to one,
+  so no seams show.
+- Assembles the output one row of tiles at a time, keeping a single
+  float band of the output in memory besides the result.
+
+The tile size is the largest one whose estimated activations for all tiles
+in flight, plus the band, stay under UPSCALE_MEMORY_MB. A payload can ask
+for smaller tiles. Network instances belong to the model and are shared by
+all requests (see model_registry), so the ceiling holds for the whole
+process.
+
+Models:
+    edsr    Best quality, slow. Downloaded on first use (x2, x4).
+    espcn   Small and fast, for interactive use (x2, x3, x4).
+    fsrcnn  Small and fast, a little sharper than espcn (x2, x3, x4).
+
+All model files live in UPSCALE_MODEL_DIR, named as in the OpenCV model
+zoo (EDSR_x4.pb, ESPCN_x2.pb, FSRCNN_x3.pb, ...). espcn and fsrcnn are
+never downloaded; put their files there.
+"""
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+try:
+    from modules.lazy_imports import lazy_module
+except ImportError:
+    from lazy_imports import lazy_module
+
+np = lazy_module("numpy")
+
+logger = logging.getLogger(__name__)
+
+UPSCALE_MODEL_DIR = os.getenv("UPSCALE_MODEL_DIR", str(Path.home() / ".cache" / "offline-tools" / "upscale"))
+# Tiles upscaled in parallel (each on its own network instance)
+UPSCALE_THREADS = max(1, int(os.getenv("UPSCALE_THREADS", str(min(4, os.cpu_count() or 1)))))
+# Ceiling for activations of the tiles in flight plus the blending band, in MB
+UPSCALE_MEMORY_MB = int(os.getenv("UPSCALE_MEMORY_MB", "1024"))
+# Input pixels shared by neighbouring tiles and cross-faded in the output
+UPSCALE_TILE_OVERLAP = int(os.getenv("UPSCALE_TILE_OVERLAP", "16"))
+
+# Tile sides tried from largest to smallest when planning
+TILE_SIZES = (512, 384, 256, 192, 128, 96, 64)
+
+# algorithm -> file name pattern, scales, feature channels and feature maps alive at once.
+# The last two only feed the activation estimate below; bench_upscale.py measures
+# the real peak memory per model and tile size.
+MODELS = {
+    "edsr": {"file": "EDSR_x{scale}.pb", "scales": (2, 4), "channels": 64, "live_maps": 3},
+    "espcn": {"file": "ESPCN_x{scale}.pb", "scales": (2, 3, 4), "channels": 64, "live_maps": 2},
+    "fsrcnn": {"file": "FSRCNN_x{scale}.pb", "scales": (2, 3, 4), "channels": 56, "live_maps": 2},
+}
+
+
+def model_path(algorithm: str, scale: int) -> str:
+    """Path of a model file in UPSCALE_MODEL_DIR (it may not exist yet)."""
+    return os.path.join(UPSCALE_MODEL_DIR, MODELS[algorithm]["file"].format(scale=scale))
+
+
+def plan_tiles(algorithm: str, scale: int, width: int, channels: int = 3,
+               requested: Optional[int] = None) -> Tuple[int, int]:
+    """
+    (tile side, parallel tiles) for an image width that keeps the estimated
+    memory under UPSCALE_MEMORY_MB. requested caps the tile side.
+    """
+    ceiling = UPSCALE_MEMORY_MB * 1024 * 1024
+    sizes = [t for t in TILE_SIZES if not requested or t <= int(requested)] or [TILE_SIZES[-1]]
+    for threads in range(UPSCALE_THREADS, 0, -1):
+        for tile in sizes:
+            if threads * _tile_bytes(algorithm, scale, tile) + _band_bytes(scale, tile, width, channels) <= ceiling:
+                return tile, threads
+    logger.warning(f"UPSCALE_MEMORY_MB={UPSCALE_MEMORY_MB} is too low for {algorithm} x{scale}; using {sizes[-1]}px tiles")
+    return sizes[-1], 1
+
+
+class SuperResModel:
+    """
+    A dnn_superres model with a pool of up to UPSCALE_THREADS network
+    instances. Instances are not thread-safe; each is used by one tile at a
+    time and created the first time all others are busy.
+    """
+
+    def __init__(self, algorithm: str, scale: int, path: str):
+        self.algorithm = algorithm
+        self.scale = scale
+        self.path = path
+        self._free: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 1
+        self._free.put(self._load())
+
+    def _load(self):
+        from cv2 import dnn_superres
+        sr = dnn_superres.DnnSuperResImpl_create()
+        sr.readModel(self.path)
+        sr.setModel(self.algorithm, self.scale)
+        return sr
+
+    @contextmanager
+    def instance(self):
+        try:
+            sr = self._free.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < UPSCALE_THREADS
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    sr = self._load()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                sr = self._free.get()
+        try:
+            yield sr
+        finally:
+            self._free.put(sr)
+
+    def upscale(self, img, tile_size: Optional[int] = None,
+                on_progress: Optional[Callable[[int, int], None]] = None):
+        """
+        Upscale a BGR (or grayscale) uint8 array tile by tile.
+
+        Args:
+            img: Array from cv2.imread
+            tile_size: Optional cap on the tile side in input pixels
+            on_progress: Optional callback(tiles done, total tiles)
+        """
+        height, width = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        s = self.scale
+        tile, threads = plan_tiles(self.algorithm, s, width, channels, tile_size)
+        overlap = min(UPSCALE_TILE_OVERLAP, tile // 4)
+
+        if height <= tile and width <= tile:
+            with self.instance() as sr:
+                result = sr.upsample(img)
+            if on_progress:
+                on_progress(1, 1)
+            return result
+
+        rows = _tile_starts(height, tile, overlap)
+        cols = _tile_starts(width, tile, overlap)
+        total = len(rows) * len(cols)
+        logger.info(f"Upscaling {width}x{height} with {self.algorithm} x{s}: {total} tiles of {tile}px, {threads} in parallel")
+
+        out = np.empty((height * s, width * s) + img.shape[2:], dtype=img.dtype)
+        carry = None  # output rows shared with the next row of tiles, already weighted
+        done = 0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="upscale") as executor:
+            for r, y in enumerate(rows):
+                y0, y1 = _padded(rows, r, height, overlap)
+                band = np.zeros(((y1 - y0) * s, width * s) + img.shape[2:], dtype=np.float32)
+                if carry is not None:
+                    band[:len(carry)] += carry
+                weight_y = _ramp(rows, r, y0, y1, overlap, s)
+
+                spans = [_padded(cols, c, width, overlap) for c in range(len(cols))]
+                futures = [executor.submit(self._upscale_tile, img, y0, y1, x0, x1) for x0, x1 in spans]
+                for c, ((x0, x1), future) in enumerate(zip(spans, futures)):
+                    weights = np.outer(weight_y, _ramp(cols, c, x0, x1, overlap, s))
+                    if img.ndim == 3:
+                        weights = weights[..., None]
+                    band[:, x0 * s:x1 * s] += future.result() * weights
+                    done += 1
+                    if on_progress:
+                        on_progress(done, total)
+
+                # Everything above the next row's padded start is final
+                final_end = rows[r + 1] - overlap if r + 1 < len(rows) else y1
+                final_rows = (final_end - y0) * s
+                out[y0 * s:final_end * s] = np.clip(band[:final_rows] + 0.5, 0, 255).astype(img.dtype)
+                carry = band[final_rows:]
+        return out
+
+    def _upscale_tile(self, img, y0: int, y1: int, x0: int, x1: int):
+        with self.instance() as sr:
+            return sr.upsample(np.ascontiguousarray(img[y0:y1, x0:x1]))
+
+
+# Helper functions
+
+def _tile_bytes(algorithm: str, scale: int, tile: int) -> int:
+    """Rough peak activation bytes of one tile: float32 feature maps at input size plus the upsampler."""
+    spec = MODELS[algorithm]
+    side = tile + 2 * min(UPSCALE_TILE_OVERLAP, tile // 4)
+    return side * side * spec["channels"] * 4 * (spec["live_maps"] + scale * scale)
+
+
+def _band_bytes(scale: int, tile: int, width: int, channels: int) -> int:
+    side = tile + 2 * min(UPSCALE_TILE_OVERLAP, tile // 4)
+    return side * scale * width * scale * channels * 4
+
+
+def _tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """Start of each tile's core; a last core shorter than 2*overlap joins the previous one."""
+    starts = list(range(0, length, tile))
+    if len(starts) > 1 and length - starts[-1] < 2 * overlap:
+        starts.pop()
+    return starts
+
+
+def _padded(starts: List[int], index: int, length: int, overlap: int) -> Tuple[int, int]:
+    """Input range of a tile: its core plus overlap on the sides that have a neighbour."""
+    begin = starts[index] - overlap if index > 0 else 0
+    end = starts[index + 1] + overlap if index + 1 < len(starts) else length
+    return begin, end
+
+
+def _ramp(starts: List[int], index: int, begin: int, end: int, overlap: int, scale: int):
+    """
+    Output-space weights along one axis of a tile. They rise over the 2*overlap
+    shared with the previous tile and fall over the one shared with the next;
+    the two neighbours' weights sum to one there.
+    """
+    weights = np.ones((end - begin) * scale, dtype=np.float32)
+    width = 2 * overlap * scale
+    if width == 0:
+        return weights
+    fade = (np.arange(width, dtype=np.float32) + 0.5) / width
+    if index > 0:
+        weights[:width] *= fade
+    if index + 1 < len(starts):
+        weights[-width:] *= fade[::-1]
+    return weights
@@ -0,0 +1,293 @@
+"""
+Per-request phase tracing and on-demand profiling.
+
+TracingMiddleware starts a Trace for every HTTP request in api.py. Code on the
+request path wraps its phases in span("upload"), span("validate"),
+span("action"), ... and the time is added to that trace. Spans with the same
+name are summed. When the response starts, the phases so far are sent as a
+Server-Timing header. When the body has been sent, the whole trace, including
+zip creation and send time, is logged as one JSON line on the "tracing"
+logger. Outside a trace, span() does nothing.
+
+Actions that run in a worker process trace into a local trace, and
+worker_pool merges those spans back (see worker_pool._run_in_worker).
+
+profiled() runs a block under cProfile or under a stack-sampling profiler and
+writes the result to a directory. api.py uses it for jobs an admin asked to
+profile.
+"""
+
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("tracing")
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# Seconds between stack samples of the "sample" profiler
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+PROFILE_MODES = ("cprofile", "sample")
+
+
+class Trace:
+    """Phase durations of one request or job."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}  # name -> [total ms, count], in first-seen order
+
+    def add(self, name: str, ms: float, count: int = 1) -> None:
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [ms, count]
+        else:
+            entry[0] += ms
+            entry[1] += count
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. 'upload;dur=12.5, action;dur=830.1, total;dur=851.0'."""
+        parts = [f"{name};dur={ms:.1f}" for name, (ms, _) in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+    def export(self) -> Dict[str, List[float]]:
+        return {name: list(entry) for name, entry in self.spans.items()}
+
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Add the time spent in the block to the current trace under name."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, (time.perf_counter() - start) * 1000)
+
+
+def mark(name: str) -> None:
+    """Record the time from the start of the trace until now (e.g. request body received)."""
+    trace = _current.get()
+    if trace is not None and name not in trace.spans:
+        trace.add(name, trace.elapsed_ms())
+
+
+def timed_iter(iterable: Iterable[bytes], name: str) -> Iterator[bytes]:
+    """
+    Wrap iterable so that only the time spent producing items (not waiting on
+    the consumer) is added to the current trace. The trace is captured now, as
+    the items may be pulled from another thread.
+    """
+    trace = _current.get()
+    if trace is None:
+        return iter(iterable)
+    return _timed(iter(iterable), name, trace)
+
+
+@contextmanager
+def traced(name: str, **fields: Any) -> Iterator[Trace]:
+    """Run a block under a new trace and log it when done (used for jobs)."""
+    trace = Trace(name)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        log_trace(trace, **fields)
+
+
+@contextmanager
+def collecting() -> Iterator[Trace]:
+    """Worker side: collect spans into a local trace without logging it."""
+    trace = Trace("worker")
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def merge(spans: Optional[Dict[str, List[float]]]) -> None:
+    """Add spans exported by a worker process to the current trace."""
+    trace = _current.get()
+    if trace is None or not spans:
+        return
+    for name, (ms, count) in spans.items():
+        trace.add(name, ms, count)
+
+
+def log_trace(trace: Trace, **fields: Any) -> None:
+    if not TRACING_ENABLED:
+        return
+    record = {
+        "trace": trace.name,
+        "total_ms": round(trace.elapsed_ms(), 1),
+        "spans": {name: round(ms, 1) for name, (ms, _) in trace.spans.items()},
+        **fields,
+    }
+    trace_logger.info(json.dumps(record, default=str))
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware: one Trace per HTTP request, Server-Timing on the response
+    and a JSON log line once the body is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f"{scope['method']} {scope['path']}")
+        token = _current.set(trace)
+        state: Dict[str, Any] = {"status": None, "response_started": None}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["response_started"] = time.perf_counter()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                if state["response_started"] is not None:
+                    trace.add("send", (time.perf_counter() - state["response_started"]) * 1000)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _current.reset(token)
+            log_trace(trace, status=state["status"])
+
+
+@contextmanager
+def profiled(mode: str, output_dir: str) -> Iterator[None]:
+    """
+    Profile the block and write the result to output_dir.
+
+    Args:
+        mode: "cprofile" (deterministic; profile.pstats + profile.txt) or
+              "sample" (stack sampling every PROFILE_SAMPLE_INTERVAL seconds;
+              profile.folded for flame graphs + profile.txt)
+        output_dir: Existing directory, e.g. the job directory
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _write_cprofile(profiler, output_dir)
+    elif mode == "sample":
+        sampler = _StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            _write_samples(sampler.samples, output_dir)
+    else:
+        raise ValueError(f"Unknown profile mode: {mode}")
+
+
+def profile_files(output_dir: str) -> List[str]:
+    """Profile files written by profiled() into output_dir."""
+    names = ("profile.txt", "profile.pstats", "profile.folded")
+    return [os.path.join(output_dir, n) for n in names if os.path.exists(os.path.join(output_dir, n))]
+
+
+# Helper functions
+
+def _timed(iterator: Iterator[bytes], name: str, trace: Trace) -> Iterator[bytes]:
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            trace.add(name, (time.perf_counter() - start) * 1000, count=0)
+            return
+        trace.add(name, (time.perf_counter() - start) * 1000, count=0)
+        yield item
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or self._stopped.is_set():
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _write_cprofile(profiler: cProfile.Profile, output_dir: str) -> None:
+    profiler.dump_stats(os.path.join(output_dir, "profile.pstats"))
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(60)
+    with open(os.path.join(output_dir, "profile.txt"), "w", encoding="utf-8") as f:
+        f.write(text.getvalue())
+
+
+def _write_samples(samples: Counter, output_dir: str) -> None:
+    with open(os.path.join(output_dir, "profile.folded"), "w", encoding="utf-8") as f:
+        for stack, n in samples.most_common():
+            f.write(f"{stack} {n}\n")
+
+    # Self time per frame: the innermost frame of each sample
+    total = sum(samples.values())
+    leaf = Counter()
+    for stack, n in samples.items():
+        leaf[stack.rsplit(";", 1)[-1]] += n
+    with open(os.path.join(output_dir, "profile.txt"), "w", encoding="utf-8") as f:
+        f.write(f"{total} samples every {PROFILE_SAMPLE_INTERVAL * 1000:.1f} ms\n\n")
+        for frame, n in leaf.most_common(60):
+            f.write(f"{n / total * 100 if total else 0:6.1f}%  {n:6d}  {frame}\n")
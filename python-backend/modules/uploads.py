@@ -0,0 +1,156 @@
+"""
+Shared upload path for api.py and server.py.
+
+An upload is copied to disk in bounded chunks. The same pass computes its
+SHA-256 (handed to the result cache, so cache lookups don't hash the file
+again) and sniffs the magic bytes of the first chunk. The size limit is
+enforced while copying: the copy stops and the partial file is removed as
+soon as the limit is crossed.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import BinaryIO, Optional
+
+try:
+    from modules import result_cache
+except ImportError:
+    import result_cache
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# (offset, signature, mime type); first match wins
+_SIGNATURES = (
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"\x00\x00\x01\x00", "image/x-icon"),
+    (0, b"PK\x03\x04", "application/zip"),  # also docx/xlsx/pptx
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),  # doc/xls/ppt
+    (0, b"<svg", "image/svg+xml"),
+)
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"}
+# Bytes of the file head sniff() needs
+SNIFF_BYTES = 64
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload crosses its size limit while being copied."""
+
+    def __init__(self, size_bytes: int, limit_bytes: int):
+        super().__init__(f"Upload exceeds {limit_bytes} bytes")
+        self.size_bytes = size_bytes
+        self.limit_bytes = limit_bytes
+
+
+class SavedUpload:
+    """An upload on disk with its size, content hash and sniffed type."""
+
+    def __init__(self, path: str, size: int, sha256: str, mime: Optional[str], filename: Optional[str]):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.mime = mime
+        self.filename = filename
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """Mime type from the first bytes of a file, or None if unrecognized."""
+    for offset, signature, mime in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in _HEIF_BRANDS:
+            return "image/heic"
+        if brand in (b"avif", b"avis"):
+            return "image/avif"
+    return None
+
+
+def sniff_stream(src: BinaryIO) -> Optional[str]:
+    """Mime type of a seekable file object from its first bytes, leaving the position unchanged."""
+    try:
+        position = src.tell()
+        head = src.read(SNIFF_BYTES)
+        src.seek(position)
+    except (OSError, ValueError, AttributeError):
+        return None
+    return sniff(head)
+
+
+def save_stream(src: BinaryIO, directory: str, name: Optional[str] = None, suffix: str = "",
+                max_bytes: Optional[int] = None, filename: Optional[str] = None) -> SavedUpload:
+    """
+    Copy a file object to disk in CHUNK_SIZE pieces.
+
+    Args:
+        src: Readable binary file object (e.g. UploadFile.file)
+        directory: Target directory
+        name: Exact file name to use; a unique temp name with suffix otherwise
+        suffix: Suffix for generated names, e.g. ".pdf"
+        max_bytes: Abort once more than this many bytes were read
+        filename: Original client file name, kept for reference
+
+    Returns:
+        SavedUpload
+
+    Raises:
+        UploadTooLargeError: max_bytes was exceeded; nothing is left on disk
+    """
+    if name:
+        path = os.path.join(directory, name)
+        dst = open(path, "wb")
+    else:
+        dst = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory)
+        path = dst.name
+
+    digest = hashlib.sha256()
+    size = 0
+    mime = None
+    try:
+        with dst:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    mime = sniff(chunk[:SNIFF_BYTES])
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLargeError(size, max_bytes)
+                digest.update(chunk)
+                dst.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        raise
+
+    sha256 = digest.hexdigest()
+    # Cache keys hash every input file; this one is already known
+    result_cache.remember_digest(path, sha256)
+    return SavedUpload(path, size, sha256, mime, filename)
+
+
+async def save(upload_file, directory: str, name: Optional[str] = None,
+               max_bytes: Optional[int] = None) -> SavedUpload:
+    """Save a Starlette/FastAPI UploadFile off the event loop (see save_stream)."""
+    suffix = os.path.splitext(upload_file.filename)[1] if upload_file.filename else ""
+    return await asyncio.to_thread(
+        save_stream, upload_file.file, directory,
+        name=name, suffix=suffix, max_bytes=max_bytes, filename=upload_file.filename,
+    )
@@ -0,0 +1,386 @@
+"""
+Process-pool execution engine for CPU-bound tool actions.
+
+Most PDF/image actions are pure-Python loops (pdfplumber, pandas, Pillow) that
+hold the GIL, so running them on the thread pool serializes heavy jobs on one
+core. Actions listed in a tool module's PROCESS_ACTIONS run in a pool of warm
+worker processes instead; every other action keeps running in a thread.
+
+Workers pre-import the tool modules at start-up and are recycled after
+WORKER_MAX_TASKS jobs to contain PyMuPDF memory growth.
+
+A worker that dies (a MuPDF segfault, the OOM killer) breaks the whole
+ProcessPoolExecutor, and every job in it gets BrokenProcessPool. Workers
+record which job they are running, so the pool is rebuilt, only the job
+whose worker died fails, and the other jobs are submitted again.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    from modules import progress, lazy_imports, metrics, tracing, model_registry, inference
+except ImportError:
+    import progress
+    import lazy_imports
+    import metrics
+    import tracing
+    import model_registry
+    import inference
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes (0 disables the pool and runs everything in threads).
+# Capped by default because every worker holds its own copy of the tool imports
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Jobs a worker runs before it is replaced by a fresh process
+WORKER_MAX_TASKS = int(os.getenv("WORKER_MAX_TASKS", "50"))
+
+TOOL_MODULES = ("pdf_tools", "image_tools")
+
+_pool = None
+_pool_lock = threading.Lock()
+_manager = None  # multiprocessing.Manager, for progress queues and the running-jobs registry
+_running = None  # Manager dict: job token -> pid of the worker running it
+_inflight = {"process": 0, "thread": 0}
+_inflight_lock = threading.Lock()
+
+
+def _import_tool_module(module_name):
+    if module_name == "pdf_tools":
+        try:
+            from modules import pdf_tools
+        except ImportError:
+            import pdf_tools
+        return pdf_tools
+    if module_name == "image_tools":
+        try:
+            from modules import image_tools
+        except ImportError:
+            import image_tools
+        return image_tools
+    raise ValueError(f"Unknown tool module: {module_name}")
+
+
+def _dispatch(module_name, action, payload):
+    module = _import_tool_module(module_name)
+    if module_name == "pdf_tools":
+        return module.handle_pdf_action(action, payload)
+    return module.handle_image_action(action, payload)
+
+
+def _dispatch_reporting(module_name, action, payload, progress_queue):
+    """Forward progress.report() calls to the parent through progress_queue."""
+    def forward(percent, message):
+        progress_queue.put((percent, message))
+
+    with progress.reporting_to(forward):
+        return _dispatch(module_name, action, payload)
+
+
+def _execute(module_name, action, payload, progress_queue=None, profile=None):
+    """Run the action, forwarding progress if a queue is given and under a profiler if requested."""
+    if profile is None:
+        if progress_queue is None:
+            return _dispatch(module_name, action, payload)
+        return _dispatch_reporting(module_name, action, payload, progress_queue)
+
+    mode, output_dir = profile
+    with tracing.profiled(mode, output_dir):
+        return _execute(module_name, action, payload, progress_queue)
+
+
+def _run_in_worker(module_name, action, payload, progress_queue=None, profile=None, running=None, token=None):
+    """
+    Worker-side entry point. Returns (result, telemetry): the parent serves
+    /metrics and owns the request trace, so metrics samples and spans recorded
+    here travel back with the result (or attached to the exception), together
+    with this worker's loaded models.
+
+    While the job runs, running[token] holds this worker's pid, so the parent
+    can tell which job a crashed worker was running.
+    """
+    if running is not None:
+        running[token] = os.getpid()
+    try:
+        with tracing.collecting() as trace:
+            try:
+                result = _execute(module_name, action, payload, progress_queue, profile)
+            except Exception as e:
+                e.telemetry = _telemetry(trace)
+                raise
+            return result, _telemetry(trace)
+    finally:
+        if running is not None:
+            running.pop(token, None)
+
+
+def _telemetry(trace):
+    return {"metrics": metrics.drain(), "spans": trace.export(), "models": model_registry.snapshot(),
+            "inference": inference.drain()}
+
+
+def _unpack(outcome):
+    result, telemetry = outcome
+    _merge_telemetry(telemetry)
+    return result
+
+
+def _merge_telemetry(telemetry):
+    if telemetry:
+        metrics.merge(telemetry.get("metrics"))
+        tracing.merge(telemetry.get("spans"))
+        model_registry.merge_snapshot(telemetry.get("models"))
+        inference.merge(telemetry.get("inference"))
+
+
+def _get_manager():
+    global _manager, _running
+    with _pool_lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context("spawn").Manager()
+            _running = _manager.dict()
+        return _manager
+
+
+def _progress_queue():
+    return _get_manager().Queue()
+
+
+def _init_worker():
+    """Runs once in every new worker: pay the heavy imports before the first job arrives."""
+    metrics.buffer_samples()
+    for module_name in TOOL_MODULES:
+        try:
+            _import_tool_module(module_name)
+        except Exception as e:
+            logger.error(f"Worker failed to pre-import {module_name}: {e}")
+    # Tool modules defer their heavy dependencies; workers load them up front
+    lazy_imports.prewarm()
+    # remove_bg/upscale run here, so the MODEL_PREWARM models are loaded per worker
+    model_registry.prewarm()
+
+
+def _warmup():
+    return os.getpid()
+
+
+def execution_mode(module_name, action):
+    """Returns "process" if the action declares itself CPU-bound and the pool is enabled, else "thread"."""
+    if WORKER_PROCESSES <= 0:
+        return "thread"
+    try:
+        module = _import_tool_module(module_name)
+    except ValueError:
+        return "thread"
+    return "process" if action in getattr(module, "PROCESS_ACTIONS", ()) else "thread"
+
+
+def start():
+    """Create the pool and spawn every worker up front so the first requests find them warm."""
+    global _pool
+    if WORKER_PROCESSES <= 0:
+        logger.info("Worker pool disabled (WORKER_PROCESSES=0), all actions run in threads")
+        return
+
+    with _pool_lock:
+        if _pool is not None:
+            return
+        _pool = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES,
+            # Recycling requires spawn; it also avoids forking a process with live threads
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            max_tasks_per_child=WORKER_MAX_TASKS,
+        )
+        pool = _pool
+
+    _get_manager()
+    for _ in range(WORKER_PROCESSES):
+        pool.submit(_warmup)
+    logger.info(f"Worker pool started: {WORKER_PROCESSES} processes, recycled every {WORKER_MAX_TASKS} jobs")
+
+
+def shutdown():
+    global _pool, _manager, _running
+    with _pool_lock:
+        pool, _pool = _pool, None
+        manager, _manager, _running = _manager, None, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if manager is not None:
+        manager.shutdown()
+
+
+def _restart_after_crash(broken_pool):
+    """Replace a pool whose worker died (e.g. a MuPDF segfault) so later jobs still run."""
+    global _pool
+    with _pool_lock:
+        if not hasattr(broken_pool, "crashed_pids"):
+            broken_pool.crashed_pids = _crashed_pids(broken_pool)
+        if _pool is not broken_pool:
+            return
+        _pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+    start()
+
+
+def stats():
+    """Pool size, in-flight jobs per execution mode and worker utilization."""
+    with _inflight_lock:
+        inflight = dict(_inflight)
+    processes = WORKER_PROCESSES if _pool is not None else 0
+    busy = min(inflight["process"], processes)
+    return {
+        "processes": processes,
+        "max_tasks_per_worker": WORKER_MAX_TASKS,
+        "inflight_process": inflight["process"],
+        "inflight_thread": inflight["thread"],
+        # Jobs submitted to the pool beyond its size wait in its queue
+        "queued_process": inflight["process"] - busy,
+        "utilization": round(busy / processes, 4) if processes else 0.0,
+    }
+
+
+def worker_pids():
+    """PIDs of the live worker processes (empty when the pool is disabled)."""
+    pool = _pool
+    if pool is None:
+        return []
+    return list(getattr(pool, "_processes", None) or {})
+
+
+def _begin(module_name, action):
+    """Resolve where the action runs and count it as in flight. Returns (mode, pool)."""
+    mode = execution_mode(module_name, action)
+    pool = _pool if mode == "process" else None
+    if pool is None:
+        mode = "thread"
+
+    with _inflight_lock:
+        _inflight[mode] += 1
+    return mode, pool
+
+
+def _end(mode):
+    with _inflight_lock:
+        _inflight[mode] -= 1
+
+
+def _crashed_pids(broken_pool):
+    """
+    Workers that died on their own. The executor fails the futures first and
+    then terminates the remaining workers, so those are still alive or exited
+    with SIGTERM.
+    """
+    try:
+        processes = list((getattr(broken_pool, "_processes", None) or {}).items())
+    except RuntimeError:
+        return set()
+    # The executor's thread reaps the workers; wait until every exit code is known
+    deadline = time.monotonic() + 5
+    while any(process.exitcode is None for _, process in processes) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return {pid for pid, process in processes if process.exitcode not in (None, 0, -signal.SIGTERM)}
+
+
+def _submit(pool, module_name, action, payload, progress_queue=None, profile=None):
+    """Submit a job to the pool. Returns (future, token)."""
+    token = uuid.uuid4().hex
+    return pool.submit(_run_in_worker, module_name, action, payload, progress_queue, profile, _running, token), token
+
+
+def _crashed(pool, token, module_name, action, retry):
+    """
+    Handle BrokenProcessPool for one job: restart the pool, then return the
+    pool to run the job on again, or raise if it was this job's worker that
+    died (or the job was already retried).
+    """
+    pid = _running.pop(token, None) if _running is not None else None
+    _restart_after_crash(pool)
+    if pid is not None and pid in pool.crashed_pids:
+        logger.error(f"Worker process {pid} died while running {module_name}.{action}, pool restarted")
+        raise RuntimeError(f"Worker process crashed while running {action}")
+    new_pool = _pool
+    if not retry or new_pool is None:
+        logger.error(f"Worker pool broke while running {module_name}.{action}, giving up")
+        raise RuntimeError(f"Worker process crashed while running {action}")
+    logger.warning(f"Another worker process died; resubmitting {module_name}.{action} to the restarted pool")
+    return new_pool
+
+
+def run_action_blocking(module_name, action, payload, on_progress=None, profile=None):
+    """
+    Synchronous variant of run_action for callers that own a thread (the job runner).
+
+    on_progress(percent, message) receives progress.report() calls from the
+    action, including ones made inside a worker process. profile is an optional
+    (mode, output_dir) pair; see tracing.profiled().
+    """
+    mode, pool = _begin(module_name, action)
+    try:
+        if mode == "thread":
+            if on_progress is None:
+                return _execute(module_name, action, payload, profile=profile)
+            with progress.reporting_to(on_progress):
+                return _execute(module_name, action, payload, profile=profile)
+
+        progress_queue = _progress_queue() if on_progress is not None else None
+        for retry in (True, False):
+            token = None
+            try:
+                with tracing.span("dispatch"):
+                    future, token = _submit(pool, module_name, action, payload, progress_queue, profile)
+                    while progress_queue is not None:
+                        try:
+                            percent, message = progress_queue.get(timeout=0.2)
+                            on_progress(percent, message)
+                        except queue.Empty:
+                            if future.done():
+                                break
+                    return _unpack(future.result())
+            except BrokenProcessPool:
+                pool = _crashed(pool, token, module_name, action, retry)
+            except Exception as e:
+                _merge_telemetry(getattr(e, "telemetry", None))
+                raise
+    finally:
+        _end(mode)
+
+
+async def run_action(module_name, action, payload):
+    """
+    Run a tool action in a worker process or a thread, as the action declares.
+
+    Raises whatever the action raises. If the action's own worker crashes, it
+    surfaces as RuntimeError; a job hit by another worker's crash is rerun.
+    """
+    mode, pool = _begin(module_name, action)
+    try:
+        if mode == "thread":
+            return await run_in_threadpool(_dispatch, module_name, action, payload)
+
+        for retry in (True, False):
+            token = None
+            try:
+                with tracing.span("dispatch"):
+                    future, token = _submit(pool, module_name, action, payload)
+                    return _unpack(await asyncio.wrap_future(future))
+            except BrokenProcessPool:
+                pool = _crashed(pool, token, module_name, action, retry)
+            except Exception as e:
+                _merge_telemetry(getattr(e, "telemetry", None))
+                raise
+    finally:
+        _end(mode)
@@ -0,0 +1,258 @@
+"""
+Temp-space lifecycle for the web API.
+
+Every request gets its own workspace directory under WORKSPACE_DIR for its
+uploads and the outputs the tools write next to them. Nothing is deleted
+while the request runs; once it finishes the workspace is released and kept
+for WORKSPACE_TTL seconds so the response (or a later download) can still
+read it, then a background janitor removes it.
+
+WORKSPACE_DIR is a tmpfs in production, so disk usage is RAM usage. Usage of
+the whole directory is tracked against WORKSPACE_QUOTA_BYTES, minus any
+directory another module manages itself (see exclude_from_quota()). A new request
+reserves room for its upload and outputs; if the quota is exhausted it waits
+(back-pressure) until the janitor or an eviction frees space, and is rejected
+with WorkspaceFullError after WORKSPACE_ADMIT_TIMEOUT seconds.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_DIR = os.getenv("WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "offline_tools_api"))
+# Total bytes allowed under WORKSPACE_DIR (uploads, outputs, editor sessions)
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+# How long a released workspace is kept for downloads (seconds)
+WORKSPACE_TTL_SECONDS = int(os.getenv("WORKSPACE_TTL", "900"))
+# How long a request waits for space before it is rejected (seconds)
+WORKSPACE_ADMIT_TIMEOUT = float(os.getenv("WORKSPACE_ADMIT_TIMEOUT", "30"))
+# Under quota pressure, released workspaces older than this may be removed before their TTL (seconds)
+WORKSPACE_MIN_RETENTION_SECONDS = int(os.getenv("WORKSPACE_MIN_RETENTION", "120"))
+# Bytes reserved per upload byte: the upload itself plus roughly as much output
+RESERVE_FACTOR = 2
+# How often the janitor runs (seconds)
+JANITOR_INTERVAL_SECONDS = 30
+
+_WORK_SUBDIR = "work"
+
+
+class WorkspaceFullError(Exception):
+    """Raised when no temp space becomes available within WORKSPACE_ADMIT_TIMEOUT."""
+
+
+class Workspace:
+    """A per-request directory plus the bookkeeping needed to expire it."""
+
+    def __init__(self, workspace_id: str, path: str, reserved_bytes: int):
+        self.id = workspace_id
+        self.path = path
+        self.reserved_bytes = reserved_bytes
+        self.size_bytes = 0
+        self.created_at = time.time()
+        self.released_at: Optional[float] = None
+
+
+_workspaces: "OrderedDict[str, Workspace]" = OrderedDict()  # released ones in release order
+_lock = threading.Lock()
+_scanned_bytes = 0  # usage of WORKSPACE_DIR at the last scan, adjusted on release/removal
+_cleanup_hooks: List[Callable[[], None]] = []
+_excluded_dirs: List[str] = []  # directories under WORKSPACE_DIR not counted against the quota
+_janitor_started = False
+_stats = {"admitted": 0, "rejected": 0, "waited": 0, "expired": 0, "evicted": 0}
+
+
+def start() -> None:
+    """Measure current usage and start the background janitor."""
+    global _janitor_started, _scanned_bytes
+    os.makedirs(os.path.join(WORKSPACE_DIR, _WORK_SUBDIR), exist_ok=True)
+    with _lock:
+        if _janitor_started:
+            return
+        _janitor_started = True
+        _scanned_bytes = _dir_size(WORKSPACE_DIR, skip=_excluded_dirs)
+
+    def _janitor_loop():
+        while True:
+            time.sleep(JANITOR_INTERVAL_SECONDS)
+            try:
+                sweep()
+            except Exception as e:
+                logger.error(f"Workspace janitor failed: {e}")
+
+    threading.Thread(target=_janitor_loop, name="workspace-janitor", daemon=True).start()
+    logger.info(f"Workspace janitor started: quota {WORKSPACE_QUOTA_BYTES} bytes, TTL {WORKSPACE_TTL_SECONDS}s in {WORKSPACE_DIR}")
+
+
+def register_cleanup(hook: Callable[[], None]) -> None:
+    """Run hook() on every janitor pass, e.g. to expire finished jobs."""
+    _cleanup_hooks.append(hook)
+
+
+def exclude_from_quota(path: str) -> None:
+    """Leave a directory with its own limits (e.g. JOBS_DIR) out of the usage scans, if it is under WORKSPACE_DIR."""
+    path = os.path.realpath(path)
+    root = os.path.realpath(WORKSPACE_DIR)
+    if os.path.commonpath([path, root]) == root and path != root:
+        _excluded_dirs.append(path)
+
+
+async def acquire(upload_bytes: int = 0) -> Workspace:
+    """
+    Create a workspace once there is room for the request.
+
+    Args:
+        upload_bytes: Size of the request body; RESERVE_FACTOR times this is reserved
+
+    Returns:
+        The new Workspace
+
+    Raises:
+        WorkspaceFullError: The quota stayed exhausted for WORKSPACE_ADMIT_TIMEOUT seconds
+    """
+    reserve = max(0, upload_bytes) * RESERVE_FACTOR
+    await wait_for_space(reserve)
+
+    workspace_id = uuid.uuid4().hex
+    path = os.path.join(WORKSPACE_DIR, _WORK_SUBDIR, workspace_id)
+    os.makedirs(path)
+    workspace = Workspace(workspace_id, path, reserve)
+    with _lock:
+        _workspaces[workspace_id] = workspace
+        _stats["admitted"] += 1
+    return workspace
+
+
+async def wait_for_space(needed_bytes: int) -> None:
+    """Wait until needed_bytes fit in the quota, evicting old released workspaces if that helps."""
+    if needed_bytes > WORKSPACE_QUOTA_BYTES:
+        with _lock:
+            _stats["rejected"] += 1
+        raise WorkspaceFullError("Request is larger than the server's temporary storage")
+
+    deadline = time.monotonic() + WORKSPACE_ADMIT_TIMEOUT
+    waited = False
+    while True:
+        with _lock:
+            fits = _usage_locked() + needed_bytes <= WORKSPACE_QUOTA_BYTES
+            victims = [] if fits else _collect_evictions_locked(needed_bytes)
+        for workspace in victims:
+            _remove(workspace, reason="evicted")
+        if fits or victims:
+            with _lock:
+                if _usage_locked() + needed_bytes <= WORKSPACE_QUOTA_BYTES:
+                    if waited:
+                        _stats["waited"] += 1
+                    return
+
+        if time.monotonic() >= deadline:
+            with _lock:
+                _stats["rejected"] += 1
+            raise WorkspaceFullError("Server is busy, temporary storage is full. Please retry shortly.")
+        waited = True
+        await asyncio.sleep(0.25)
+
+
+def release(workspace: Workspace) -> None:
+    """Mark the request as finished; the workspace is deleted WORKSPACE_TTL seconds later."""
+    global _scanned_bytes
+    size = _dir_size(workspace.path)
+    with _lock:
+        if workspace.released_at is not None:
+            return
+        workspace.released_at = time.time()
+        workspace.size_bytes = size
+        _scanned_bytes += size
+        # Keep released workspaces in release order for TTL and eviction scans
+        if workspace.id in _workspaces:
+            _workspaces.move_to_end(workspace.id)
+
+
+def sweep() -> int:
+    """Remove expired workspaces, run cleanup hooks and re-measure usage. Returns workspaces removed."""
+    global _scanned_bytes
+    cutoff = time.time() - WORKSPACE_TTL_SECONDS
+    with _lock:
+        expired = [w for w in _workspaces.values() if w.released_at is not None and w.released_at < cutoff]
+    for workspace in expired:
+        _remove(workspace, reason="expired")
+
+    for hook in list(_cleanup_hooks):
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"Workspace cleanup hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+    size = _dir_size(WORKSPACE_DIR, skip=_excluded_dirs)
+    with _lock:
+        _scanned_bytes = size
+    if expired:
+        logger.info(f"Workspace janitor removed {len(expired)} expired workspace(s)")
+    return len(expired)
+
+
+def stats() -> Dict[str, Any]:
+    """Current temp usage and admission counters."""
+    with _lock:
+        active = sum(1 for w in _workspaces.values() if w.released_at is None)
+        return {
+            **_stats,
+            "used_bytes": _scanned_bytes,
+            "reserved_bytes": sum(w.reserved_bytes for w in _workspaces.values() if w.released_at is None),
+            "quota_bytes": WORKSPACE_QUOTA_BYTES,
+            "active": active,
+            "released": len(_workspaces) - active,
+        }
+
+
+# Helper functions
+
+def _usage_locked() -> int:
+    """Measured usage plus reservations of running requests. Caller holds _lock."""
+    reserved = sum(w.reserved_bytes for w in _workspaces.values() if w.released_at is None)
+    return _scanned_bytes + reserved
+
+
+def _collect_evictions_locked(needed_bytes: int) -> List[Workspace]:
+    """Oldest released workspaces past the minimum retention that free enough space. Caller holds _lock."""
+    cutoff = time.time() - WORKSPACE_MIN_RETENTION_SECONDS
+    excess = _usage_locked() + needed_bytes - WORKSPACE_QUOTA_BYTES
+    victims = []
+    for workspace in _workspaces.values():
+        if excess <= 0:
+            break
+        if workspace.released_at is not None and workspace.released_at < cutoff:
+            victims.append(workspace)
+            excess -= workspace.size_bytes
+    return victims
+
+
+def _remove(workspace: Workspace, reason: str) -> None:
+    global _scanned_bytes
+    with _lock:
+        if _workspaces.pop(workspace.id, None) is None:
+            return
+        _scanned_bytes = max(0, _scanned_bytes - workspace.size_bytes)
+        _stats[reason] += 1
+    shutil.rmtree(workspace.path, ignore_errors=True)
+
+
+def _dir_size(path: str, skip: List[str] = ()) -> int:
+    total = 0
+    for root, dirs, files in os.walk(path):
+        if skip:
+            dirs[:] = [d for d in dirs if os.path.realpath(os.path.join(root, d)) not in skip]
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,106 @@
+"""
+Streaming zip archives for multi-file results.
+
+iter_zip() yields the archive in chunks while it reads the input files, so a
+response can start sending immediately, nothing is written to disk and memory
+stays at roughly one read chunk regardless of archive size. Entries are written
+with data descriptors (sizes and CRC after the data), which every unzip tool
+understands. Formats that are already compressed are stored as-is; deflating
+them again costs CPU for no size gain.
+"""
+
+import io
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# Already-compressed formats: stored without recompression
+STORED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".webp", ".gif", ".heic", ".heif", ".avif", ".ico",
+    ".pdf", ".zip", ".gz", ".docx", ".xlsx", ".pptx", ".odt", ".mp3", ".mp4",
+}
+
+# Entries larger than this need zip64 headers, which must be decided before writing
+_ZIP64_LIMIT = zipfile.ZIP64_LIMIT - CHUNK_SIZE
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that hands out what has been written so far."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compression_for(path):
+    """ZIP_STORED for already-compressed formats, ZIP_DEFLATED for everything else."""
+    ext = os.path.splitext(path)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _unique_arcnames(paths):
+    """Archive names from basenames, with " (2)", " (3)", ... added to duplicates."""
+    seen = set()
+    for path in paths:
+        name = os.path.basename(path)
+        stem, ext = os.path.splitext(name)
+        n = 2
+        while name in seen:
+            name = f"{stem} ({n}){ext}"
+            n += 1
+        seen.add(name)
+        yield path, name
+
+
+def iter_zip(paths, chunk_size=CHUNK_SIZE):
+    """
+    Yield a zip archive of the given files chunk by chunk.
+
+    Args:
+        paths: Files to add; archive names are their basenames (made unique)
+        chunk_size: Bytes read from each file at a time
+
+    Yields:
+        bytes of the archive, in order
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for path, arcname in _unique_arcnames(paths):
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compression_for(path)
+            force_zip64 = info.file_size > _ZIP64_LIMIT
+
+            with open(path, "rb") as src, archive.open(info, "w", force_zip64=force_zip64) as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    dst.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+
+            data = buffer.drain()
+            if data:
+                yield data
+
+    data = buffer.drain()
+    if data:
+        yield data
@@ -3,7 +3,11 @@ from PyInstaller.utils.hooks import collect_all
 
 datas = []
 binaries = []
-hiddenimports = ['modules', 'modules.image_tools', 'modules.pdf_tools', 'modules.pdf_editor', 'modules.licensing']
+hiddenimports = ['modules', 'modules.image_tools', 'modules.pdf_tools', 'modules.pdf_editor', 'modules.pdf_sessions', 'modules.result_cache', 'modules.progress', 'modules.lazy_imports', 'modules.metrics', 'modules.tracing', 'modules.model_registry', 'modules.inference', 'modules.superres', 'modules.bg_removal', 'modules.image_metadata', 'modules.ocr', 'modules.ocr_engine', 'modules.ocr_cache', 'modules.ocr_preprocess', 'modules.pipeline', 'modules.disk_lru', 'modules.licensing']
+# Imported through lazy_imports.lazy_module(), which the analysis cannot follow
+hiddenimports += ['fitz', 'pypdf', 'pdfplumber', 'pandas', 'pikepdf', 'pyhanko.sign.fields', 'pillow_heif',
+                  'PIL.Image', 'PIL.ImageChops', 'PIL.ImageDraw', 'PIL.ImageFont', 'PIL.ImageOps',
+                  'PIL.ImageEnhance', 'PIL.ImageFilter']
 tmp_ret = collect_all('pdf2docx')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
 tmp_ret = collect_all('py_pdf_parser')
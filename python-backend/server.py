@@ -1,12 +1,11 @@
 import os
 import shutil
 import tempfile
-import zipfile
 import sys
 from typing import List, Optional
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -19,6 +18,7 @@ if 'modules.image_tools' in sys.modules:
 
 from modules.pdf_tools import handle_pdf_action
 from modules.image_tools import handle_image_action
+from modules import zip_stream, workspace, uploads
 from debug_utils import debug_log
 
 # Rate limiter setup
@@ -27,6 +27,12 @@ app = FastAPI()
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+
+@app.on_event("startup")
+def start_workspace_janitor():
+    # Uploads and outputs go to per-request workspaces that expire after WORKSPACE_TTL
+    workspace.start()
+
 # CORS configuration - allow both production and development origins
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 # Always include production domain
@@ -49,35 +55,51 @@ app.add_middleware(
 
 TEMP_DIR = tempfile.gettempdir()
 
-async def save_upload_file(upload_file: UploadFile) -> str:
+# Per-file upload limit, enforced while the upload is copied
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # Default: 50MB
+
+async def save_upload_file(upload_file: UploadFile, directory: str = TEMP_DIR) -> str:
     try:
-        suffix = os.path.splitext(upload_file.filename)[1]
-        print(f"[UPLOAD] Saving file: {upload_file.filename}, suffix: {suffix}", flush=True)
+        saved = await uploads.save(upload_file, directory, max_bytes=MAX_FILE_SIZE)
+        print(f"[UPLOAD] Saved {upload_file.filename}: {saved.size} bytes, type {saved.mime or 'unknown'}, sha256 {saved.sha256[:12]}", flush=True)
+        return saved.path
+    except uploads.UploadTooLargeError:
+        raise HTTPException(status_code=413, detail=f"File exceeds maximum allowed size ({MAX_FILE_SIZE / 1024 / 1024:.0f}MB)")
+    except Exception as e:
+        print(f"[UPLOAD] Error saving file: {e}", flush=True)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Read the content
-        content = await upload_file.read()
-        print(f"[UPLOAD] Read {len(content)} bytes. First 20 bytes: {content[:20]}", flush=True)
+async def request_workspace(request: Request):
+    """Dependency that gives the request its own temp directory (see modules/workspace.py)."""
+    try:
+        upload_bytes = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        upload_bytes = 0
 
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=TEMP_DIR) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+    try:
+        ws = await workspace.acquire(upload_bytes)
+    except workspace.WorkspaceFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
 
-        # Verify what was written
-        with open(tmp_path, 'rb') as verify:
-            verify_bytes = verify.read(20)
-            print(f"[UPLOAD] Verified temp file. First 20 bytes: {verify_bytes}", flush=True)
+    try:
+        yield ws
+    finally:
+        workspace.release(ws)
 
-        return tmp_path
-    except Exception as e:
-        print(f"[UPLOAD] Error saving file: {e}", flush=True)
-        raise HTTPException(status_code=500, detail=str(e))
+def zip_response(files: List[str], zip_filename: str) -> StreamingResponse:
+    """Stream several result files as one zip archive, built while it is sent."""
+    return StreamingResponse(
+        zip_stream.iter_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{zip_filename}"'}
+    )
 
 @app.post("/api/pdf/{action}")
 @limiter.limit("30/minute")  # 30 requests per minute per IP
 async def pdf_endpoint(
     request: Request,
     action: str,
+    ws: workspace.Workspace = Depends(request_workspace),
     files: List[UploadFile] = File(...),
     output_name: Optional[str] = Form(None),
     output_format: Optional[str] = Form(None),
@@ -105,16 +127,16 @@ async def pdf_endpoint(
 ):
     saved_files = []
     for f in files:
-        saved_files.append(await save_upload_file(f))
+        saved_files.append(await save_upload_file(f, ws.path))
 
     # Save watermark file if present
     saved_watermark_file = None
     if watermark_file:
-        saved_watermark_file = await save_upload_file(watermark_file)
+        saved_watermark_file = await save_upload_file(watermark_file, ws.path)
 
     saved_cert_file = None
     if cert_file:
-        saved_cert_file = await save_upload_file(cert_file)
+        saved_cert_file = await save_upload_file(cert_file, ws.path)
 
     payload = {
         "files": saved_files,
@@ -210,16 +232,7 @@ async def pdf_endpoint(
         else:
              # Create zip
              zip_filename = f"processed_files_{action}.zip"
-             zip_path = os.path.join(TEMP_DIR, zip_filename)
-             with zipfile.ZipFile(zip_path, 'w') as zipf:
-                 for file in processed_files:
-                     zipf.write(file, os.path.basename(file))
-
-             response = FileResponse(
-                 zip_path,
-                 filename=zip_filename,
-                 media_type="application/zip"
-             )
+             response = zip_response(processed_files, zip_filename)
              if warning_header:
                  response.headers["X-Processing-Warning"] = warning_header
              return response
@@ -231,10 +244,6 @@ async def pdf_endpoint(
         traceback.print_exc()
         print(f"Server Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Cleanup temp upload files (processed files might be needed for download)
-        # Ideally we'd have a cron job to clean up processed files later
-        pass
 
 # --- Licensing Endpoints ---
 from modules import licensing
@@ -267,6 +276,7 @@ async def deactivate_license():
 async def image_endpoint(
     request: Request,
     action: str,
+    ws: workspace.Workspace = Depends(request_workspace),
     files: List[UploadFile] = File(...),
     watermark_type: Optional[str] = Form(None),
     text: Optional[str] = Form(None),
@@ -294,12 +304,12 @@ async def image_endpoint(
     print(f"DEBUG: Received crop_box raw: {crop_box}")
     saved_files = []
     for f in files:
-        saved_files.append(await save_upload_file(f))
+        saved_files.append(await save_upload_file(f, ws.path))
 
     # Save watermark file if present
     saved_watermark_file = None
     if watermark_file:
-        saved_watermark_file = await save_upload_file(watermark_file)
+        saved_watermark_file = await save_upload_file(watermark_file, ws.path)
 
     payload = {
         "files": saved_files,
@@ -360,15 +370,7 @@ async def image_endpoint(
              return FileResponse(processed_files[0], filename=os.path.basename(processed_files[0]))
         else:
              zip_filename = f"processed_images_{action}.zip"
-             zip_path = os.path.join(TEMP_DIR, zip_filename)
-             with zipfile.ZipFile(zip_path, 'w') as zipf:
-                 for file in processed_files:
-                     zipf.write(file, os.path.basename(file))
-             return FileResponse(
-                 zip_path, 
-                 filename=zip_filename,
-                 media_type="application/zip"
-             )
+             return zip_response(processed_files, zip_filename)
 
     except HTTPException as he:
         raise he